@@ -1,5 +1,7 @@
 from google.cloud import bigquery
+import hashlib
 import logging
+from typing import Iterator, Sequence, Tuple
 from google.api_core.exceptions import NotFound
 
 logger = logging.getLogger(__name__)
@@ -15,6 +17,37 @@ def get_table_metadata(
     return client.get_table(table_id)
 
 
+def _schema_signature(fields: Sequence[bigquery.SchemaField]) -> str:
+    return ",".join(
+        f"{f.name}:{f.field_type}:{f.mode}"
+        + (f"<{_schema_signature(f.fields)}>" if f.fields else "")
+        for f in fields
+    )
+
+
+def iter_schema_paths(
+    fields: Sequence[bigquery.SchemaField], prefix: str = ""
+) -> Iterator[Tuple[str, bigquery.SchemaField]]:
+    """
+    Recorre el schema en profundidad y produce (ruta, campo) con rutas con
+    puntos para los campos anidados: "cliente", "cliente.direccion", ...
+    """
+    for field in fields:
+        path = f"{prefix}{field.name}"
+        yield path, field
+        if field.fields:
+            yield from iter_schema_paths(field.fields, prefix=f"{path}.")
+
+
+def schema_fingerprint(table: bigquery.Table) -> str:
+    """
+    Hash estable del schema (nombres, tipos y modos, incluyendo RECORD anidados).
+    No incluye descripciones ni modified: escribir descripciones no lo altera.
+    """
+    signature = _schema_signature(table.schema)
+    return hashlib.sha256(signature.encode("utf-8")).hexdigest()[:16]
+
+
 def get_partition_field(table: bigquery.Table) -> str:
     """
     Retorna el campo de partición si existe, o "" si no es particionada.
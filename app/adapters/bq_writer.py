@@ -1,47 +1,105 @@
 from __future__ import annotations
 
 from google.cloud import bigquery
+import json
 import logging
-from typing import Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
 
 logger = logging.getLogger(__name__)
 
 MIN_ACCURACY = 0.7
 
 
-def _clone_field_preserving_all(
-    field: bigquery.SchemaField, *, description: str
-) -> bigquery.SchemaField:
-    d = field.to_api_repr()
-    d["description"] = description
-    return bigquery.SchemaField.from_api_repr(d)
+def _iter_field_reprs(
+    fields: List[Dict[str, Any]], prefix: str = ""
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Recorre la representación API del schema produciendo (ruta con puntos, nodo).
+    Trabaja sobre dicts para no instanciar SchemaField por cada nivel.
+    """
+    for node in fields:
+        path = f"{prefix}{node['name']}"
+        yield path, node
+        children = node.get("fields")
+        if children:
+            yield from _iter_field_reprs(children, prefix=f"{path}.")
 
 
-def update_table_schema(metadata: Dict[str, Any], client: bigquery.Client) -> None:
-    table_fqn = (metadata.get("table_fqn") or "").strip()
-    if not table_fqn:
-        raise ValueError(
-            "metadata['table_fqn'] es requerido (ej: 'proyecto.dataset.tabla')."
-        )
+def _with_descriptions(
+    node: Dict[str, Any],
+    path: str,
+    changes: Dict[str, str],
+    touched: Set[str],
+) -> Dict[str, Any]:
+    """
+    Copia superficial de node con las descripciones nuevas. Solo se desciende
+    (y se copia) en los hijos cuya ruta está en touched; el resto del subárbol
+    se reutiliza tal cual, preservando todos sus atributos.
+    """
+    new_node = dict(node)
+    if path in changes:
+        new_node["description"] = changes[path]
 
-    logger.info("Actualizando descripciones para: %s", table_fqn)
+    children = node.get("fields")
+    if children:
+        new_children = []
+        for child in children:
+            child_path = f"{path}.{child['name']}"
+            if child_path in touched:
+                child = _with_descriptions(child, child_path, changes, touched)
+            new_children.append(child)
+        new_node["fields"] = new_children
 
-    table = client.get_table(table_fqn)
+    return new_node
 
+
+def _apply_description_changes(
+    schema: List[bigquery.SchemaField], changes: Dict[str, str]
+) -> List[bigquery.SchemaField]:
+    """
+    Construye el schema nuevo en una sola pasada. changes usa rutas con
+    puntos; solo se clonan los campos cambiados y sus ancestros.
+    """
+    touched: Set[str] = set()
+    for path in changes:
+        parts = path.split(".")
+        touched.update(".".join(parts[: i + 1]) for i in range(len(parts)))
+
+    return [
+        bigquery.SchemaField.from_api_repr(
+            _with_descriptions(field.to_api_repr(), field.name, changes, touched)
+        )
+        if field.name in touched
+        else field
+        for field in schema
+    ]
+
+
+def _collect_description_changes(
+    metadata: Dict[str, Any], table: bigquery.Table
+) -> Tuple[Optional[str], Dict[str, str]]:
+    """
+    Compara el metadata generado contra la tabla actual.
+    Retorna (nueva descripción de tabla o None si no cambia,
+    {ruta: nueva descripción} solo para las columnas que cambian).
+    Las columnas anidadas se identifican por ruta con puntos ("cliente.dni").
+    """
     new_table_description = (
         (metadata.get("table_description") or {}).get("description") or ""
     ).strip()
     current_table_description = (table.description or "").strip()
-    table_desc_changed = current_table_description != new_table_description
-    print(table_desc_changed)
 
-    if table_desc_changed:
+    table_change = None
+    if current_table_description != new_table_description:
         logger.info(
             "Tabla: description cambia (len %s -> %s)",
             len(current_table_description),
             len(new_table_description),
         )
-        table.description = new_table_description
+        table_change = new_table_description
 
     columns = metadata.get("columns") or []
     if not isinstance(columns, list):
@@ -68,31 +126,241 @@ def update_table_schema(metadata: Dict[str, Any], client: bigquery.Client) -> No
                 MIN_ACCURACY,
             )
 
-    new_schema: List[bigquery.SchemaField] = []
-    schema_changed = False
+    column_changes: Dict[str, str] = {}
+    schema_repr = [field.to_api_repr() for field in table.schema]
+    for path, node in _iter_field_reprs(schema_repr):
+        if path not in col_descriptions:
+            continue
+
+        new_desc = col_descriptions[path]
+        old_desc = (node.get("description") or "").strip()
 
-    for field in table.schema:
-        if field.field_type != "RECORD" and field.name in col_descriptions:
-            new_desc = col_descriptions[field.name]
-            old_desc = (field.description or "").strip()
+        if old_desc != new_desc:
+            logger.info("Columna '%s': description cambia", path)
+            column_changes[path] = new_desc
 
-            if old_desc != new_desc:
-                logger.info("Columna '%s': description cambia", field.name)
-                field = _clone_field_preserving_all(field, description=new_desc)
-                schema_changed = True
+    return table_change, column_changes
 
-        new_schema.append(field)
 
-    if not schema_changed and not table_desc_changed:
+def _table_fqn_of(metadata: Dict[str, Any]) -> str:
+    table_fqn = (metadata.get("table_fqn") or "").strip()
+    if not table_fqn:
+        raise ValueError(
+            "metadata['table_fqn'] es requerido (ej: 'proyecto.dataset.tabla')."
+        )
+    return table_fqn
+
+
+def update_table_schema(metadata: Dict[str, Any], client: bigquery.Client) -> None:
+    table_fqn = _table_fqn_of(metadata)
+
+    logger.info("Actualizando descripciones para: %s", table_fqn)
+
+    table = client.get_table(table_fqn)
+
+    table_change, column_changes = _collect_description_changes(metadata, table)
+
+    if not column_changes and table_change is None:
         logger.info("Sin cambios detectados para: %s", table_fqn)
         return
 
     update_fields: List[str] = []
-    if schema_changed:
-        table.schema = new_schema
+    if column_changes:
+        table.schema = _apply_description_changes(table.schema, column_changes)
         update_fields.append("schema")
-    if table_desc_changed:
+    if table_change is not None:
+        table.description = table_change
         update_fields.append("description")
 
     client.update_table(table, update_fields)
     logger.info("Descripciones actualizadas correctamente para: %s", table_fqn)
+
+
+def _sql_string(value: str) -> str:
+    # Los escapes de un string JSON (\", \\, \n, \uXXXX) son válidos en BigQuery
+    return json.dumps(value, ensure_ascii=False)
+
+
+@dataclass
+class _PendingWrite:
+    metadata: Dict[str, Any]
+    table: bigquery.Table
+    table_change: Optional[str]
+    column_changes: Dict[str, str]
+
+    @property
+    def statement(self) -> Optional[str]:
+        """ALTER de la descripción de tabla; None si hay cambios de columnas."""
+        if self.column_changes:
+            return None
+        return (
+            f"ALTER TABLE `{_table_fqn_of(self.metadata)}` "
+            f"SET OPTIONS (description = {_sql_string(self.table_change)});"
+        )
+
+
+class BatchedSchemaWriter:
+    """
+    Acumula cambios de descripción de muchas tablas y los aplica en el flush
+    con una sola actualización de metadata por tabla (BigQuery admite unas
+    5 cada 10 s por tabla: un ALTER COLUMN por columna las agotaría):
+
+    - solo descripción de tabla: un ALTER TABLE ... SET OPTIONS por tabla,
+      agrupados en un script multi-statement por dataset
+    - con cambios de columnas (incluidas las anidadas): un update_table con
+      el schema completo sobre la tabla que ya leyó process_table (sin
+      get_table), en paralelo entre tablas
+
+    Si un script o un update falla, sus tablas se reescriben una a una con
+    update_table_schema (idempotente: relee la tabla y solo aplica lo que
+    siga distinto).
+    """
+
+    # BigQuery limita el texto de una query a 1MB
+    _MAX_SCRIPT_BYTES = 900_000
+    # update_table concurrentes (cada uno sobre una tabla distinta)
+    _UPDATE_WORKERS = 8
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        # (project, dataset) -> {table_fqn: _PendingWrite}
+        self._pending: Dict[Tuple[str, str], Dict[str, _PendingWrite]] = {}
+        self._clients: Dict[Tuple[str, str], bigquery.Client] = {}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(tables) for tables in self._pending.values())
+
+    def add(
+        self,
+        metadata: Dict[str, Any],
+        table: bigquery.Table,
+        client: bigquery.Client,
+    ) -> bool:
+        """
+        Encola los cambios de una tabla ya leída. Retorna False si no hay
+        nada que escribir (la tabla queda completa sin esperar al flush).
+        """
+        table_fqn = _table_fqn_of(metadata)
+        table_change, column_changes = _collect_description_changes(metadata, table)
+
+        if not column_changes and table_change is None:
+            logger.info("Sin cambios detectados para: %s", table_fqn)
+            return False
+
+        key = (table.project, table.dataset_id)
+        with self._lock:
+            self._pending.setdefault(key, {})[table_fqn] = _PendingWrite(
+                metadata, table, table_change, column_changes
+            )
+            self._clients[key] = client
+
+        return True
+
+    def flush(self) -> Dict[str, Optional[Exception]]:
+        """
+        Aplica lo acumulado. Retorna {table_fqn: None si OK | excepción}.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            clients = dict(self._clients)
+
+        outcomes: Dict[str, Optional[Exception]] = {}
+        updates = []
+
+        for key, tables in pending.items():
+            client = clients[key]
+
+            scripted = {}
+            for fqn, write in tables.items():
+                if write.statement is None:
+                    updates.append((fqn, write, client))
+                else:
+                    scripted[fqn] = write.statement
+
+            for chunk in self._split_scripts(scripted):
+                script = "\n".join(scripted[fqn] for fqn in chunk)
+                try:
+                    client.query(script).result()
+                    outcomes.update({fqn: None for fqn in chunk})
+                    logger.info(
+                        "Script de descripciones aplicado: %s.%s (%s tablas)",
+                        key[0],
+                        key[1],
+                        len(chunk),
+                    )
+                except Exception as exc:
+                    logger.warning(
+                        "Script de descripciones falló en %s.%s: %s. "
+                        "Reintentando tabla por tabla.",
+                        key[0],
+                        key[1],
+                        exc,
+                    )
+                    for fqn in chunk:
+                        outcomes[fqn] = self._write_single(tables[fqn].metadata, client)
+
+        if updates:
+            with ThreadPoolExecutor(
+                max_workers=min(self._UPDATE_WORKERS, len(updates))
+            ) as pool:
+                futures = {
+                    fqn: pool.submit(self._update_schema, write, client)
+                    for fqn, write, client in updates
+                }
+                outcomes.update({fqn: f.result() for fqn, f in futures.items()})
+
+        return outcomes
+
+    @classmethod
+    def _update_schema(
+        cls, write: _PendingWrite, client: bigquery.Client
+    ) -> Optional[Exception]:
+        """Un solo update_table con todas las descripciones de la tabla."""
+        # copia: la tabla de process_table no se modifica
+        table = bigquery.Table.from_api_repr(write.table.to_api_repr())
+        table.schema = _apply_description_changes(table.schema, write.column_changes)
+        update_fields = ["schema"]
+        if write.table_change is not None:
+            table.description = write.table_change
+            update_fields.append("description")
+        try:
+            # el etag de la lectura evita pisar un cambio de schema concurrente
+            client.update_table(table, update_fields)
+            return None
+        except Exception as exc:
+            logger.warning(
+                "update_table falló para %s: %s. Reintentando con la tabla releída.",
+                table.full_table_id,
+                exc,
+            )
+            return cls._write_single(write.metadata, client)
+
+    @staticmethod
+    def _write_single(
+        metadata: Dict[str, Any], client: bigquery.Client
+    ) -> Optional[Exception]:
+        try:
+            update_table_schema(metadata, client)
+            return None
+        except Exception as exc:
+            return exc
+
+    def _split_scripts(self, statements: Dict[str, str]) -> List[List[str]]:
+        chunks: List[List[str]] = []
+        current: List[str] = []
+        current_size = 0
+
+        for fqn, statement in statements.items():
+            size = len(statement.encode("utf-8")) + 1
+            if current and current_size + size > self._MAX_SCRIPT_BYTES:
+                chunks.append(current)
+                current = []
+                current_size = 0
+            current.append(fqn)
+            current_size += size
+
+        if current:
+            chunks.append(current)
+
+        return chunks
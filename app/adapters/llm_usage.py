@@ -0,0 +1,175 @@
+"""
+Consumo de tokens de las llamadas a Vertex AI.
+
+LlmUsage acumula, por tabla, los intentos de generate_metadata con sus
+tokens (usage_metadata), región, modelo, número de intento y latencia; el
+resumen va al tracker (columna llm_usage, JSON). TokenRateLimiter usa los
+mismos conteos para no pasarse del TPM del modelo: reserva una estimación
+antes de cada intento y la corrige con lo que reportó la respuesta.
+"""
+
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from app.errors import DeadlineExceededError
+
+# USD por millón de tokens (entrada, entrada cacheada, salida + thinking);
+# tarifa estándar hasta 200k tokens de prompt. Modelos sin precio: costo 0.
+MODEL_PRICES_USD_PER_M = {
+    "gemini-2.5-pro": (1.25, 0.125, 10.0),
+    "gemini-2.5-flash": (0.30, 0.03, 2.50),
+}
+
+# TPM por modelo para esta task (0 = sin límite). La cuota de Vertex es por
+# proyecto y región: repartirla entre las tasks que corren en paralelo.
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "0"))
+
+# Estimación previa a la respuesta: ~4 caracteres por token en el prompt
+CHARS_PER_TOKEN = 4
+# salida + thinking esperada antes de observar respuestas del modelo
+DEFAULT_OUTPUT_TOKENS = 4096
+_OUTPUT_EWMA_ALPHA = 0.2
+
+TOKEN_FIELDS = ("input_tokens", "cached_tokens", "output_tokens", "thinking_tokens")
+
+
+def usage_tokens(usage_metadata) -> Dict[str, int]:
+    """Tokens de response.usage_metadata (campos ausentes cuentan 0)."""
+    return {
+        "input_tokens": getattr(usage_metadata, "prompt_token_count", None) or 0,
+        "cached_tokens": getattr(usage_metadata, "cached_content_token_count", None)
+        or 0,
+        "output_tokens": getattr(usage_metadata, "candidates_token_count", None) or 0,
+        "thinking_tokens": getattr(usage_metadata, "thoughts_token_count", None) or 0,
+    }
+
+
+def estimate_cost_usd(model: str, tokens: Dict[str, int]) -> float:
+    prices = MODEL_PRICES_USD_PER_M.get(model)
+    if prices is None:
+        return 0.0
+    input_price, cached_price, output_price = prices
+    cached = tokens.get("cached_tokens", 0)
+    # los tokens cacheados son parte de prompt_token_count
+    fresh = max(tokens.get("input_tokens", 0) - cached, 0)
+    generated = tokens.get("output_tokens", 0) + tokens.get("thinking_tokens", 0)
+    return (
+        fresh * input_price + cached * cached_price + generated * output_price
+    ) / 1_000_000
+
+
+class LlmUsage:
+    """Intentos de LLM de una tabla (un worker: sin locks)."""
+
+    def __init__(self):
+        self.calls: List[dict] = []
+
+    def record(
+        self,
+        model: str,
+        region: str,
+        attempt: int,
+        latency_ms: int,
+        tokens: Optional[Dict[str, int]] = None,
+        outcome: str = "OK",
+    ) -> None:
+        self.calls.append(
+            {
+                "model": model,
+                "region": region,
+                "attempt": attempt,
+                "latency_ms": int(latency_ms),
+                **{field: (tokens or {}).get(field, 0) for field in TOKEN_FIELDS},
+                "outcome": outcome,
+            }
+        )
+
+    def summary(self) -> Optional[dict]:
+        """Totales de la tabla y detalle por intento; None si no hubo llamadas."""
+        if not self.calls:
+            return None
+        totals = {
+            field: sum(call[field] for call in self.calls) for field in TOKEN_FIELDS
+        }
+        cost = sum(estimate_cost_usd(call["model"], call) for call in self.calls)
+        return {
+            "attempts": len(self.calls),
+            **totals,
+            "latency_ms": sum(call["latency_ms"] for call in self.calls),
+            "cost_usd": round(cost, 6),
+            "calls": self.calls,
+        }
+
+
+class TokenRateLimiter:
+    """
+    Ventana deslizante de 60s por modelo. acquire reserva la estimación del
+    intento (prompt + salida esperada) y espera si no entra en el TPM;
+    settle reemplaza la reserva por los tokens que reportó la respuesta.
+    """
+
+    WINDOW_SEC = 60.0
+
+    def __init__(self, tpm_limit: int, clock=time):
+        self.tpm_limit = tpm_limit
+        self._clock = clock
+        self._lock = threading.Lock()
+        # modelo -> [[instante, tokens], ...]
+        self._window: Dict[str, List[list]] = {}
+        self._expected_output: Dict[str, float] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.tpm_limit > 0
+
+    def estimate(self, model: str, prompt: str) -> int:
+        expected = self._expected_output.get(model, DEFAULT_OUTPUT_TOKENS)
+        return math.ceil(len(prompt) / CHARS_PER_TOKEN + expected)
+
+    def _used(self, model: str, now: float) -> int:
+        entries = self._window.setdefault(model, [])
+        while entries and entries[0][0] <= now - self.WINDOW_SEC:
+            entries.pop(0)
+        return sum(tokens for _, tokens in entries)
+
+    def acquire(self, model: str, tokens: int, deadline: Optional[float] = None):
+        """
+        Espera hasta que los tokens entren en la ventana y los reserva.
+        Retorna la reserva (para settle). Un intento que pide más que el TPM
+        completo pasa solo, con la ventana vacía. Lanza DeadlineExceededError
+        si la espera supera el deadline (epoch en segundos).
+        """
+        if not self.enabled:
+            return None
+        tokens = min(tokens, self.tpm_limit)
+        while True:
+            with self._lock:
+                now = self._clock.monotonic()
+                entries = self._window.setdefault(model, [])
+                if self._used(model, now) + tokens <= self.tpm_limit:
+                    entry = [now, tokens]
+                    entries.append(entry)
+                    return entry
+                # la reserva más antigua libera espacio al salir de la ventana
+                wait = entries[0][0] + self.WINDOW_SEC - now
+
+            if deadline is not None and self._clock.time() + wait >= deadline:
+                raise DeadlineExceededError(
+                    f"LLM cutoff: el TPM de {model} no libera {tokens} tokens "
+                    f"antes del deadline"
+                )
+            self._clock.sleep(max(wait, 0.05))
+
+    def settle(self, model: str, reservation, tokens: Dict[str, int]) -> None:
+        """Corrige la reserva con el consumo real (entrada + salida + thinking)."""
+        generated = tokens["output_tokens"] + tokens["thinking_tokens"]
+        with self._lock:
+            if reservation is not None:
+                reservation[1] = tokens["input_tokens"] + generated
+            previous = self._expected_output.get(model, DEFAULT_OUTPUT_TOKENS)
+            self._expected_output[model] = (
+                previous + _OUTPUT_EWMA_ALPHA * (generated - previous)
+            )
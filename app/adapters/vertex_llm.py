@@ -1,84 +1,285 @@
 import json
+import os
 import time
 import logging
 import itertools
+from collections import Counter
 from datetime import datetime, timezone
+from threading import Lock
+from typing import Any, Dict, Optional
+
 from google import genai
 from google.genai import types
 
+from app.errors import (
+    PERMANENT,
+    RATE_LIMIT,
+    VALIDATION,
+    DeadlineExceededError,
+    MetadataValidationError,
+    PermanentError,
+    RateLimitError,
+    TransientError,
+    classify_error,
+)
+from app.adapters.llm_usage import (
+    LLM_TPM_LIMIT,
+    TOKEN_FIELDS,
+    LlmUsage,
+    TokenRateLimiter,
+    estimate_cost_usd,
+    usage_tokens,
+)
+from app.validators.metadata_schema import RESPONSE_SCHEMA
+
 logger = logging.getLogger(__name__)
 
 MODEL_NAME = "gemini-2.5-pro"
 
+# Parámetros de generación compartidos por las llamadas online y batch
+TEMPERATURE = 0.4
+TOP_P = 0.85
+RESPONSE_MIME_TYPE = "application/json"
+
+# response_schema restringe la decodificación al contrato METADATA_SCHEMA
+USE_RESPONSE_SCHEMA = os.getenv("LLM_RESPONSE_SCHEMA", "true").strip().lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# Tokens de thinking (-1 dinámico, 0 apagado). Sin definir: default del modelo.
+# Los modelos pro no admiten apagarlo: el mínimo es 128.
+THINKING_BUDGET = os.getenv("THINKING_BUDGET")
+_PRO_MIN_THINKING_BUDGET = 128
+
+# Tiempo mínimo restante para que valga la pena lanzar un intento
+MIN_ATTEMPT_SEC = 30
+
 REGIONS = [
     "us-central1",
     "us-east1",
     "us-west1",
 ]
 
-CLIENTS = {region: genai.Client(vertexai=True, location=region) for region in REGIONS}
+# Los clientes se crean al primer uso: importar el módulo no requiere credenciales
+CLIENTS: Dict[str, genai.Client] = {}
+_clients_lock = Lock()
 
 region_cycle = itertools.cycle(REGIONS)
 
+# TPM por modelo, compartido por los workers del proceso
+token_limiter = TokenRateLimiter(LLM_TPM_LIMIT)
+
+# Contadores del proceso: generaciones desperdiciadas por JSON o contrato roto
+_stats: Counter = Counter()
+_stats_lock = Lock()
+
+
+def record_llm_event(name: str, count: int = 1) -> None:
+    with _stats_lock:
+        _stats[name] += count
+
+
+def llm_stats() -> Dict[str, int]:
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _thinking_budget(model: str) -> Optional[int]:
+    if THINKING_BUDGET is None or not THINKING_BUDGET.strip():
+        return None
+    budget = int(THINKING_BUDGET)
+    if "pro" in model and 0 <= budget < _PRO_MIN_THINKING_BUDGET:
+        return _PRO_MIN_THINKING_BUDGET
+    return budget
+
+
+def generation_config(
+    model: str = MODEL_NAME, response_schema: Optional[dict] = None
+) -> dict:
+    """
+    Parámetros de generación en formato REST: sirven tanto para
+    GenerateContentConfig como para las líneas de un batch prediction.
+    response_schema None usa el del contrato (RESPONSE_SCHEMA).
+    """
+    config = {
+        "temperature": TEMPERATURE,
+        "topP": TOP_P,
+        "responseMimeType": RESPONSE_MIME_TYPE,
+    }
+    if USE_RESPONSE_SCHEMA:
+        config["responseSchema"] = response_schema or RESPONSE_SCHEMA
+
+    budget = _thinking_budget(model)
+    if budget is not None:
+        config["thinkingConfig"] = {"thinkingBudget": budget}
+
+    return config
+
 
 def get_next_region():
     return next(region_cycle)
 
 
-def generate_metadata(prompt: str, retries: int = 3) -> dict:
+def get_client(region: str) -> genai.Client:
+    client = CLIENTS.get(region)
+    if client is None:
+        with _clients_lock:
+            client = CLIENTS.get(region)
+            if client is None:
+                client = genai.Client(vertexai=True, location=region)
+                CLIENTS[region] = client
+    return client
+
+
+def stamp_metadata(data: dict, model: str = MODEL_NAME) -> dict:
+    """
+    Añade al payload del modelo los campos model y generated_at del contrato.
+    """
+    data["model"] = {
+        "name": "manage-metadata-gemini",
+        "version": model,
+    }
+
+    data["generated_at"] = datetime.now(timezone.utc).strftime(
+        "%Y-%m-%dT%H:%M:%SZ"
+    )
+
+    return data
+
+
+def generate_metadata(
+    prompt: str,
+    retries: int = 3,
+    deadline: Optional[float] = None,
+    model: str = MODEL_NAME,
+    wire_format: Optional[Any] = None,
+    usage: Optional[LlmUsage] = None,
+) -> dict:
+    """
+    deadline (epoch en segundos) corta la llamada: cada intento recibe como
+    timeout HTTP el tiempo restante y no se lanzan intentos sin margen.
+
+    wire_format (app.services.wire_format.CompactFormat) pide la salida
+    compacta y la expande al contrato antes de retornar.
+
+    usage acumula tokens, región, modelo y latencia de cada intento (los
+    contadores del proceso se actualizan siempre).
+    """
+    response_schema = wire_format.response_schema if wire_format else None
     last_error = None
+    last_type = None
+    record_llm_event("calls")
 
     for attempt in range(retries + 1):
+        http_options = None
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining < MIN_ATTEMPT_SEC:
+                raise DeadlineExceededError(
+                    f"LLM cutoff: {remaining:.0f}s restantes antes del intento "
+                    f"{attempt + 1} (último error: {last_error})"
+                )
+            http_options = types.HttpOptions(timeout=int(remaining * 1000))
+
         region = get_next_region()
-        client = CLIENTS[region]
+        client = get_client(region)
+        # sin respuesta la reserva queda con la estimación: cuenta como backoff
+        reservation = token_limiter.acquire(
+            model, token_limiter.estimate(model, prompt), deadline
+        )
+        attempt_start = time.monotonic()
+        tokens = None
 
         try:
-            logger.info(f"[LLM] Attempt {attempt + 1} using region: {region}")
+            logger.info(
+                f"[LLM] Attempt {attempt + 1} using region: {region} | model={model}"
+            )
+            record_llm_event("attempts")
 
             response = client.models.generate_content(
-                model=MODEL_NAME,
+                model=model,
                 contents=prompt,
                 config=types.GenerateContentConfig(
-                    temperature=0.4,
-                    response_mime_type="application/json",
-                    top_p=0.85,
+                    **generation_config(model, response_schema),
+                    http_options=http_options,
                 ),
             )
+            latency_ms = int((time.monotonic() - attempt_start) * 1000)
+
+            tokens = usage_tokens(response.usage_metadata)
+            token_limiter.settle(model, reservation, tokens)
+            for field in TOKEN_FIELDS:
+                if tokens[field]:
+                    record_llm_event(field, tokens[field])
+            record_llm_event(
+                "cost_micro_usd", round(estimate_cost_usd(model, tokens) * 1_000_000)
+            )
+            logger.info(
+                f"[LLM] region={region} model={model} attempt={attempt + 1} "
+                f"latency_ms={latency_ms} | "
+                + " | ".join(f"{field}={tokens[field]}" for field in TOKEN_FIELDS)
+            )
 
             raw_text = response.text.strip()
             data = json.loads(raw_text)
+            if wire_format is not None:
+                data = wire_format.expand(data)
 
-            data["model"] = {
-                "name": "manage-metadata-gemini",
-                "version": MODEL_NAME,
-            }
-
-            data["generated_at"] = datetime.now(timezone.utc).strftime(
-                "%Y-%m-%dT%H:%M:%SZ"
-            )
-
-            return data
+            if usage is not None:
+                usage.record(model, region, attempt + 1, latency_ms, tokens)
+            return stamp_metadata(data, model)
 
         except Exception as e:
             last_error = str(e)
-
-            is_rate_limit = (
-                "429" in last_error
-                or "ResourceExhausted" in last_error
-                or "quota" in last_error.lower()
-            )
+            last_type = classify_error(e)
+            if last_type == VALIDATION:
+                record_llm_event("parse_errors")
+            if usage is not None:
+                # un JSON ilegible también consumió tokens
+                usage.record(
+                    model,
+                    region,
+                    attempt + 1,
+                    (time.monotonic() - attempt_start) * 1000,
+                    tokens,
+                    outcome=last_type,
+                )
 
             logger.warning(
                 f"[LLM ERROR] region={region} attempt={attempt + 1} "
-                f"type={'RATE_LIMIT' if is_rate_limit else 'OTHER'} "
-                f"error={last_error}"
+                f"type={last_type} error={last_error}"
             )
 
-            if is_rate_limit:
+            # request inválido o prompt demasiado largo: otra región no lo arregla
+            if last_type == PERMANENT:
+                raise PermanentError(f"LLM rechazó el request: {last_error}") from e
+
+            if last_type == RATE_LIMIT:
                 wait = 2 * (attempt + 1)
             else:
                 wait = 1
 
             time.sleep(wait)
 
-    raise RuntimeError(f"LLM failed after {retries + 1} attempts: {last_error}")
+    message = f"LLM failed after {retries + 1} attempts: {last_error}"
+    if last_type == RATE_LIMIT:
+        raise RateLimitError(message)
+    if last_type == VALIDATION:
+        raise MetadataValidationError(message)
+    raise TransientError(message)
+
+
+def submit_batch_job(src_uri: str, dest_uri: str, region: Optional[str] = None) -> str:
+    """
+    Lanza un batch prediction de Vertex AI sobre un JSONL de requests en GCS.
+    Retorna el nombre del batch job; los resultados quedan bajo dest_uri.
+    """
+    client = get_client(region or REGIONS[0])
+    batch_job = client.batches.create(
+        model=MODEL_NAME,
+        src=src_uri,
+        config=types.CreateBatchJobConfig(dest=dest_uri),
+    )
+    logger.info(f"[LLM] Batch job creado: {batch_job.name} | src={src_uri}")
+    return batch_job.name
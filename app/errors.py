@@ -0,0 +1,110 @@
+import json
+
+from google.api_core import exceptions as api_exceptions
+from google.genai import errors as genai_errors
+
+# Tipos de error persistidos en el tracker (columna error_type)
+TRANSIENT = "TRANSIENT"
+RATE_LIMIT = "RATE_LIMIT"
+PERMANENT = "PERMANENT"
+VALIDATION = "VALIDATION"
+DEADLINE = "DEADLINE"
+
+# Solo para excepciones sin tipo (RuntimeError de librerías, reintentos
+# envueltos): en las tipadas manda la clase o el código, no el mensaje
+_RATE_LIMIT_MARKERS = (
+    "resource_exhausted",
+    "resourceexhausted",
+    "ratelimitexceeded",
+    "quotaexceeded",
+)
+# reason estructurado de BigQuery: los 403 de cuota llegan como Forbidden
+_RATE_LIMIT_REASONS = {"rateLimitExceeded", "quotaExceeded"}
+
+
+class DeadlineExceededError(Exception):
+    """
+    La task no tiene tiempo suficiente para completar la etapa.
+    No es un fallo de la tabla: la fila vuelve al backlog sin penalización.
+    """
+
+
+class ProcessingError(Exception):
+    error_type = TRANSIENT
+
+
+class TransientError(ProcessingError):
+    """Fallo pasajero (red, 5xx, timeouts): se reintenta con back-off."""
+
+    error_type = TRANSIENT
+
+
+class RateLimitError(TransientError):
+    """Cuota o 429: se reintenta con back-off."""
+
+    error_type = RATE_LIMIT
+
+
+class PermanentError(ProcessingError):
+    """La tabla no puede procesarse (NotFound, permisos, request inválido)."""
+
+    error_type = PERMANENT
+
+
+class MetadataValidationError(ProcessingError):
+    """El payload generado no cumple el contrato METADATA_SCHEMA."""
+
+    error_type = VALIDATION
+
+
+def classify_error(exc: BaseException) -> str:
+    """
+    Clasifica una excepción en TRANSIENT, RATE_LIMIT, PERMANENT, VALIDATION
+    o DEADLINE. Lo no reconocido se trata como TRANSIENT.
+    """
+    if isinstance(exc, DeadlineExceededError):
+        return DEADLINE
+    if isinstance(exc, ProcessingError):
+        return exc.error_type
+
+    if isinstance(exc, (api_exceptions.TooManyRequests, api_exceptions.ResourceExhausted)):
+        return RATE_LIMIT
+    if isinstance(exc, api_exceptions.GoogleAPICallError):
+        reasons = {
+            error.get("reason")
+            for error in (exc.errors or [])
+            if isinstance(error, dict)
+        }
+        if reasons & _RATE_LIMIT_REASONS:
+            return RATE_LIMIT
+
+    if isinstance(exc, genai_errors.APIError):
+        if exc.code == 429:
+            return RATE_LIMIT
+        if isinstance(exc, genai_errors.ClientError):
+            return PERMANENT
+        return TRANSIENT
+
+    if isinstance(
+        exc,
+        (
+            api_exceptions.NotFound,
+            api_exceptions.Forbidden,
+            api_exceptions.PermissionDenied,
+            api_exceptions.Unauthorized,
+            api_exceptions.BadRequest,
+            api_exceptions.InvalidArgument,
+        ),
+    ):
+        return PERMANENT
+
+    if isinstance(exc, json.JSONDecodeError):
+        return VALIDATION
+
+    if not isinstance(exc, api_exceptions.GoogleAPICallError):
+        message = str(exc).lower()
+        if any(marker in message for marker in _RATE_LIMIT_MARKERS):
+            return RATE_LIMIT
+
+    # ServerError, RetryError, timeouts y errores de red
+    return TRANSIENT
@@ -0,0 +1,173 @@
+"""
+API de generación de metadata para una tabla (uvicorn app.main:app).
+
+Usa el mismo pipeline que el job (job.processor.process_table) a través de
+GenerationService: pedidos concurrentes de la misma tabla comparten una
+generación y los resultados se cachean por fingerprint de schema. POST /bulk
+genera un dataset completo (o una lista de FQNs) y transmite el avance como
+NDJSON o, con Accept: text/event-stream, como SSE.
+"""
+
+import json
+import logging
+import sys
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from google.api_core import exceptions as api_exceptions
+
+from app.errors import DEADLINE, PERMANENT, RATE_LIMIT, VALIDATION, classify_error
+from app.models import BulkGenerationRequest, TableGenerationResponse
+from app.services.bulk_generation import (
+    dataset_tables,
+    generate_bulk,
+    listed_tables,
+    validate_request,
+)
+from app.services.generation import GenerationService
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+# error_type (app.errors) -> status HTTP; lo no listado (TRANSIENT) es 503
+_STATUS_BY_ERROR_TYPE = {
+    PERMANENT: 422,
+    RATE_LIMIT: 429,
+    VALIDATION: 502,
+    DEADLINE: 504,
+}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.generation = GenerationService()
+    try:
+        yield
+    finally:
+        app.state.generation.shutdown()
+
+
+app = FastAPI(title="Manage Metadata Vertex AI", lifespan=lifespan)
+
+
+def _error(status_code: int, error_type: str, message: str) -> HTTPException:
+    return HTTPException(
+        status_code=status_code,
+        detail={"error_type": error_type, "error": message[:500]},
+    )
+
+
+@app.get("/")
+async def health(request: Request) -> dict:
+    return {"status": "ok", **request.app.state.generation.stats()}
+
+
+@app.post(
+    "/projects/{project}/datasets/{dataset}/tables/{table}",
+    response_model=TableGenerationResponse,
+)
+async def generate_table_metadata(
+    project: str,
+    dataset: str,
+    table: str,
+    request: Request,
+    refresh: bool = Query(False, description="ignora el cache y regenera"),
+) -> TableGenerationResponse:
+    service: GenerationService = request.app.state.generation
+    table_fqn = f"{project}.{dataset}.{table}"
+
+    try:
+        generation = await service.generate(project, dataset, table, refresh=refresh)
+    except api_exceptions.NotFound as exc:
+        raise _error(404, PERMANENT, str(exc))
+    except Exception as exc:
+        error_type = classify_error(exc)
+        logger.error(f"[API] {table_fqn} — {error_type}: {exc}")
+        raise _error(_STATUS_BY_ERROR_TYPE.get(error_type, 503), error_type, str(exc))
+
+    result = generation.result
+    if result["estado"] != "OK":
+        error_type = result.get("error_type")
+        raise _error(
+            _STATUS_BY_ERROR_TYPE.get(error_type, 503), error_type, result["error"]
+        )
+
+    return TableGenerationResponse(
+        table_fqn=table_fqn,
+        estado=result["estado"],
+        cached=generation.cached,
+        coalesced=generation.coalesced,
+        fingerprint=result.get("fingerprint"),
+        model_tier=result.get("model_tier"),
+        metadata=result["payload"],
+        llm_usage=result.get("llm_usage"),
+        stage_ms=result.get("stage_ms") or {},
+    )
+
+
+def _ndjson(events):
+    async def body():
+        async for event in events:
+            yield json.dumps(event, ensure_ascii=False, default=str) + "\n"
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+def _sse(events):
+    async def body():
+        async for event in events:
+            # id = cursor: al reconectar, EventSource lo manda en Last-Event-ID
+            yield (
+                f"id: {event.get('cursor') or ''}\n"
+                f"event: {event['type']}\n"
+                f"data: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+            )
+
+    return StreamingResponse(body(), media_type="text/event-stream")
+
+
+@app.post("/bulk")
+async def generate_bulk_metadata(
+    body: BulkGenerationRequest,
+    request: Request,
+    accept: str = Header("application/x-ndjson"),
+    last_event_id: Optional[str] = Header(None),
+):
+    if bool(body.dataset) == bool(body.tables):
+        raise _error(422, PERMANENT, "Indicar dataset (proyecto.dataset) o tables")
+
+    cursor = body.cursor or last_event_id or None
+    try:
+        errors = validate_request(body.dataset, body.tables, cursor)
+    except ValueError as exc:
+        # cursor con formato inválido
+        errors = [str(exc)]
+    if errors:
+        raise _error(422, PERMANENT, "; ".join(errors))
+
+    if body.dataset:
+        project, dataset = body.dataset.split(".")
+        tables = dataset_tables(project, dataset, after=cursor)
+    else:
+        tables = listed_tables(body.tables, after=cursor)
+
+    logger.info(
+        f"[API] Bulk {body.dataset or f'{len(body.tables)} tabla(s)'} | "
+        f"cursor={cursor}"
+    )
+    events = generate_bulk(
+        request.app.state.generation,
+        tables,
+        cursor=cursor,
+        refresh=body.refresh,
+        include_metadata=body.include_metadata,
+    )
+    if "text/event-stream" in accept:
+        return _sse(events)
+    return _ndjson(events)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 
 
@@ -48,3 +48,27 @@ class TableStatus(BaseModel):
     columns: List[ColumnStatus]
     labels: dict
     last_modified: datetime
+
+
+class TableGenerationResponse(BaseModel):
+    table_fqn: str
+    estado: str
+    # resultado OK anterior con el mismo fingerprint de schema
+    cached: bool
+    # el pedido se sumó a una generación ya en curso
+    coalesced: bool
+    fingerprint: Optional[str]
+    model_tier: Optional[str]
+    metadata: TableMetadata
+    llm_usage: Optional[dict]
+    stage_ms: Dict[str, int]
+
+
+class BulkGenerationRequest(BaseModel):
+    # "proyecto.dataset": todas sus tablas; o tables: FQNs explícitos
+    dataset: Optional[str] = None
+    tables: Optional[List[str]] = None
+    refresh: bool = False
+    include_metadata: bool = False
+    # cursor del último evento recibido, para reanudar
+    cursor: Optional[str] = None
@@ -0,0 +1,201 @@
+"""
+Generación en bloque (un dataset o una lista de FQNs) con progreso en stream.
+
+Las tablas pasan por GenerationService (mismo pool acotado, single-flight y
+cache que el endpoint por tabla) y cada resultado se emite al completarse.
+La memoria no depende del tamaño del dataset: el listado se pagina a
+demanda, hay a lo sumo max_concurrency tablas en curso y el avance no se
+adelanta más de BULK_WINDOW posiciones a la tabla pendiente más antigua.
+
+Reanudación: cada evento lleva cursor = FQN de la última tabla del prefijo
+ya completo (en orden de listado). Un cliente desconectado vuelve a pedir
+con ese cursor y se omiten las tablas hasta él inclusive. Las que habían
+terminado después del cursor se vuelven a pedir, pero salen del cache.
+"""
+
+import asyncio
+import os
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from app.errors import classify_error
+from app.services.generation import GenerationService
+from job.bq_client_factory import get_bq_client
+
+# Máximo de posiciones entre la tabla pendiente más antigua y la última lanzada
+BULK_WINDOW = int(os.getenv("BULK_WINDOW", "64"))
+LIST_PAGE_SIZE = 500
+
+TableRef = Tuple[str, str, str]
+
+
+def split_fqn(fqn: str) -> TableRef:
+    parts = fqn.strip().split(".")
+    if len(parts) != 3 or not all(parts):
+        raise ValueError(f"FQN inválido (se espera proyecto.dataset.tabla): {fqn}")
+    return parts[0], parts[1], parts[2]
+
+
+async def dataset_tables(
+    project: str, dataset: str, after: Optional[str] = None
+) -> AsyncIterator[TableRef]:
+    """
+    Tablas (TABLE) del dataset, página a página. tables.list devuelve las
+    tablas ordenadas por table_id: el cursor se compara por nombre y sigue
+    siendo válido aunque se creen o borren tablas entre intentos.
+    """
+    after_table = split_fqn(after)[2] if after else None
+    bq_client = get_bq_client(project)
+    listing = iter(
+        bq_client.list_tables(f"{project}.{dataset}", page_size=LIST_PAGE_SIZE)
+    )
+    while True:
+        # cada next puede traer una página nueva (llamada bloqueante)
+        item = await asyncio.to_thread(next, listing, None)
+        if item is None:
+            return
+        if item.table_type != "TABLE":
+            continue
+        if after_table is not None and item.table_id <= after_table:
+            continue
+        yield project, dataset, item.table_id
+
+
+def validate_request(
+    dataset: Optional[str], fqns: Optional[List[str]], cursor: Optional[str]
+) -> List[str]:
+    """
+    Errores del pedido, antes de abrir el stream (un FQN inválido a mitad
+    del listado cortaría el resto y el reintento desde el cursor también).
+    """
+    errors = []
+    if dataset:
+        parts = dataset.split(".")
+        if len(parts) != 2 or not all(parts):
+            errors.append(f"dataset inválido (se espera proyecto.dataset): {dataset}")
+        elif cursor and ".".join(split_fqn(cursor)[:2]) != dataset:
+            errors.append(f"cursor fuera del dataset {dataset}: {cursor}")
+    else:
+        for fqn in fqns or []:
+            try:
+                split_fqn(fqn)
+            except ValueError as exc:
+                errors.append(str(exc))
+        if cursor and cursor not in (fqns or []):
+            errors.append(f"cursor que no está en tables: {cursor}")
+    return errors
+
+
+async def listed_tables(
+    fqns: Iterable[str], after: Optional[str] = None
+) -> AsyncIterator[TableRef]:
+    """
+    FQNs explícitos (ya validados) en el orden recibido; con cursor, los
+    posteriores a él.
+    """
+    fqns = list(fqns)
+    start = fqns.index(after) + 1 if after else 0
+    for fqn in fqns[start:]:
+        yield split_fqn(fqn)
+
+
+def _event(table_ref: TableRef, generation=None, exc=None, metadata=False) -> dict:
+    event = {"type": "table", "table_fqn": ".".join(table_ref)}
+    if exc is not None:
+        event.update(
+            estado="ERROR", error_type=classify_error(exc), error=str(exc)[:500]
+        )
+        return event
+
+    result = generation.result
+    event.update(
+        estado=result["estado"],
+        cached=generation.cached,
+        coalesced=generation.coalesced,
+        duration_ms=result.get("duration_ms"),
+    )
+    if result["estado"] == "OK":
+        event["model_tier"] = result.get("model_tier")
+        if metadata:
+            event["metadata"] = result["payload"]
+    else:
+        event.update(error_type=result.get("error_type"), error=result.get("error"))
+    return event
+
+
+async def generate_bulk(
+    service: GenerationService,
+    tables: AsyncIterator[TableRef],
+    cursor: Optional[str] = None,
+    refresh: bool = False,
+    include_metadata: bool = False,
+    window: int = BULK_WINDOW,
+) -> AsyncIterator[dict]:
+    """
+    Eventos {"type": "table", ...} a medida que terminan las tablas y uno
+    final {"type": "done", ...}; {"type": "error", ...} si falla el listado.
+    Si el consumidor deja de iterar (cliente desconectado) se cancelan las
+    esperas; las generaciones ya lanzadas terminan y quedan en cache.
+    """
+    in_flight: Dict[asyncio.Task, Tuple[int, TableRef]] = {}
+    # completadas por encima del prefijo (a lo sumo window)
+    completed: Dict[int, TableRef] = {}
+    next_position = 0
+    prefix_end = -1
+    exhausted = False
+    counts = {"ok": 0, "error": 0}
+
+    async def run(table_ref: TableRef):
+        return await service.generate(*table_ref, refresh=refresh)
+
+    try:
+        while True:
+            while (
+                not exhausted
+                and len(in_flight) < service.max_concurrency
+                and next_position - prefix_end <= window
+            ):
+                try:
+                    table_ref = await tables.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                except Exception as exc:
+                    # falló el listado del dataset: se terminan las ya lanzadas
+                    exhausted = True
+                    yield {
+                        "type": "error",
+                        "error_type": classify_error(exc),
+                        "error": str(exc)[:500],
+                        "cursor": cursor,
+                    }
+                    break
+                task = asyncio.ensure_future(run(table_ref))
+                in_flight[task] = (next_position, table_ref)
+                next_position += 1
+
+            if not in_flight:
+                break
+
+            done, _ = await asyncio.wait(
+                in_flight, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in sorted(done, key=lambda t: in_flight[t][0]):
+                position, table_ref = in_flight.pop(task)
+                try:
+                    event = _event(table_ref, task.result(), metadata=include_metadata)
+                except Exception as exc:
+                    event = _event(table_ref, exc=exc)
+
+                completed[position] = table_ref
+                while prefix_end + 1 in completed:
+                    prefix_end += 1
+                    cursor = ".".join(completed.pop(prefix_end))
+
+                counts["ok" if event["estado"] == "OK" else "error"] += 1
+                event["cursor"] = cursor
+                yield event
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+    yield {"type": "done", **counts, "cursor": cursor}
@@ -0,0 +1,178 @@
+"""
+Clasificador local y determinístico de sensitivity e is_computed.
+
+Reglas sobre el nombre de la columna (tokens separados por "_" o camelCase)
+y patrones sobre los ejemplos del perfil: DNI, RUC, correo, celular y
+nombres de persona. Con LOCAL_FLAGS activo los flags no se piden al modelo
+en el formato compacto; en el formato completo la respuesta del modelo se
+contrasta con la local:
+
+- sensitivity: true si cualquiera de los dos la marca (no se pierde PII)
+- is_computed: manda la regla local (reproducible entre corridas)
+"""
+
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List
+
+from google.cloud import bigquery
+
+from app.adapters.bq_reader import iter_schema_paths
+from app.adapters.vertex_llm import record_llm_event
+
+logger = logging.getLogger(__name__)
+
+LOCAL_FLAGS = os.getenv("LOCAL_FLAGS", "true").strip().lower() in ("1", "true", "yes")
+
+# Fracción mínima de ejemplos que deben cumplir un patrón
+PATTERN_MIN_FRACTION = 0.5
+
+_COMPUTED_TOKENS = {
+    "rate", "tasa", "pct", "porc", "porcentaje", "flag", "flg", "total", "tot",
+    "avg", "prom", "promedio", "sum", "suma", "count", "cnt", "conteo", "ratio",
+}
+_COMPUTED_BIGRAMS = {("amount", "final"), ("monto", "final")}
+
+_SENSITIVE_TOKENS = {
+    "apellido", "apellidos", "dni", "ruc", "email", "correo", "mail",
+    "telefono", "telf", "celular", "movil", "direccion", "domicilio",
+    "nacimiento", "tarjeta", "cci", "iban", "placa", "sueldo", "salario",
+}
+_DOCUMENT_TOKENS = {"doc", "documento", "identificacion"}
+_NAME_TOKENS = {"nombre", "nombres", "nom"}
+_PERSON_TOKENS = {
+    "asegurado", "contratante", "titular", "cliente", "beneficiario",
+    "paciente", "afiliado", "persona", "completo", "corredor", "agente",
+}
+
+_PATTERNS = {
+    "email": re.compile(r"^[\w.+-]+@[\w-]+(\.[\w-]+)+$"),
+    "ruc": re.compile(r"^(10|15|17|20)\d{9}$"),
+    "dni": re.compile(r"^\d{8}$"),
+    "celular": re.compile(r"^(\+?51)?9\d{8}$"),
+    "nombre": re.compile(r"^[^\W\d_]{2,}(\s+[^\W\d_]{2,}){1,4}$"),
+}
+# YYYYMMDD también tiene 8 dígitos: no cuenta como DNI
+_DATE_8 = re.compile(r"^(19|20)\d{2}(0[1-9]|1[0-2])(0[1-9]|[12]\d|3[01])$")
+_PHONE_SEPARATORS = re.compile(r"[\s\-().]")
+
+
+@dataclass(frozen=True)
+class ColumnFlags:
+    is_computed: bool
+    sensitivity: bool
+    # regla que marcó sensitivity ("" si ninguna)
+    reason: str = ""
+
+
+def name_tokens(path: str) -> List[str]:
+    leaf = path.rsplit(".", 1)[-1]
+    leaf = re.sub(r"([a-z0-9])([A-Z])", r"\1_\2", leaf)
+    return [token for token in re.split(r"[_\W]+", leaf.lower()) if token]
+
+
+def _pattern_hits(examples: List[str]) -> Dict[str, int]:
+    """Una pasada por los ejemplos con todos los patrones compilados."""
+    hits = dict.fromkeys(_PATTERNS, 0)
+    for text in examples:
+        if _PATTERNS["email"].match(text):
+            hits["email"] += 1
+            continue
+        digits = _PHONE_SEPARATORS.sub("", text)
+        if _PATTERNS["ruc"].match(digits):
+            hits["ruc"] += 1
+        elif _PATTERNS["celular"].match(digits):
+            hits["celular"] += 1
+        elif _PATTERNS["dni"].match(digits) and not _DATE_8.match(digits):
+            hits["dni"] += 1
+        elif _PATTERNS["nombre"].match(text):
+            hits["nombre"] += 1
+    return hits
+
+
+def classify_column(path: str, examples: Iterable = ()) -> ColumnFlags:
+    tokens = name_tokens(path)
+    token_set = set(tokens)
+
+    is_computed = bool(token_set & _COMPUTED_TOKENS) or any(
+        pair in _COMPUTED_BIGRAMS for pair in zip(tokens, tokens[1:])
+    )
+
+    texts = [str(value).strip() for value in examples if str(value).strip()]
+    hits = _pattern_hits(texts) if texts else {}
+    matched = [
+        name
+        for name, count in hits.items()
+        if count >= PATTERN_MIN_FRACTION * len(texts)
+    ]
+
+    reason = ""
+    if token_set & _SENSITIVE_TOKENS:
+        reason = f"nombre:{sorted(token_set & _SENSITIVE_TOKENS)[0]}"
+    elif token_set & _DOCUMENT_TOKENS and ("dni" in matched or "ruc" in matched):
+        reason = "documento"
+    elif token_set & _NAME_TOKENS and (
+        token_set & _PERSON_TOKENS
+        # "nombre" a secas: solo si los ejemplos parecen nombres de persona
+        # (nombre_producto, nom_ramo, ... describen otra cosa)
+        or (token_set <= _NAME_TOKENS and "nombre" in matched)
+    ):
+        reason = "nombre_persona"
+    elif "email" in matched or "celular" in matched:
+        # correo y celular bastan aunque el nombre no lo indique; 8 u 11
+        # dígitos sueltos también son códigos y necesitan el nombre
+        reason = "ejemplos:email" if "email" in matched else "ejemplos:celular"
+
+    return ColumnFlags(is_computed=is_computed, sensitivity=bool(reason), reason=reason)
+
+
+def classify_columns(table: bigquery.Table, profile: dict) -> Dict[str, ColumnFlags]:
+    """Flags locales por ruta; los campos anidados solo usan el nombre."""
+    return {
+        path: classify_column(
+            path, ((profile or {}).get(path) or {}).get("example_values") or []
+        )
+        for path, _ in iter_schema_paths(table.schema)
+    }
+
+
+def reconcile_flags(payload: dict, local_flags: Dict[str, ColumnFlags]) -> dict:
+    """
+    Contrasta los flags del modelo con los locales y deja el resultado
+    combinado. Los desacuerdos se cuentan en flag_disagreements.
+    """
+    if not isinstance(payload, dict) or not local_flags:
+        return payload
+
+    columns = []
+    disagreements = 0
+    for col in payload.get("columns") or []:
+        local = local_flags.get(col.get("name")) if isinstance(col, dict) else None
+        if local is None:
+            columns.append(col)
+            continue
+
+        model_sensitive = col.get("sensitivity")
+        model_computed = col.get("is_computed")
+        if isinstance(model_sensitive, bool) and model_sensitive != local.sensitivity:
+            disagreements += 1
+        if isinstance(model_computed, bool) and model_computed != local.is_computed:
+            disagreements += 1
+
+        col = dict(col)
+        col["sensitivity"] = local.sensitivity or model_sensitive is True
+        col["is_computed"] = local.is_computed
+        columns.append(col)
+
+    if disagreements:
+        record_llm_event("flag_disagreements", disagreements)
+        logger.info(
+            f"[{payload.get('table_fqn')}] Flags: {disagreements} desacuerdo(s) "
+            f"entre modelo y clasificador local"
+        )
+
+    reconciled = dict(payload)
+    reconciled["columns"] = columns
+    return reconciled
@@ -14,14 +14,21 @@ Requisitos:
 - El Entry de BigQuery debe existir (auto-discovery)
 """
 
+import hashlib
+import json
 import logging
 import os
+import queue
+import random
+import threading
+import time
 from dataclasses import dataclass, field
-from typing import List
+from typing import Any, Callable, List, Optional
 
 import google.auth
 import google.auth.transport.requests
 import requests
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger(__name__)
 
@@ -35,6 +42,14 @@ ASPECT_TYPE_DESCRIPTIONS = os.getenv(
 
 _DATAPLEX_API_BASE = "https://dataplex.googleapis.com/v1"
 
+# Conexiones keep-alive reutilizables: una por worker concurrente
+DATAPLEX_POOL_SIZE = int(
+    os.getenv("DATAPLEX_POOL_SIZE", os.getenv("MAX_WORKERS", "15"))
+)
+
+_session: Optional[google.auth.transport.requests.AuthorizedSession] = None
+_session_lock = threading.Lock()
+
 
 @dataclass
 class DataplexWriteResult:
@@ -43,6 +58,12 @@ class DataplexWriteResult:
     entry_name: str
     aspects_updated: List[str] = field(default_factory=list)
     errors: List[str] = field(default_factory=list)
+    latency_ms: int = 0
+    # 429, 5xx, timeout o error de red: vale la pena reintentar
+    retryable: bool = False
+    # hash del contenido publicado; skipped=True si no hubo PATCH por no cambiar
+    content_hash: str = ""
+    skipped: bool = False
 
 
 def _parse_fqn(table_fqn: str) -> tuple[str, str, str]:
@@ -82,12 +103,28 @@ def _aspect_map_key(aspect_type_id: str) -> str:
     return f"{GOVERNANCE_PROJECT}.{DATAPLEX_LOCATION}.{aspect_type_id}"
 
 
-def _get_credentials():
-    credentials, _ = google.auth.default(
-        scopes=["https://www.googleapis.com/auth/cloud-platform"]
-    )
-    credentials.refresh(google.auth.transport.requests.Request())
-    return credentials
+def _get_session() -> google.auth.transport.requests.AuthorizedSession:
+    """
+    Sesión autorizada compartida por todos los threads del proceso.
+    AuthorizedSession solo refresca el token cuando está por expirar y el
+    pool de conexiones mantiene keep-alive: una escritura = un round-trip.
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            credentials, _ = google.auth.default(
+                scopes=["https://www.googleapis.com/auth/cloud-platform"]
+            )
+            session = google.auth.transport.requests.AuthorizedSession(credentials)
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=DATAPLEX_POOL_SIZE,
+            )
+            session.mount("https://", adapter)
+            _session = session
+
+    return _session
 
 
 def _build_descriptions_aspect(payload: dict) -> dict:
@@ -117,7 +154,26 @@ def _build_descriptions_aspect(payload: dict) -> dict:
     }
 
 
-def upsert_dataplex_aspects(payload: dict) -> DataplexWriteResult:
+def aspect_content_hash(payload: dict) -> str:
+    """
+    Hash canónico del contenido del aspect. Excluye job_details (cambia en
+    cada generación) para que un contenido idéntico produzca el mismo hash.
+    """
+    data = dict(_build_descriptions_aspect(payload)["data"])
+    data.pop("job_details", None)
+    canonical = json.dumps(
+        data, ensure_ascii=False, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+def upsert_dataplex_aspects(
+    payload: dict, previous_hash: Optional[str] = None
+) -> DataplexWriteResult:
+    """
+    previous_hash: hash del último aspect publicado (tracker). Si el contenido
+    no cambió no se hace PATCH y el resultado vuelve con skipped=True.
+    """
     table_fqn = payload.get("table_fqn", "")
 
     try:
@@ -132,15 +188,22 @@ def upsert_dataplex_aspects(payload: dict) -> DataplexWriteResult:
         )
 
     entry_name = _build_entry_name(bq_project, dataset, table)
+
+    content_hash = aspect_content_hash(payload)
+    if previous_hash and previous_hash == content_hash:
+        logger.info(f"[Dataplex] Sin cambios para {table_fqn}, se omite PATCH")
+        return DataplexWriteResult(
+            success=True,
+            table_fqn=table_fqn,
+            entry_name=entry_name,
+            content_hash=content_hash,
+            skipped=True,
+        )
+
     logger.info(f"[Dataplex] Upsert Aspect para: {table_fqn}")
     logger.debug(f"[Dataplex] Entry: {entry_name}")
 
-    credentials = _get_credentials()
-
-    headers = {
-        "Authorization": f"Bearer {credentials.token}",
-        "Content-Type": "application/json",
-    }
+    session = _get_session()
 
     aspects_body = {
         _aspect_map_key(ASPECT_TYPE_DESCRIPTIONS): _build_descriptions_aspect(payload)
@@ -150,23 +213,33 @@ def upsert_dataplex_aspects(payload: dict) -> DataplexWriteResult:
     params = {"updateMask": "aspects"}
     body = {"aspects": aspects_body}
 
+    start = time.monotonic()
+
+    def elapsed_ms() -> int:
+        return int((time.monotonic() - start) * 1000)
+
     try:
-        response = requests.patch(
+        response = session.patch(
             url,
-            headers=headers,
             params=params,
             json=body,
             timeout=(5, 25),
         )
         response.raise_for_status()
 
-        logger.info(f"[Dataplex] Aspect actualizado correctamente para {table_fqn}")
+        latency_ms = elapsed_ms()
+        logger.info(
+            f"[Dataplex] Aspect actualizado correctamente para {table_fqn} "
+            f"({latency_ms} ms)"
+        )
 
         return DataplexWriteResult(
             success=True,
             table_fqn=table_fqn,
             entry_name=entry_name,
             aspects_updated=[ASPECT_TYPE_DESCRIPTIONS],
+            latency_ms=latency_ms,
+            content_hash=content_hash,
         )
 
     except requests.exceptions.HTTPError:
@@ -177,6 +250,8 @@ def upsert_dataplex_aspects(payload: dict) -> DataplexWriteResult:
             table_fqn=table_fqn,
             entry_name=entry_name,
             errors=[error_msg],
+            latency_ms=elapsed_ms(),
+            retryable=response.status_code == 429 or response.status_code >= 500,
         )
 
     except requests.exceptions.Timeout:
@@ -187,6 +262,8 @@ def upsert_dataplex_aspects(payload: dict) -> DataplexWriteResult:
             table_fqn=table_fqn,
             entry_name=entry_name,
             errors=[error_msg],
+            latency_ms=elapsed_ms(),
+            retryable=True,
         )
 
     except requests.exceptions.RequestException as e:
@@ -197,22 +274,139 @@ def upsert_dataplex_aspects(payload: dict) -> DataplexWriteResult:
             table_fqn=table_fqn,
             entry_name=entry_name,
             errors=[error_msg],
+            latency_ms=elapsed_ms(),
+            retryable=True,
         )
 
 
-def _publish_dataplex_background(payload: dict, table_fqn: str):
+class DataplexPublisher:
     """
-    Publica metadata en Dataplex en segundo plano.
-    Nunca lanza excepción hacia FastAPI.
+    Publica aspects en Dataplex en segundo plano para que los workers del LLM
+    no esperen la escritura.
+
+    - Cola acotada: submit() bloquea si Dataplex no da abasto (backpressure)
+    - Pool propio de threads pequeño
+    - Reintentos con back-off exponencial solo para errores reintentables
+    - on_done(key, result) se invoca desde el thread del publisher;
+      nunca propaga excepciones
+    - close(timeout) nunca bloquea más que timeout: el cierre se señala con
+      eventos, no con items en la cola (que puede estar llena)
     """
-    try:
-        logger.info(f"[Dataplex] (bg) Publicando metadata para {table_fqn}")
-        result = upsert_dataplex_aspects(payload)
-
-        if not result.success:
-            logger.error(f"[Dataplex] (bg) Fallo para {table_fqn}: {result.errors}")
-        else:
-            logger.info(f"[Dataplex] (bg) Publicado correctamente para {table_fqn}")
 
-    except Exception:
-        logger.exception(f"[Dataplex] (bg) Error inesperado para {table_fqn}")
+    # cada cuánto un worker ocioso revisa si se pidió el cierre
+    _POLL_SEC = 0.2
+
+    def __init__(
+        self,
+        on_done: Callable[[Any, DataplexWriteResult], None],
+        workers: int = 4,
+        queue_size: int = 100,
+        retries: int = 3,
+        backoff_sec: float = 2.0,
+    ):
+        self._on_done = on_done
+        self._retries = retries
+        self._backoff_sec = backoff_sec
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        # cerrando: los workers terminan al vaciar la cola
+        self._closing = threading.Event()
+        # timeout de close vencido: no se toman más items ni se reintenta
+        self._abandoned = threading.Event()
+        self._threads = [
+            threading.Thread(
+                target=self._worker, name=f"dataplex-publisher-{i}", daemon=True
+            )
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(
+        self, key: Any, payload: dict, previous_hash: Optional[str] = None
+    ) -> None:
+        self._queue.put((key, payload, previous_hash))
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Espera a que se publique lo encolado. Lo que siga en cola al vencer
+        timeout se reporta como fallo reintentable.
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        self._closing.set()
+
+        for thread in self._threads:
+            remaining = None if end is None else max(0.0, end - time.monotonic())
+            thread.join(remaining)
+        # un worker que siga con un item termina ese intento y sale
+        self._abandoned.set()
+
+        while True:
+            try:
+                key, payload, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._notify(
+                key,
+                DataplexWriteResult(
+                    success=False,
+                    table_fqn=payload.get("table_fqn", ""),
+                    entry_name="",
+                    errors=["No publicado antes del cierre del publisher"],
+                    retryable=True,
+                ),
+            )
+
+    def _worker(self) -> None:
+        while not self._abandoned.is_set():
+            try:
+                item = self._queue.get(timeout=self._POLL_SEC)
+            except queue.Empty:
+                if self._closing.is_set():
+                    return
+                continue
+
+            key, payload, previous_hash = item
+            self._notify(key, self._publish_with_retries(payload, previous_hash))
+
+    def _publish_with_retries(
+        self, payload: dict, previous_hash: Optional[str]
+    ) -> DataplexWriteResult:
+        table_fqn = payload.get("table_fqn", "")
+
+        for attempt in range(self._retries + 1):
+            try:
+                result = upsert_dataplex_aspects(payload, previous_hash)
+            except Exception as exc:
+                logger.exception(f"[Dataplex] (bg) Error inesperado para {table_fqn}")
+                result = DataplexWriteResult(
+                    success=False,
+                    table_fqn=table_fqn,
+                    entry_name="",
+                    errors=[str(exc)],
+                    retryable=True,
+                )
+
+            if (
+                result.success
+                or not result.retryable
+                or attempt == self._retries
+                or self._abandoned.is_set()
+            ):
+                return result
+
+            wait = self._backoff_sec * 2**attempt * random.uniform(0.8, 1.2)
+            logger.warning(
+                f"[Dataplex] (bg) Reintento {attempt + 1}/{self._retries} "
+                f"para {table_fqn} en {wait:.1f}s"
+            )
+            # el cierre interrumpe la espera: el fallo queda reintentable
+            if self._abandoned.wait(wait):
+                return result
+
+        return result
+
+    def _notify(self, key: Any, result: DataplexWriteResult) -> None:
+        try:
+            self._on_done(key, result)
+        except Exception:
+            logger.exception(f"[Dataplex] (bg) on_done falló para {result.table_fqn}")
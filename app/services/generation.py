@@ -0,0 +1,194 @@
+"""
+Generación online (API) sobre el pipeline del job (job.processor.process_table).
+
+- single-flight: pedidos concurrentes de la misma tabla se suman a la
+  generación en curso; una ráfaga de clics cuesta un solo LLM
+- cache por (tabla, fingerprint del schema) con TTL: mientras el schema no
+  cambie se devuelve el último resultado OK. Escribir descripciones no altera
+  el fingerprint, así que la propia escritura no invalida el cache
+- concurrencia acotada: process_table es bloqueante y corre en un pool de
+  API_MAX_CONCURRENCY threads; el resto espera en la cola del pool
+
+SingleFlight y TtlCache solo se usan desde el event loop: no llevan locks.
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from app.adapters.bq_reader import get_table_metadata, schema_fingerprint
+from job.bq_client_factory import get_bq_client
+from job.processor import process_table
+
+logger = logging.getLogger(__name__)
+
+API_MAX_CONCURRENCY = int(os.getenv("API_MAX_CONCURRENCY", "8"))
+API_CACHE_TTL_SEC = int(os.getenv("API_CACHE_TTL_SEC", "3600"))
+API_CACHE_MAX_ENTRIES = int(os.getenv("API_CACHE_MAX_ENTRIES", "1024"))
+# Deadline de cada generación (perfilado + LLM + escrituras)
+API_REQUEST_TIMEOUT_SEC = int(os.getenv("API_REQUEST_TIMEOUT_SEC", "300"))
+
+# Campos del resultado de process_table que no se guardan ni se devuelven
+_INTERNAL_FIELDS = ("snapshot",)
+
+
+class SingleFlight:
+    """Una sola ejecución en curso por clave; los demás esperan su resultado."""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    async def do(
+        self, key: Hashable, fn: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """Retorna (resultado, compartido): compartido si se sumó a otra llamada."""
+        future = self._inflight.get(key)
+        shared = future is not None
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._inflight[key] = future
+            future.add_done_callback(functools.partial(self._done, key))
+        # shield: si el cliente que la lanzó se desconecta, la generación sigue
+        # para los demás (y su resultado queda en cache)
+        return await asyncio.shield(future), shared
+
+    def _done(self, key: Hashable, future: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        if not future.cancelled():
+            # marca la excepción como observada aunque ya no quede nadie esperando
+            future.exception()
+
+
+class TtlCache:
+    """LRU acotado a max_entries cuyas entradas vencen a los ttl_sec."""
+
+    def __init__(self, ttl_sec: float, max_entries: int, clock=time.monotonic):
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if self._clock() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.ttl_sec <= 0 or self.max_entries <= 0:
+            return
+        self._entries[key] = (self._clock() + self.ttl_sec, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+@dataclass
+class Generation:
+    result: dict
+    # resultado OK anterior con el mismo fingerprint
+    cached: bool = False
+    # el pedido se sumó a una generación ya en curso
+    coalesced: bool = False
+
+
+class GenerationService:
+    def __init__(
+        self,
+        max_concurrency: int = API_MAX_CONCURRENCY,
+        cache_ttl_sec: int = API_CACHE_TTL_SEC,
+        cache_max_entries: int = API_CACHE_MAX_ENTRIES,
+        request_timeout_sec: int = API_REQUEST_TIMEOUT_SEC,
+    ):
+        self.max_concurrency = max_concurrency
+        self.request_timeout_sec = request_timeout_sec
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="generation"
+        )
+        self._flights = SingleFlight()
+        self._cache = TtlCache(cache_ttl_sec, cache_max_entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._flights), "cached": len(self._cache)}
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self, fn: Callable, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(fn, *args, **kwargs)
+        )
+
+    async def generate(
+        self, project: str, dataset: str, table: str, refresh: bool = False
+    ) -> Generation:
+        """
+        Metadata de la tabla: desde cache si el schema no cambió, si no con
+        process_table (que también escribe en BigQuery y Dataplex).
+        refresh omite el cache y solo se suma a otro refresh en curso (una
+        generación normal puede terminar devolviendo el cache que se quiere
+        saltar); un pedido normal se suma a cualquiera de los dos.
+        Los errores de lectura de la tabla (NotFound, permisos) se propagan;
+        los de generación vuelven en result (estado ERROR, error_type).
+        """
+        table_fqn = f"{project}.{dataset}.{table}"
+
+        async def produce() -> Tuple[dict, bool]:
+            bq_client = get_bq_client(project)
+            table_obj = await self._run(
+                get_table_metadata, project, dataset, table, bq_client
+            )
+            fingerprint = schema_fingerprint(table_obj)
+            if not refresh:
+                cached = self._cache.get((table_fqn, fingerprint))
+                if cached is not None:
+                    return cached, True
+
+            result = await self._run(
+                process_table,
+                project,
+                dataset,
+                table,
+                bq_client,
+                deadline=time.time() + self.request_timeout_sec,
+            )
+            result = {
+                key: value
+                for key, value in result.items()
+                if key not in _INTERNAL_FIELDS
+            }
+            if result["estado"] == "OK":
+                self._cache.set((table_fqn, result["fingerprint"]), result)
+            logger.info(
+                f"[API] {table_fqn} | estado={result['estado']} | "
+                f"duration_ms={result['duration_ms']}"
+            )
+            return result, False
+
+        # sin await entre el chequeo y do: nadie puede colarse en el medio
+        key = (table_fqn, True)
+        if not refresh and key not in self._flights:
+            key = (table_fqn, False)
+        (result, cached), coalesced = await self._flights.do(key, produce)
+        return Generation(result, cached=cached, coalesced=coalesced)
@@ -0,0 +1,155 @@
+"""
+Reparación dirigida de un payload del LLM: en vez de regenerar la tabla
+completa, se vuelve a pedir solo las columnas faltantes, duplicadas o que no
+cumplen el contrato, y se fusionan con las columnas válidas.
+
+Los errores fuera de las columnas (table_description, table_fqn, JSON que no
+es objeto) no son reparables por columna: el payload se regenera completo.
+"""
+
+import logging
+from typing import Dict, List, Optional, Set
+
+from google.cloud import bigquery
+
+from app.adapters.bq_reader import iter_schema_paths
+from app.adapters.llm_usage import LlmUsage
+from app.adapters.vertex_llm import MODEL_NAME, generate_metadata, record_llm_event
+from app.errors import MetadataValidationError
+from app.services.column_classifier import LOCAL_FLAGS, classify_columns
+from app.services.prompt_builder import build_prompt
+from app.services.wire_format import compact_format_for
+from app.validators.metadata_schema import split_errors
+
+logger = logging.getLogger(__name__)
+
+# Rondas máximas de reparación por tabla
+REPAIR_MAX_ROUNDS = 2
+
+
+def is_repairable(payload) -> bool:
+    if not isinstance(payload, dict):
+        return False
+    _, other_errors = split_errors(payload)
+    return not other_errors
+
+
+def columns_to_repair(payload: dict, expected_names: List[str]) -> Set[str]:
+    """
+    Rutas del schema que hay que volver a pedir: sin entrada, duplicadas o
+    con errores de contrato. Las entradas que no existen en el schema se
+    descartan en el merge, no se reparan.
+    """
+    expected = set(expected_names)
+    invalid_indexes, _ = split_errors(payload)
+
+    seen: Set[str] = set()
+    bad: Set[str] = set()
+    for index, col in enumerate(payload.get("columns") or []):
+        name = col.get("name") if isinstance(col, dict) else None
+        if not isinstance(name, str) or name not in expected:
+            continue
+        if name in seen or index in invalid_indexes:
+            bad.add(name)
+        seen.add(name)
+
+    bad.update(expected - seen)
+    return bad
+
+
+def _valid_columns(
+    payload: dict, names: Set[str], allow_duplicates: bool = False
+) -> Dict[str, dict]:
+    """
+    Entrada válida de cada nombre pedido. Un nombre duplicado no cuenta salvo
+    con allow_duplicates, en cuyo caso gana la primera entrada válida.
+    """
+    invalid_indexes, _ = split_errors(payload)
+    counts: Dict[str, int] = {}
+    for col in payload.get("columns") or []:
+        if isinstance(col, dict) and isinstance(col.get("name"), str):
+            counts[col["name"]] = counts.get(col["name"], 0) + 1
+
+    valid: Dict[str, dict] = {}
+    for index, col in enumerate(payload.get("columns") or []):
+        if index in invalid_indexes or not isinstance(col, dict):
+            continue
+        name = col.get("name")
+        if name in names and name not in valid and (
+            allow_duplicates or counts[name] == 1
+        ):
+            valid[name] = col
+    return valid
+
+
+def repair_metadata(
+    payload: dict,
+    table: bigquery.Table,
+    profile: dict,
+    deadline: Optional[float] = None,
+    usage: Optional[LlmUsage] = None,
+) -> dict:
+    """
+    Retorna el payload con las columnas defectuosas regeneradas, en el orden
+    del schema. Lanza MetadataValidationError si hay errores fuera de las
+    columnas. Lo que siga sin reparar tras REPAIR_MAX_ROUNDS usa la primera
+    entrada válida del original o queda sin entrada (sin descripción).
+    """
+    table_fqn = f"{table.project}.{table.dataset_id}.{table.table_id}"
+
+    _, other_errors = split_errors(payload)
+    if other_errors:
+        raise MetadataValidationError(str(other_errors))
+
+    expected_names = [path for path, _ in iter_schema_paths(table.schema)]
+    model = (payload.get("model") or {}).get("version") or MODEL_NAME
+
+    local_flags = classify_columns(table, profile) if LOCAL_FLAGS else None
+    to_repair = columns_to_repair(payload, expected_names)
+    accepted = _valid_columns(payload, set(expected_names) - to_repair)
+
+    for round_number in range(1, REPAIR_MAX_ROUNDS + 1):
+        if not to_repair:
+            break
+
+        logger.info(
+            f"[{table_fqn}] Reparando {len(to_repair)} de {len(expected_names)} "
+            f"columna(s) (ronda {round_number})"
+        )
+        record_llm_event("repairs")
+        record_llm_event("repaired_columns", len(to_repair))
+
+        prompt = build_prompt(
+            table=table,
+            profile=profile,
+            only_columns=to_repair,
+            local_flags=local_flags,
+        )
+        repaired = generate_metadata(
+            prompt,
+            deadline=deadline,
+            model=model,
+            wire_format=compact_format_for(table, to_repair, local_flags),
+            usage=usage,
+        )
+
+        fixed = _valid_columns(repaired, to_repair)
+        accepted.update(fixed)
+        to_repair -= set(fixed)
+
+    if to_repair:
+        fallback = _valid_columns(payload, to_repair, allow_duplicates=True)
+        accepted.update(fallback)
+        to_repair -= set(fallback)
+
+    if to_repair:
+        logger.warning(
+            f"[{table_fqn}] {len(to_repair)} columna(s) quedan sin descripción "
+            f"tras la reparación"
+        )
+
+    repaired_payload = dict(payload)
+    repaired_payload["columns"] = [
+        accepted[name] for name in expected_names if name in accepted
+    ]
+    return repaired_payload
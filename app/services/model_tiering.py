@@ -0,0 +1,154 @@
+"""
+Selección de modelo por tabla: las tablas chicas y planas van primero a un
+modelo rápido y solo escalan al modelo pro si la respuesta no alcanza la
+calidad mínima.
+
+Motivos de escalamiento:
+- el payload no cumple METADATA_SCHEMA (o el modelo rápido no devolvió JSON)
+- cobertura incompleta: alguna columna del schema no tiene entrada
+- accuracy media de las columnas por debajo de MIN_ACCURACY
+"""
+
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from google.cloud import bigquery
+
+from app.adapters.bq_reader import iter_schema_paths
+from app.adapters.bq_writer import MIN_ACCURACY
+from app.adapters.llm_usage import LlmUsage
+from app.adapters.vertex_llm import MODEL_NAME, generate_metadata, record_llm_event
+from app.errors import DeadlineExceededError, PermanentError, ProcessingError
+from app.validators.metadata_schema import missing_columns, validate_metadata
+
+logger = logging.getLogger(__name__)
+
+FAST = "fast"
+PRO = "pro"
+
+MODEL_TIERING = os.getenv("MODEL_TIERING", "true").strip().lower() in ("1", "true", "yes")
+FAST_MODEL_NAME = os.getenv("FAST_MODEL_NAME", "gemini-2.5-flash")
+
+# Umbrales para el tier rápido (tablas sin RECORD anidados)
+FAST_TIER_MAX_COLUMNS = int(os.getenv("FAST_TIER_MAX_COLUMNS", "40"))
+FAST_TIER_MAX_BYTES = int(os.getenv("FAST_TIER_MAX_BYTES", str(10 * 1024**3)))
+
+# Un solo reintento en el tier rápido: si falla, el pro es el reintento
+FAST_TIER_RETRIES = 1
+
+
+@dataclass
+class TieredResult:
+    payload: dict
+    model_tier: str
+    escalated: bool = False
+    escalation_reason: Optional[str] = None
+
+
+def choose_tier(table: bigquery.Table) -> str:
+    if not MODEL_TIERING:
+        return PRO
+
+    if any(field.fields for field in table.schema):
+        return PRO
+    if len(table.schema) > FAST_TIER_MAX_COLUMNS:
+        return PRO
+    if (table.num_bytes or 0) > FAST_TIER_MAX_BYTES:
+        return PRO
+
+    return FAST
+
+
+def tier_of(payload: dict) -> str:
+    """Tier que generó un payload (por ejemplo, uno leído de checkpoint)."""
+    version = (payload.get("model") or {}).get("version")
+    return FAST if version == FAST_MODEL_NAME else PRO
+
+
+def escalation_reason(
+    payload: dict, table: bigquery.Table, only_columns=None
+) -> Optional[str]:
+    """
+    Motivo por el que la respuesta del tier rápido no se acepta, o None.
+    only_columns limita la cobertura exigida (generación por delta).
+    """
+    errors = validate_metadata(payload)
+    if errors:
+        record_llm_event("validation_failures")
+        return f"validación: {errors[0]}"
+
+    missing = missing_columns(
+        payload,
+        [
+            path
+            for path, _ in iter_schema_paths(table.schema)
+            if only_columns is None or path in only_columns
+        ],
+    )
+    if missing:
+        return f"cobertura: {len(missing)} columna(s) sin entrada"
+
+    accuracies = [col["accuracy"] for col in payload["columns"]]
+    if accuracies:
+        mean_accuracy = sum(accuracies) / len(accuracies)
+        if mean_accuracy < MIN_ACCURACY:
+            return f"accuracy media {mean_accuracy:.2f} < {MIN_ACCURACY}"
+
+    return None
+
+
+def generate_tiered(
+    prompt: str,
+    table: bigquery.Table,
+    retries: int = 3,
+    deadline: Optional[float] = None,
+    wire_format: Optional[Any] = None,
+    only_columns=None,
+    usage: Optional[LlmUsage] = None,
+) -> TieredResult:
+    """
+    Genera metadata con el tier que corresponde a la tabla, escalando al
+    modelo pro cuando la respuesta rápida no alcanza la calidad mínima.
+    usage acumula los intentos de ambos tiers.
+    """
+    table_fqn = f"{table.project}.{table.dataset_id}.{table.table_id}"
+
+    if choose_tier(table) == PRO:
+        payload = generate_metadata(
+            prompt,
+            retries=retries,
+            deadline=deadline,
+            wire_format=wire_format,
+            usage=usage,
+        )
+        return TieredResult(payload, PRO)
+
+    try:
+        payload = generate_metadata(
+            prompt,
+            retries=FAST_TIER_RETRIES,
+            deadline=deadline,
+            model=FAST_MODEL_NAME,
+            wire_format=wire_format,
+            usage=usage,
+        )
+        reason = escalation_reason(payload, table, only_columns)
+    except (DeadlineExceededError, PermanentError):
+        raise
+    except ProcessingError as exc:
+        reason = f"{exc.error_type}: {exc}"
+
+    if reason is None:
+        return TieredResult(payload, FAST)
+
+    logger.info(f"[{table_fqn}] Escalando a {MODEL_NAME} — {reason[:200]}")
+    payload = generate_metadata(
+        prompt,
+        retries=retries,
+        deadline=deadline,
+        wire_format=wire_format,
+        usage=usage,
+    )
+    return TieredResult(payload, PRO, escalated=True, escalation_reason=reason)
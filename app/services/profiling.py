@@ -1,10 +1,11 @@
-from typing import Any, Dict, List
+from typing import Any, Collection, Dict, List, Optional
 from google.cloud import bigquery
 import logging
 import base64
 import datetime
 import concurrent.futures
 import json
+import time
 from decimal import Decimal
 
 from app.adapters.bq_reader import get_partition_field, get_max_partition
@@ -72,9 +73,14 @@ def build_profile(
     bq_client: bigquery.Client,
     max_examples: int = 10,
     sample_percent: int = 5,
+    columns: Optional[Collection[str]] = None,
+    timings: Optional[Dict[str, int]] = None,
 ) -> Dict[str, Dict]:
     """
     Calcula estadísticas y obtiene ejemplos delegando el procesamiento a BigQuery.
+    columns restringe el perfilado (y los bytes escaneados) a esas columnas
+    de primer nivel; None = todas.
+    timings: si se pasa, acumula ahí los ms de partition_lookup.
     """
     fq_table = f"{table.project}.{table.dataset_id}.{table.table_id}"
 
@@ -82,13 +88,19 @@ def build_profile(
     partition_bq_type = _get_partition_bq_type(table, partition_field)
     max_partition = None
     if partition_field and partition_bq_type in ("TIMESTAMP", "DATE", "DATETIME"):
+        lookup_start = time.monotonic()
         max_partition = get_max_partition(bq_client, fq_table, partition_field)
+        if timings is not None:
+            timings["partition_lookup"] = timings.get("partition_lookup", 0) + int(
+                (time.monotonic() - lookup_start) * 1000
+            )
 
     # 1. Construir agregaciones por columna
     stat_parts = []
     profiled_column_names = []
 
-    for f in table.schema[:MAX_COLUMNS_TO_PROFILE]:
+    fields = [f for f in table.schema if columns is None or f.name in columns]
+    for f in fields[:MAX_COLUMNS_TO_PROFILE]:
         # Filtrar solo campos simples (no STRUCT, no ARRAY/REPEATED, no JSON/GEOGRAPHY)
         if f.mode == "REPEATED" or f.field_type in ("RECORD", "JSON", "GEOGRAPHY"):
             continue
@@ -104,6 +116,9 @@ def build_profile(
             ) as `{name}`
         """)
 
+    if not stat_parts:
+        return {}
+
     stats_select = ",\n".join(stat_parts)
 
     # 2. Manejo de Partición y Muestreo
@@ -164,8 +179,10 @@ def build_profile(
             f"No se pudieron obtener estadísticas para {fq_table}: {e}. Ejecutando fallback de ejemplos."
         )
         try:
+            select_list = ", ".join(f"`{f.name}`" for f in fields) or "*"
             fallback_query = (
-                f"SELECT * FROM `{fq_table}` WHERE {where_clause} LIMIT {max_examples}"
+                f"SELECT {select_list} FROM `{fq_table}` "
+                f"WHERE {where_clause} LIMIT {max_examples}"
             )
             fallback_results = bq_client.query(
                 fallback_query, job_config=job_config
@@ -175,7 +192,7 @@ def build_profile(
                 return {}
 
             profile = {}
-            for field in table.schema:
+            for field in fields:
                 vals = [getattr(r, field.name, None) for r in fallback_rows]
                 profile[field.name] = {
                     "type": field.field_type,
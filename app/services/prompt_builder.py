@@ -1,3 +1,14 @@
+import os
+
+from app.adapters.bq_reader import iter_schema_paths
+
+# Formato de salida del modelo: "compact" (columnas por índice, ver
+# app.services.wire_format) o "full" (el contrato METADATA_SCHEMA literal)
+COMPACT_OUTPUT = os.getenv("LLM_WIRE_FORMAT", "compact").strip().lower() == "compact"
+
+# Máximo de columnas ya documentadas que se muestran como contexto
+MAX_CONTEXT_COLUMNS = 150
+
 DOMAIN_CONTEXT = """
 ==================================================
 CONTEXTO DE DOMINIO (SOLO PARA DESAMBIGUAR NOMBRES)
@@ -13,38 +24,176 @@ que no estén evidenciados explícitamente en el esquema, desc_bq o ejemplos.
 """
 
 
-def build_prompt(table, profile: dict) -> str:
+def prompt_columns(table, only_columns=None) -> list:
+    """
+    Rutas de las columnas listadas en el prompt, en orden: la posición es el
+    índice que usa el formato compacto.
+    """
+    return [
+        path
+        for path, _ in iter_schema_paths(table.schema)
+        if only_columns is None or path in only_columns
+    ]
+
+
+def _full_output_format(fq_table: str) -> str:
+    return f"""{{
+  "table_fqn": "{fq_table}",
+  "table_description": {{
+    "description": "texto",
+    "accuracy": 0.0
+  }},
+  "columns": [
+    {{
+      "name": "nombre_columna",
+      "description": "texto",
+      "accuracy": 0.0,
+      "is_computed": false,
+      "sensitivity": false
+    }}
+  ]
+}}"""
+
+
+_COMPACT_OUTPUT_FORMAT = """{
+  "t": {"d": "descripción de la tabla", "a": 0.0},
+  "c": [
+    {"i": 0, "d": "descripción de la columna", "a": 0.0, "f": 0}
+  ]
+}
+
+- t.d / t.a : description y accuracy de la tabla.
+- c : UNA entrada por columna. i = índice [i] de la columna listada,
+  d = description, a = accuracy,
+  f = flags: 1 si is_computed, 2 si sensitivity, 3 si ambos, 0 si ninguno.
+- No repitas nombres de columna ni el FQN."""
+
+# Con flags locales el modelo solo genera descripciones
+_COMPACT_OUTPUT_FORMAT_NO_FLAGS = """{
+  "t": {"d": "descripción de la tabla", "a": 0.0},
+  "c": [
+    {"i": 0, "d": "descripción de la columna", "a": 0.0}
+  ]
+}
+
+- t.d / t.a : description y accuracy de la tabla.
+- c : UNA entrada por columna. i = índice [i] de la columna listada,
+  d = description, a = accuracy.
+- No repitas nombres de columna ni el FQN."""
+
+_FLAG_RULES = """sensitivity:
+- true  si el contenido demuestra datos personales o sensibles
+  (nombre, documento, contacto, dirección, datos financieros).
+- false en cualquier otro caso.
+
+is_computed:
+- true  si el nombre indica valor derivado:
+  rate, pct, flag, total, avg, sum, count, ratio, amount_final.
+- false en cualquier otro caso.
+"""
+
+_LOCAL_FLAG_RULES = """sensitivity / is_computed:
+- Se calculan fuera del modelo: NO los generes.
+"""
+
+
+def _context_section(known_columns: dict) -> str:
+    """Columnas ya documentadas, como contexto de solo lectura."""
+    if not known_columns:
+        return ""
+
+    lines = [
+        f"- {name}: {description}"
+        for name, description in list(known_columns.items())[:MAX_CONTEXT_COLUMNS]
+    ]
+    hidden = len(known_columns) - len(lines)
+    if hidden > 0:
+        lines.append(f"- ... ({hidden} columnas más)")
+
+    return (
+        "\nColumnas ya documentadas (SOLO CONTEXTO: no generes entradas para ellas):\n"
+        + "\n".join(lines)
+        + "\n"
+    )
+
+
+def build_prompt(
+    table,
+    profile: dict,
+    only_columns=None,
+    compact=None,
+    known_columns=None,
+    suggested_columns=None,
+    local_flags=None,
+) -> str:
     """
     Construye un prompt para que el modelo genere SOLO el JSON indicado por el contrato.
     - table: bigquery.Table
     - profile: dict con bq_description, example_values, null_ratio, distinct_ratio
+    - only_columns: rutas a incluir (reparación o delta); None = todas
+    - compact: formato de salida compacto; None = LLM_WIRE_FORMAT
+    - known_columns: {ruta: descripción} ya validadas, solo como contexto
+    - suggested_columns: {ruta: descripción} del glosario, como respuesta sugerida
+    - local_flags: flags del clasificador local; en formato compacto el modelo
+      ya no los genera (el formato completo los pide igual, para contrastar)
     Retorna: str - Prompt formateado
     """
+    if compact is None:
+        compact = COMPACT_OUTPUT
+    suggested_columns = suggested_columns or {}
     fq_table = f"{table.project}.{table.dataset_id}.{table.table_id}"
     table_desc = (table.description or "").strip() or "Sin descripción previa"
 
     schema_lines = []
-    for field in table.schema:
-        col_profile = profile.get(field.name, {}) or {}
+    # Los campos anidados se listan con su ruta completa (cliente.direccion.ciudad);
+    # el perfilado solo cubre columnas simples de primer nivel
+    for path, field in iter_schema_paths(table.schema):
+        if only_columns is not None and path not in only_columns:
+            continue
+        index_str = f"[{len(schema_lines)}] " if compact else ""
+        col_profile = profile.get(path, {}) or {}
 
         examples = col_profile.get("example_values", []) or []
         null_ratio = col_profile.get("null_ratio", None)
         dist_ratio = col_profile.get("distinct_ratio", None)
-        bq_description = (col_profile.get("bq_description", "") or "").strip()
+        bq_description = (
+            col_profile.get("bq_description", "") or field.description or ""
+        ).strip()
 
         examples_str = ", ".join(map(str, examples[:3])) if examples else "sin ejemplos"
         null_str = f"{null_ratio:.0%} nulos" if null_ratio is not None else ""
         dist_str = f"{dist_ratio:.0%} distintos" if dist_ratio is not None else ""
         stats_str = " | ".join(filter(None, [null_str, dist_str]))
         desc_str = f' | desc_bq: "{bq_description}"' if bq_description else ""
+        suggested = suggested_columns.get(path)
+        glossary_str = f' | glosario: "{suggested}"' if suggested else ""
 
         schema_lines.append(
-            f"- {field.name} [{field.field_type}, {field.mode}]"
+            f"- {index_str}{path} [{field.field_type}, {field.mode}]"
             f"{' | ' + stats_str if stats_str else ''}"
             f"{desc_str}"
+            f"{glossary_str}"
             f" | ejemplos: {examples_str}"
         )
 
+    if compact:
+        coverage_rule = (
+            "Genera exactamente UNA entrada por cada columna listada,\n"
+            "identificada por su índice [i] y sin duplicados."
+        )
+        output_format = (
+            _COMPACT_OUTPUT_FORMAT_NO_FLAGS if local_flags else _COMPACT_OUTPUT_FORMAT
+        )
+    else:
+        coverage_rule = (
+            "Genera exactamente UNA entrada por cada columna listada,\n"
+            "usando el mismo nombre y sin duplicados.\n"
+            "Para campos anidados usa la ruta completa tal como aparece\n"
+            '(por ejemplo "cliente.direccion.ciudad").'
+        )
+        output_format = _full_output_format(fq_table)
+    flag_rules = _LOCAL_FLAG_RULES if compact and local_flags else _FLAG_RULES
+
     prompt = f"""
 Eres un experto en gobierno de datos y catalogación empresarial.
 
@@ -59,7 +208,7 @@ Descripción BQ : {table_desc}
 
 Columnas (tipo, modo, estadísticas, desc_bq y ejemplos reales):
 {chr(10).join(schema_lines)}
-
+{_context_section(known_columns)}
 {DOMAIN_CONTEXT}
 
 ==================================================
@@ -115,6 +264,9 @@ Sin excepciones. No rellenes.
 Si desc_bq está presente:
 - úsala como base factual
 - puedes reformular para cumplir longitud
+Si glosario está presente, es una descripción validada para una columna
+equivalente de otra tabla: reutilízala tal cual salvo que el tipo, desc_bq
+o los ejemplos de esta tabla la contradigan.
 
 6) NULOS ALTOS
 Si null_ratio >= 0.50 (solo para campos), la descripción debe terminar EXACTAMENTE con:
@@ -130,22 +282,12 @@ No expliques causas ni contexto.
 - No incluir tipos técnicos (STRING, INT64, etc.).
 
 8) COBERTURA
-Genera exactamente UNA entrada por cada columna listada,
-usando el mismo nombre y sin duplicados.
+{coverage_rule}
 
 ==================================================
 REGLAS DE METADATOS
 ==================================================
-sensitivity:
-- true  si el contenido demuestra datos personales o sensibles
-  (nombre, documento, contacto, dirección, datos financieros).
-- false en cualquier otro caso.
-
-is_computed:
-- true  si el nombre indica valor derivado:
-  rate, pct, flag, total, avg, sum, count, ratio, amount_final.
-- false en cualquier otro caso.
-
+{flag_rules}
 accuracy — escala fija
 - 1.0 : evidencia completa e inequívoca
 - 0.8 : desc_bq clara, ejemplos limitados
@@ -159,22 +301,7 @@ FORMATO EXACTO (JSON ESTRICTO)
 Devuelve SOLO JSON válido.
 Sin markdown, sin texto adicional, sin comentarios.
 
-{{
-  "table_fqn": "{fq_table}",
-  "table_description": {{
-    "description": "texto",
-    "accuracy": 0.0
-  }},
-  "columns": [
-    {{
-      "name": "nombre_columna",
-      "description": "texto",
-      "accuracy": 0.0,
-      "is_computed": false,
-      "sensitivity": false
-    }}
-  ]
-}}
+{output_format}
 
 ==================================================
 TAREA
@@ -0,0 +1,144 @@
+"""
+Formato compacto de salida del LLM. En lugar de repetir las claves del
+contrato por cada columna, el modelo responde:
+
+    {"t": {"d": "...", "a": 0.8},
+     "c": [{"i": 0, "d": "...", "a": 0.7, "f": 2}, ...]}
+
+i es el índice de la columna en el prompt y f empaqueta los flags
+(1 = is_computed, 2 = sensitivity). Con flags locales (ver
+app.services.column_classifier) el modelo no responde f y el expander los
+completa. El expander reconstruye el payload exacto que espera
+validate_metadata (sin model ni generated_at).
+"""
+
+import copy
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from google.cloud import bigquery
+
+from app.services.column_classifier import ColumnFlags
+from app.services.prompt_builder import COMPACT_OUTPUT, prompt_columns
+
+logger = logging.getLogger(__name__)
+
+FLAG_COMPUTED = 1
+FLAG_SENSITIVE = 2
+
+COMPACT_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "t": {
+            "type": "OBJECT",
+            "properties": {
+                "d": {"type": "STRING", "maxLength": 1000},
+                "a": {"type": "NUMBER", "minimum": 0, "maximum": 1},
+            },
+            "propertyOrdering": ["d", "a"],
+            "required": ["d", "a"],
+        },
+        "c": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "i": {"type": "INTEGER", "minimum": 0},
+                    "d": {"type": "STRING", "maxLength": 1000},
+                    "a": {"type": "NUMBER", "minimum": 0, "maximum": 1},
+                    "f": {"type": "INTEGER", "minimum": 0, "maximum": 3},
+                },
+                "propertyOrdering": ["i", "d", "a", "f"],
+                "required": ["i", "d", "a", "f"],
+            },
+        },
+    },
+    "propertyOrdering": ["t", "c"],
+    "required": ["t", "c"],
+}
+
+# Variante sin flags: los decide el clasificador local
+COMPACT_RESPONSE_SCHEMA_NO_FLAGS = copy.deepcopy(COMPACT_RESPONSE_SCHEMA)
+_column_item = COMPACT_RESPONSE_SCHEMA_NO_FLAGS["properties"]["c"]["items"]
+del _column_item["properties"]["f"]
+_column_item["propertyOrdering"].remove("f")
+_column_item["required"].remove("f")
+
+
+@dataclass
+class CompactFormat:
+    table_fqn: str
+    column_names: List[str]
+    local_flags: Optional[Dict[str, ColumnFlags]] = None
+
+    @property
+    def response_schema(self) -> dict:
+        if self.local_flags:
+            return COMPACT_RESPONSE_SCHEMA_NO_FLAGS
+        return COMPACT_RESPONSE_SCHEMA
+
+    def expand(self, data):
+        """
+        Reconstruye el payload del contrato. Las entradas con índice fuera de
+        rango se descartan (la columna queda faltante y se repara); los campos
+        ausentes quedan en None para que validate_metadata los marque.
+        """
+        # respuesta ya en formato completo (p. ej. prompt de un checkpoint previo)
+        if not isinstance(data, dict) or "columns" in data:
+            return data
+
+        table = data.get("t") if isinstance(data.get("t"), dict) else {}
+        columns = []
+        for item in data.get("c") or []:
+            if not isinstance(item, dict):
+                continue
+            index = item.get("i")
+            if not isinstance(index, int) or not 0 <= index < len(self.column_names):
+                logger.warning(
+                    f"[{self.table_fqn}] Índice de columna fuera de rango: {index}"
+                )
+                continue
+
+            name = self.column_names[index]
+            local = (self.local_flags or {}).get(name)
+            flags = item.get("f")
+            if local is not None:
+                flags = (FLAG_COMPUTED if local.is_computed else 0) | (
+                    FLAG_SENSITIVE if local.sensitivity else 0
+                )
+            has_flags = isinstance(flags, int)
+            columns.append(
+                {
+                    "name": name,
+                    "description": item.get("d"),
+                    "accuracy": item.get("a"),
+                    "is_computed": bool(flags & FLAG_COMPUTED) if has_flags else None,
+                    "sensitivity": bool(flags & FLAG_SENSITIVE) if has_flags else None,
+                }
+            )
+
+        return {
+            "table_fqn": self.table_fqn,
+            "table_description": {
+                "description": table.get("d"),
+                "accuracy": table.get("a"),
+            },
+            "columns": columns,
+        }
+
+
+def compact_format_for(
+    table: bigquery.Table, only_columns=None, local_flags=None
+) -> Optional[CompactFormat]:
+    """
+    Formato compacto para un prompt de build_prompt sobre table (con el mismo
+    only_columns y local_flags), o None si LLM_WIRE_FORMAT=full.
+    """
+    if not COMPACT_OUTPUT:
+        return None
+    return CompactFormat(
+        table_fqn=f"{table.project}.{table.dataset_id}.{table.table_id}",
+        column_names=prompt_columns(table, only_columns),
+        local_flags=local_flags,
+    )
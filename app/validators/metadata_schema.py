@@ -55,6 +55,77 @@ METADATA_SCHEMA = {
 
 validator = Draft7Validator(METADATA_SCHEMA)
 
+# Campos que agrega el pipeline (stamp_metadata), no el modelo
+_PIPELINE_FIELDS = ("model", "generated_at")
+
+# Restricciones de JSON Schema que response_schema también admite
+_OPENAPI_KEYWORDS = ("minimum", "maximum", "minLength", "maxLength")
+
+
+def _to_openapi(node: dict) -> dict:
+    schema = {"type": node["type"].upper()}
+    for key in _OPENAPI_KEYWORDS:
+        if key in node:
+            schema[key] = node[key]
+
+    if "properties" in node:
+        schema["properties"] = {
+            name: _to_openapi(child) for name, child in node["properties"].items()
+        }
+        # el orden de las propiedades guía el orden de decodificación
+        schema["propertyOrdering"] = list(node["properties"])
+        schema["required"] = list(node.get("required", []))
+    if "items" in node:
+        schema["items"] = _to_openapi(node["items"])
+
+    return schema
+
+
+def build_response_schema() -> dict:
+    """
+    METADATA_SCHEMA en el subconjunto OpenAPI que acepta response_schema de
+    Vertex AI, sin los campos que agrega el pipeline.
+    """
+    contract = dict(METADATA_SCHEMA)
+    contract["properties"] = {
+        name: prop
+        for name, prop in METADATA_SCHEMA["properties"].items()
+        if name not in _PIPELINE_FIELDS
+    }
+    contract["required"] = [
+        name for name in METADATA_SCHEMA["required"] if name not in _PIPELINE_FIELDS
+    ]
+    return _to_openapi(contract)
+
+
+RESPONSE_SCHEMA = build_response_schema()
+
 
 def validate_metadata(payload: dict) -> list[str]:
     return [e.message for e in validator.iter_errors(payload)]
+
+
+def split_errors(payload: dict) -> tuple[set[int], list[str]]:
+    """
+    Separa los errores de contrato en (índices de payload["columns"] con
+    errores, errores fuera de las columnas).
+    """
+    column_indexes: set[int] = set()
+    other_errors: list[str] = []
+
+    for error in validator.iter_errors(payload):
+        path = list(error.absolute_path)
+        if len(path) >= 2 and path[0] == "columns" and isinstance(path[1], int):
+            column_indexes.add(path[1])
+        else:
+            other_errors.append(error.message)
+
+    return column_indexes, other_errors
+
+
+def missing_columns(payload: dict, expected_names) -> list[str]:
+    """
+    Columnas del schema sin entrada en payload["columns"] (en orden del schema).
+    """
+    returned = {col.get("name") for col in payload.get("columns", []) or []}
+    return [name for name in expected_names if name not in returned]
@@ -0,0 +1,453 @@
+"""
+Fakes en proceso de BigQuery, Vertex AI (genai) y Dataplex para medir el job
+sin cuota ni credenciales.
+
+Las latencias se expresan en tiempo "real" de producción y se duermen
+multiplicadas por time_scale, igual que los back-off del código (ScaledTime):
+un escenario de una hora corre en segundos y los resultados se reescalan.
+"""
+
+import json
+import math
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+
+import requests
+from google.cloud import bigquery
+from google.cloud.bigquery.table import Row
+
+
+# ─── tiempo ─────────────────────────────────────────────────────────────────
+
+
+class ScaledTime:
+    """
+    Reemplazo del módulo time para los módulos bajo prueba: sleep se escala,
+    el resto (time, monotonic, ...) es el reloj real.
+    """
+
+    def __init__(self, scale: float):
+        self.scale = scale
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(max(0.0, seconds) * self.scale)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+@dataclass(frozen=True)
+class Latency:
+    """Lognormal con mediana y p95 en ms (tiempo de producción)."""
+
+    median_ms: float
+    p95_ms: float
+
+    def sample(self, rng: random.Random) -> float:
+        if self.p95_ms <= self.median_ms:
+            return self.median_ms
+        sigma = math.log(self.p95_ms / self.median_ms) / 1.645
+        return rng.lognormvariate(math.log(self.median_ms), sigma)
+
+
+class _Sim:
+    """Estado compartido por los fakes: RNG con lock y escala de tiempo."""
+
+    def __init__(self, seed: int, time_scale: float):
+        self.rng = random.Random(seed)
+        self.time_scale = time_scale
+        self._lock = threading.Lock()
+
+    def draw(self, latency: Latency, extra_ms: float = 0.0) -> float:
+        with self._lock:
+            return latency.sample(self.rng) + extra_ms
+
+    def chance(self, probability: float) -> bool:
+        with self._lock:
+            return self.rng.random() < probability
+
+    def uniform(self, low: float, high: float) -> float:
+        with self._lock:
+            return self.rng.uniform(low, high)
+
+    def choice(self, values, weights=None):
+        with self._lock:
+            return self.rng.choices(values, weights=weights)[0]
+
+    def wait_ms(self, ms: float) -> None:
+        time.sleep(ms / 1000 * self.time_scale)
+
+
+# ─── tablas sintéticas ──────────────────────────────────────────────────────
+
+
+@dataclass(frozen=True)
+class TableShape:
+    columns: int
+    size_bytes: int
+    nested: bool = False
+    partitioned: bool = False
+
+
+_COLUMN_KINDS = (
+    ("num_poliza", "STRING", lambda r, i: f"POL-{r.randint(1, 999999):06d}"),
+    ("cod_producto", "STRING", lambda r, i: f"P{r.randint(1, 99):02d}"),
+    ("mto_prima_total", "NUMERIC", lambda r, i: round(r.uniform(10, 5000), 2)),
+    ("nro_documento", "STRING", lambda r, i: f"{r.randint(10000000, 99999999)}"),
+    ("email_contacto", "STRING", lambda r, i: f"user{i}@correo.pe"),
+    ("fec_emision", "DATE", lambda r, i: f"2024-{r.randint(1, 12):02d}-01"),
+    ("flg_vigente", "BOOL", lambda r, i: r.random() < 0.5),
+    ("des_cobertura", "STRING", lambda r, i: r.choice(["Vida", "Salud", "SOAT"])),
+)
+
+
+def build_schema(shape: TableShape) -> List[bigquery.SchemaField]:
+    fields = []
+    for i in range(shape.columns):
+        name, field_type, _ = _COLUMN_KINDS[i % len(_COLUMN_KINDS)]
+        fields.append(bigquery.SchemaField(f"{name}_{i}", field_type))
+    if shape.partitioned:
+        fields.append(bigquery.SchemaField("fec_proceso", "DATE"))
+    if shape.nested:
+        fields.append(
+            bigquery.SchemaField(
+                "cliente",
+                "RECORD",
+                fields=[
+                    bigquery.SchemaField("nombre", "STRING"),
+                    bigquery.SchemaField("direccion", "STRING"),
+                ],
+            )
+        )
+    return fields
+
+
+def _example_values(rng: random.Random, name: str, count: int) -> list:
+    for prefix, _, make in _COLUMN_KINDS:
+        if name.startswith(prefix):
+            return [make(rng, i) for i in range(count)]
+    return [f"valor_{i}" for i in range(count)]
+
+
+def _row(values: dict) -> Row:
+    return Row(tuple(values.values()), {k: i for i, k in enumerate(values)})
+
+
+# ─── BigQuery ───────────────────────────────────────────────────────────────
+
+
+@dataclass(frozen=True)
+class BigQueryProfile:
+    metadata: Latency = Latency(80, 250)
+    partition_lookup: Latency = Latency(400, 1500)
+    profiling: Latency = Latency(2500, 9000)
+    profiling_per_gb_ms: float = 150.0
+    dml: Latency = Latency(1500, 4000)
+    ddl: Latency = Latency(1200, 3000)
+    update_table: Latency = Latency(600, 1500)
+
+
+class _QueryJob:
+    def __init__(self, rows: List[Row], affected: int = 0):
+        self._rows = rows
+        self.num_dml_affected_rows = affected
+
+    def result(self, timeout=None):
+        return iter(self._rows)
+
+
+class FakeBigQueryClient:
+    """
+    Cliente BigQuery en memoria. Reconoce por forma el SQL que emite el
+    repo (claim/fetch/MERGE/release del tracker, perfilado, particiones,
+    scripts DDL) y responde con filas sintéticas tras la latencia simulada.
+    """
+
+    def __init__(self, sim: _Sim, profile: BigQueryProfile, tracker_table: str):
+        self.sim = sim
+        self.profile = profile
+        self.tracker_table = tracker_table
+        self.tables: Dict[str, bigquery.Table] = {}
+        self.tracker: Dict[Tuple[str, str, str], dict] = {}
+        self.merged_rows: List[dict] = []
+        self._lock = threading.Lock()
+
+    # --- registro del backlog ---
+
+    def add_table(self, fqn: str, shape: TableShape) -> None:
+        table = bigquery.Table(fqn, schema=build_schema(shape))
+        table._properties["numBytes"] = str(shape.size_bytes)
+        table._properties["numRows"] = str(max(1, shape.size_bytes // 200))
+        if shape.partitioned:
+            table.time_partitioning = bigquery.TimePartitioning(field="fec_proceso")
+        self.tables[fqn] = table
+
+        catalog, schema, name = fqn.split(".")
+        self.tracker[(catalog, schema, name)] = {
+            "catalog": catalog,
+            "schema": schema,
+            "table": name,
+            "estado": None,
+            "job_id": None,
+            "duration_ms": None,
+            "size_bytes": shape.size_bytes,
+            "num_columns": len(table.schema),
+            "attempts": 0,
+            "aspect_hash": None,
+            "payload_snapshot": None,
+        }
+
+    # --- API usada por el repo ---
+
+    def get_table(self, table_id) -> bigquery.Table:
+        self.sim.wait_ms(self.sim.draw(self.profile.metadata))
+        return self.tables[str(table_id)]
+
+    def update_table(self, table, fields):
+        self.sim.wait_ms(self.sim.draw(self.profile.update_table))
+        return table
+
+    def query(self, sql: str, job_config=None) -> _QueryJob:
+        params = {
+            p.name: p.value
+            for p in getattr(job_config, "query_parameters", None) or []
+        }
+
+        if self.tracker_table in sql:
+            return self._tracker_query(sql, params)
+        if "INFORMATION_SCHEMA.PARTITIONS" in sql:
+            self.sim.wait_ms(self.sim.draw(self.profile.partition_lookup))
+            return _QueryJob([_row({"max_id": "20240601"})])
+        if sql.lstrip().startswith("SELECT COUNT(*) as total_rows"):
+            return self._profile_query(sql)
+
+        # DDL por lotes (ALTER TABLE SET OPTIONS), glosario, etc.
+        self.sim.wait_ms(self.sim.draw(self.profile.ddl))
+        return _QueryJob([])
+
+    # --- tracker ---
+
+    def _tracker_query(self, sql: str, params: dict) -> _QueryJob:
+        self.sim.wait_ms(self.sim.draw(self.profile.dml))
+        with self._lock:
+            if re.search(r"SET\s+job_id\s*=\s*@job_id", sql):
+                limit = int(re.search(r"<=\s*(\d+)", sql).group(1))
+                pending = [
+                    row
+                    for row in self.tracker.values()
+                    if row["job_id"] is None and row["estado"] in (None, "ERROR")
+                ]
+                for row in pending[:limit]:
+                    row["job_id"] = params["job_id"]
+                    row["estado"] = "PROCESSING"
+                return _QueryJob([], affected=min(limit, len(pending)))
+
+            if sql.lstrip().startswith("SELECT") and "@job_id" in sql:
+                columns = (
+                    "catalog", "schema", "table", "duration_ms", "size_bytes",
+                    "num_columns", "attempts", "aspect_hash",
+                )
+                return _QueryJob(
+                    [
+                        _row(
+                            {
+                                **{c: row[c] for c in columns},
+                                "has_snapshot": row["payload_snapshot"] is not None,
+                            }
+                        )
+                        for row in self.tracker.values()
+                        if row["job_id"] == params["job_id"]
+                    ]
+                )
+
+            if sql.lstrip().startswith("MERGE"):
+                for item in json.loads(params["payload"]):
+                    self.merged_rows.append(item)
+                    key = (item["catalog"], item["schema"], item["table"])
+                    row = self.tracker[key]
+                    row["estado"] = item["estado"]
+                    if item["estado"] in ("ERROR", "BATCH"):
+                        row["job_id"] = None
+                    if item.get("duration_ms") is not None:
+                        row["duration_ms"] = item["duration_ms"]
+                return _QueryJob([])
+
+            if "estado = 'PROCESSING'" in sql and "job_id" in params:
+                released = 0
+                for row in self.tracker.values():
+                    if (
+                        row["job_id"] == params["job_id"]
+                        and row["estado"] == "PROCESSING"
+                    ):
+                        row["job_id"] = None
+                        row["estado"] = None
+                        released += 1
+                return _QueryJob([], affected=released)
+
+        # ALTER TABLE ADD COLUMN IF NOT EXISTS y similares
+        return _QueryJob([])
+
+    # --- perfilado ---
+
+    def _profile_query(self, sql: str) -> _QueryJob:
+        fqn = re.search(r"FROM `([^`]+)`", sql).group(1)
+        table = self.tables[fqn]
+        gb = (table.num_bytes or 0) / 1e9
+        self.sim.wait_ms(
+            self.sim.draw(self.profile.profiling, self.profile.profiling_per_gb_ms * gb)
+        )
+
+        total_rows = 1000
+        values = {"total_rows": total_rows}
+        for name in re.findall(r"\) as `([^`]+)`", sql):
+            with self.sim._lock:
+                examples = _example_values(self.sim.rng, name, 50)
+                nulls = self.sim.rng.randint(0, total_rows // 2)
+            values[name] = {
+                "null_count": nulls,
+                "dist_count": len(set(map(str, examples))),
+                "non_null_count": total_rows - nulls,
+                "examples": examples,
+            }
+        return _QueryJob([_row(values)])
+
+
+# ─── Vertex AI (genai) ──────────────────────────────────────────────────────
+
+
+@dataclass(frozen=True)
+class LlmProfile:
+    latency: Latency = Latency(18000, 45000)
+    per_column_ms: float = 250.0
+    rate_limit_rate: float = 0.0
+    # el 429 llega rápido: cuota rechazada antes de generar
+    rate_limit_latency: Latency = Latency(300, 900)
+    thinking_tokens: int = 1024
+
+
+_COMPACT_LINE = re.compile(r"^- \[(\d+)\] (\S+) \[")
+_FULL_LINE = re.compile(r"^- (\S+) \[[A-Z0-9]+, [A-Z]+\]")
+
+_DESCRIPTION = (
+    "Dato registrado en la tabla para cada fila del proceso de emisión, "
+    "expresado con el formato observado en los ejemplos y sin transformaciones "
+    "adicionales documentadas en la fuente analizada."
+)
+
+
+class _FakeModels:
+    def __init__(self, sim: _Sim, profile: LlmProfile, counters: Dict[str, int]):
+        self.sim = sim
+        self.profile = profile
+        self.counters = counters
+
+    def generate_content(self, model: str, contents: str, config=None):
+        if self.sim.chance(self.profile.rate_limit_rate):
+            self.sim.wait_ms(self.sim.draw(self.profile.rate_limit_latency))
+            self.counters["rate_limited"] += 1
+            raise RuntimeError("429 RESOURCE_EXHAUSTED (simulado)")
+
+        lines = contents.splitlines()
+        compact = [m.groups() for m in map(_COMPACT_LINE.match, lines) if m]
+        columns = compact or [
+            (None, m.group(1)) for m in map(_FULL_LINE.match, lines) if m
+        ]
+        self.sim.wait_ms(
+            self.sim.draw(self.profile.latency, self.profile.per_column_ms * len(columns))
+        )
+        self.counters["generated"] += 1
+
+        accuracy = round(self.sim.uniform(0.7, 0.95), 2)
+        if compact:
+            with_flags = '"f":' in contents
+            data = {
+                "t": {"d": _DESCRIPTION, "a": accuracy},
+                "c": [
+                    dict(
+                        {"i": int(index), "d": _DESCRIPTION, "a": accuracy},
+                        **({"f": 0} if with_flags else {}),
+                    )
+                    for index, _ in compact
+                ],
+            }
+        else:
+            fqn = re.search(r"FQN\s*:\s*(\S+)", contents).group(1)
+            data = {
+                "table_fqn": fqn,
+                "table_description": {"description": _DESCRIPTION, "accuracy": accuracy},
+                "columns": [
+                    {
+                        "name": name,
+                        "description": _DESCRIPTION,
+                        "accuracy": accuracy,
+                        "is_computed": False,
+                        "sensitivity": False,
+                    }
+                    for _, name in columns
+                ],
+            }
+
+        text = json.dumps(data, ensure_ascii=False)
+        return SimpleNamespace(
+            text=text,
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=len(contents) // 4,
+                candidates_token_count=len(text) // 4,
+                thoughts_token_count=self.profile.thinking_tokens,
+            ),
+        )
+
+
+class FakeGenaiClient:
+    def __init__(self, sim: _Sim, profile: LlmProfile):
+        self.counters: Dict[str, int] = {"generated": 0, "rate_limited": 0}
+        self.models = _FakeModels(sim, profile, self.counters)
+
+
+# ─── Dataplex ───────────────────────────────────────────────────────────────
+
+
+@dataclass(frozen=True)
+class DataplexProfile:
+    latency: Latency = Latency(700, 2500)
+    rate_limit_rate: float = 0.0
+
+
+class _FakeResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.text = "" if status_code < 400 else '{"error": "simulado"}'
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"HTTP {self.status_code}")
+
+
+class FakeDataplexSession:
+    """Reemplazo de la AuthorizedSession compartida de dataplex_writer."""
+
+    def __init__(self, sim: _Sim, profile: DataplexProfile):
+        self.sim = sim
+        self.profile = profile
+        self.patches = 0
+
+    def patch(self, url, params=None, json=None, timeout=None) -> _FakeResponse:
+        self.sim.wait_ms(self.sim.draw(self.profile.latency))
+        if self.sim.chance(self.profile.rate_limit_rate):
+            return _FakeResponse(429)
+        self.patches += 1
+        return _FakeResponse(200)
+
+
+def new_sim(seed: int, time_scale: float) -> _Sim:
+    return _Sim(seed, time_scale)
+
+
+def table_fqns(count: int, project: str = "bench-project") -> List[str]:
+    # sin sufijo de período: no deben agruparse como familias shardeadas
+    return [f"{project}.dataset_{i % 20:02d}.tabla_{i:05d}_bench" for i in range(count)]
@@ -0,0 +1,364 @@
+"""
+Micro-benchmarks del CPU propio por columna: _normalize_for_hash,
+_to_display, la deduplicación de ejemplos de build_profile (dict.fromkeys)
+y el armado de líneas de schema de build_prompt. Corre sobre schemas
+bigquery.Table sintéticos de 50 a 900 columnas, con ejemplos anidados
+(STRUCT/ARRAY), BYTES, Decimal y datetime, y reporta tiempo y memoria pico
+(tracemalloc) por caso y tamaño de tabla.
+
+    python -m bench.micro                     # reporte
+    python -m bench.micro --check             # falla (exit 1) si supera umbrales
+    python -m bench.micro --update-thresholds # regraba bench/micro_thresholds.json
+
+Los umbrales guardan el valor medido multiplicado por un margen
+(THRESHOLD_HEADROOM, con un piso absoluto), porque el tiempo depende de la
+máquina: regrábalos en la misma máquina donde se corre --check.
+bench.throughput no sirve para esto: ahí el CPU aparece amplificado por
+1 / time_scale.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional
+
+from google.cloud import bigquery
+
+from bench.fakes import _row
+from app.adapters.bq_reader import iter_schema_paths
+from app.services.profiling import _normalize_for_hash, _to_display, build_profile
+from app.services.prompt_builder import build_prompt
+
+SIZES = (50, 300, 900)
+THRESHOLDS_PATH = os.path.join(os.path.dirname(__file__), "micro_thresholds.json")
+
+# margen sobre lo medido al regrabar umbrales (tiempo, memoria)
+THRESHOLD_HEADROOM = {"ms": 3.0, "peak_kib": 1.5}
+# piso absoluto: los casos de menos de un ms son puro ruido de scheduling
+THRESHOLD_FLOOR = {"ms": 5.0, "peak_kib": 256.0}
+
+# ARRAY_AGG de build_profile trae max_examples * 5 valores por columna
+MAX_EXAMPLES = 10
+RAW_EXAMPLES = MAX_EXAMPLES * 5
+
+_UTC_MINUS_5 = datetime.timezone(datetime.timedelta(hours=-5))
+
+
+# ─── schema y valores sintéticos ────────────────────────────────────────────
+
+
+def _struct_fields() -> List[bigquery.SchemaField]:
+    return [
+        bigquery.SchemaField("nombre", "STRING"),
+        bigquery.SchemaField("fec_alta", "TIMESTAMP"),
+        bigquery.SchemaField(
+            "direccion",
+            "RECORD",
+            fields=[
+                bigquery.SchemaField("ciudad", "STRING"),
+                bigquery.SchemaField("ubigeo", "INT64"),
+            ],
+        ),
+        bigquery.SchemaField("coberturas", "STRING", mode="REPEATED"),
+    ]
+
+
+def _kinds():
+    """(prefijo, tipo, modo, generador) en proporciones de una tabla real."""
+    return (
+        ("num_poliza", "STRING", "NULLABLE", lambda r: f"POL-{r.randint(1, 5000):06d}"),
+        (
+            "des_cobertura",
+            "STRING",
+            "NULLABLE",
+            lambda r: r.choice(["Vida", "Salud", "SOAT", "Vehicular"]),
+        ),
+        ("cnt_siniestros", "INT64", "NULLABLE", lambda r: r.randint(0, 50)),
+        (
+            "mto_prima",
+            "NUMERIC",
+            "NULLABLE",
+            lambda r: Decimal(r.randint(1000, 999999)) / 100,
+        ),
+        (
+            "fec_emision",
+            "DATE",
+            "NULLABLE",
+            lambda r: datetime.date(2024, r.randint(1, 12), r.randint(1, 28)),
+        ),
+        (
+            "fec_registro",
+            "TIMESTAMP",
+            "NULLABLE",
+            lambda r: datetime.datetime(
+                2024, r.randint(1, 12), 1, r.randint(0, 23), tzinfo=_UTC_MINUS_5
+            ),
+        ),
+        (
+            "fec_proceso",
+            "DATETIME",
+            "NULLABLE",
+            lambda r: datetime.datetime(2024, 1, r.randint(1, 28), r.randint(0, 23)),
+        ),
+        ("hash_documento", "BYTES", "NULLABLE", lambda r: r.randbytes(16)),
+        ("flg_vigente", "BOOL", "NULLABLE", lambda r: r.random() < 0.5),
+        ("cliente", "RECORD", "NULLABLE", _struct_value),
+        (
+            "cod_ramos",
+            "STRING",
+            "REPEATED",
+            lambda r: [f"R{r.randint(1, 30):02d}" for _ in range(r.randint(1, 4))],
+        ),
+        (
+            "atributos",
+            "JSON",
+            "NULLABLE",
+            lambda r: {
+                "canal": r.choice(["web", "agencia"]),
+                "score": r.random(),
+                "tags": [r.randint(1, 9)],
+            },
+        ),
+    )
+
+
+def _struct_value(rng: random.Random) -> dict:
+    return {
+        "nombre": rng.choice(["Ana Díaz", "Luis Quispe", "María Torres"]),
+        "fec_alta": datetime.datetime(
+            2023, rng.randint(1, 12), 1, tzinfo=datetime.timezone.utc
+        ),
+        "direccion": {
+            "ciudad": rng.choice(["Lima", "Arequipa"]),
+            "ubigeo": rng.randint(10000, 99999),
+        },
+        "coberturas": [rng.choice(["Vida", "Salud"]) for _ in range(rng.randint(0, 3))],
+    }
+
+
+def synthetic_table(columns: int, seed: int = 7) -> tuple:
+    """(bigquery.Table, {columna: valores crudos}); las columnas rotan en _kinds()."""
+    rng = random.Random(seed)
+    kinds = _kinds()
+    fields = []
+    values = {}
+    for i in range(columns):
+        prefix, field_type, mode, make = kinds[i % len(kinds)]
+        name = f"{prefix}_{i}"
+        sub_fields = _struct_fields() if field_type == "RECORD" else ()
+        fields.append(
+            bigquery.SchemaField(
+                name,
+                field_type,
+                mode=mode,
+                description=f"Campo {name}",
+                fields=sub_fields,
+            )
+        )
+        # valores repetidos a propósito: la deduplicación tiene trabajo real
+        values[name] = [make(rng) for _ in range(RAW_EXAMPLES)]
+
+    table = bigquery.Table(f"bench-project.micro.tabla_{columns}", schema=fields)
+    table.description = "Tabla sintética para micro-benchmarks"
+    return table, values
+
+
+class _StaticQueryJob:
+    def __init__(self, row):
+        self._row = row
+
+    def result(self, timeout=None):
+        return iter([self._row])
+
+
+class _StaticProfileClient:
+    """Devuelve siempre la misma fila de perfilado: solo se mide el CPU local."""
+
+    def __init__(self, table: bigquery.Table, values: Dict[str, list]):
+        total_rows = 1000
+        row = {"total_rows": total_rows}
+        for field in table.schema:
+            examples = values[field.name]
+            row[field.name] = {
+                "null_count": 10,
+                "dist_count": len(examples),
+                "non_null_count": total_rows - 10,
+                "examples": examples,
+            }
+        self._job = _StaticQueryJob(_row(row))
+
+    def query(self, sql: str, job_config=None) -> _StaticQueryJob:
+        return self._job
+
+
+# ─── medición ───────────────────────────────────────────────────────────────
+
+
+def measure(fn: Callable[[], object], repeat: int) -> Dict[str, float]:
+    """Mediana de ms por llamada y memoria pico (KiB) de una llamada aparte."""
+    fn()  # calentamiento
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    # tracemalloc ralentiza: la memoria se mide fuera de las muestras de tiempo
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "ms": round(statistics.median(samples), 3),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def _cases(columns: int, seed: int) -> Dict[str, Callable[[], object]]:
+    table, values = synthetic_table(columns, seed)
+    all_values = [value for column in values.values() for value in column]
+    client = _StaticProfileClient(table, values)
+    profile = build_profile(table, client, max_examples=MAX_EXAMPLES)
+    # el perfilado cubre solo columnas simples y hasta MAX_COLUMNS_TO_PROFILE;
+    # para el prompt se completan las demás como si vinieran del perfil
+    for path, field in iter_schema_paths(table.schema):
+        profile.setdefault(
+            path,
+            {
+                "example_values": [_to_display(v) for v in values.get(path, [])[:3]],
+                "null_ratio": 0.01,
+                "distinct_ratio": 0.5,
+            },
+        )
+
+    return {
+        "normalize_for_hash": lambda: [_normalize_for_hash(v) for v in all_values],
+        "to_display": lambda: [_to_display(v) for v in all_values],
+        "profile_dedupe": lambda: build_profile(
+            table, client, max_examples=MAX_EXAMPLES
+        ),
+        "prompt_schema": lambda: build_prompt(table, profile, compact=True),
+    }
+
+
+def run(sizes=SIZES, repeat: int = 5, seed: int = 7) -> Dict[str, Dict[str, dict]]:
+    """{caso: {columnas: {ms, peak_kib}}}"""
+    results: Dict[str, Dict[str, dict]] = {}
+    for columns in sizes:
+        for case, fn in _cases(columns, seed).items():
+            results.setdefault(case, {})[str(columns)] = measure(fn, repeat)
+    return results
+
+
+# ─── umbrales ───────────────────────────────────────────────────────────────
+
+
+def load_thresholds(path: str = THRESHOLDS_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def thresholds_from(results: dict) -> dict:
+    return {
+        case: {
+            size: {
+                metric: round(
+                    max(value * THRESHOLD_HEADROOM[metric], THRESHOLD_FLOOR[metric]), 1
+                )
+                for metric, value in measured.items()
+            }
+            for size, measured in by_size.items()
+        }
+        for case, by_size in results.items()
+    }
+
+
+def regressions(results: dict, thresholds: dict) -> List[str]:
+    found = []
+    for case, by_size in results.items():
+        for size, measured in by_size.items():
+            limits = (thresholds.get(case) or {}).get(size) or {}
+            for metric, limit in limits.items():
+                if measured.get(metric, 0) > limit:
+                    found.append(
+                        f"{case}[{size} columnas] {metric}={measured[metric]} > {limit}"
+                    )
+    return found
+
+
+def _print_table(results: dict, thresholds: dict) -> None:
+    header = (
+        f"{'caso':<20} {'columnas':>8} {'ms':>10} {'umbral':>10} "
+        f"{'pico KiB':>10} {'umbral':>10}"
+    )
+    print(header)
+    print("-" * len(header))
+    for case, by_size in results.items():
+        for size, measured in by_size.items():
+            limits = (thresholds.get(case) or {}).get(size) or {}
+            print(
+                f"{case:<20} {size:>8} {measured['ms']:>10.3f} "
+                f"{limits.get('ms', '-'):>10} {measured['peak_kib']:>10.1f} "
+                f"{limits.get('peak_kib', '-'):>10}"
+            )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=list(SIZES),
+        help="cantidad de columnas de cada tabla sintética",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument(
+        "--check", action="store_true", help="exit 1 si algún caso supera su umbral"
+    )
+    parser.add_argument(
+        "--update-thresholds",
+        action="store_true",
+        help=f"regraba {os.path.basename(THRESHOLDS_PATH)} con lo medido",
+    )
+    parser.add_argument("--json", help="archivo donde guardar el reporte completo")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, repeat=args.repeat, seed=args.seed)
+
+    if args.update_thresholds:
+        with open(THRESHOLDS_PATH, "w", encoding="utf-8") as fh:
+            json.dump(thresholds_from(results), fh, indent=2)
+            fh.write("\n")
+
+    thresholds = load_thresholds()
+    _print_table(results, thresholds)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+
+    if args.check:
+        found = regressions(results, thresholds)
+        if found:
+            print("\nRegresiones:")
+            for line in found:
+                print(f"  {line}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
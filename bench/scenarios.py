@@ -0,0 +1,83 @@
+"""
+Escenarios del benchmark de throughput: backlog (cantidad y mezcla de
+tamaños), concurrencia y comportamiento de cada servicio simulado.
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, Tuple
+
+from bench.fakes import (
+    BigQueryProfile,
+    DataplexProfile,
+    Latency,
+    LlmProfile,
+    TableShape,
+)
+
+GB = 1024**3
+
+# (peso, forma): la mezcla típica del lago, mayoría de tablas chicas
+DEFAULT_MIX: Tuple[Tuple[float, TableShape], ...] = (
+    (0.60, TableShape(columns=15, size_bytes=int(0.2 * GB))),
+    (0.25, TableShape(columns=60, size_bytes=5 * GB, partitioned=True)),
+    (0.10, TableShape(columns=150, size_bytes=80 * GB, partitioned=True)),
+    (0.05, TableShape(columns=40, size_bytes=2 * GB, nested=True)),
+)
+
+WIDE_MIX: Tuple[Tuple[float, TableShape], ...] = (
+    (0.50, TableShape(columns=300, size_bytes=20 * GB, partitioned=True)),
+    (0.50, TableShape(columns=900, size_bytes=150 * GB, partitioned=True)),
+)
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    description: str
+    tables: int = 200
+    size_mix: Tuple[Tuple[float, TableShape], ...] = DEFAULT_MIX
+    max_workers: int = 10
+    dataplex_async: bool = True
+    bq_batch_writes: bool = True
+    bigquery: BigQueryProfile = field(default_factory=BigQueryProfile)
+    llm: LlmProfile = field(default_factory=LlmProfile)
+    dataplex: DataplexProfile = field(default_factory=DataplexProfile)
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    s.name: s
+    for s in (
+        Scenario(
+            name="baseline",
+            description="Mezcla típica, 10 workers, sin 429",
+        ),
+        Scenario(
+            name="workers_30",
+            description="Mezcla típica con 30 workers",
+            max_workers=30,
+        ),
+        Scenario(
+            name="rate_limited",
+            description="15% de 429 en Vertex y 5% en Dataplex",
+            llm=LlmProfile(rate_limit_rate=0.15),
+            dataplex=DataplexProfile(rate_limit_rate=0.05),
+        ),
+        Scenario(
+            name="sync_writes",
+            description="Escrituras síncronas (sin lotes BQ ni publisher Dataplex)",
+            dataplex_async=False,
+            bq_batch_writes=False,
+        ),
+        Scenario(
+            name="wide_tables",
+            description="Tablas de 300 a 900 columnas",
+            tables=60,
+            size_mix=WIDE_MIX,
+        ),
+        Scenario(
+            name="slow_llm",
+            description="Vertex degradado: mediana 40s, p95 120s",
+            llm=LlmProfile(latency=Latency(40000, 120000)),
+        ),
+    )
+}
@@ -0,0 +1,266 @@
+"""
+Benchmark de throughput de extremo a extremo: corre job.job.run contra los
+fakes de bench.fakes y reporta por escenario tablas/minuto, utilización de
+workers y latencia de cola (p50/p95/p99) por tabla y por etapa.
+
+    python -m bench.throughput                       # todos los escenarios
+    python -m bench.throughput -s baseline -s workers_30 --time-scale 0.02
+    python -m bench.throughput --json bench_output.json
+
+Los tiempos reportados están en escala de producción (medidos / time_scale).
+Solo las esperas simuladas se escalan: el CPU propio del job (prompt,
+validación, JSON) aparece multiplicado por 1 / time_scale. Con la escala por
+defecto ese efecto es menor que la latencia de los servicios. Compara
+escenarios siempre con la misma escala; el CPU por columna se mide con
+bench.micro.
+"""
+
+import argparse
+import dataclasses
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from bench.fakes import (
+    FakeBigQueryClient,
+    FakeDataplexSession,
+    FakeGenaiClient,
+    ScaledTime,
+    new_sim,
+    table_fqns,
+)
+from bench.scenarios import SCENARIOS, Scenario
+from job.metrics import StageHistograms, percentile
+
+TRACKER_TABLE_FQN = "bench-project.monitoreo.tablas_mdm"
+
+
+@contextmanager
+def _patched(obj, name: str, value) -> Iterator[None]:
+    original = getattr(obj, name)
+    setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        setattr(obj, name, original)
+
+
+@contextmanager
+def _environ(values: Dict[str, str]) -> Iterator[None]:
+    previous = {key: os.environ.get(key) for key in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def _job_env(scenario: Scenario) -> Dict[str, str]:
+    return {
+        "TRACKER_TABLE_FQN": TRACKER_TABLE_FQN,
+        "MAX_WORKERS": str(scenario.max_workers),
+        "BATCH_SIZE": str(scenario.tables),
+        "STARTUP_JITTER_SEC": "0",
+        "SHARD_BY_TASK": "false",
+        "REFRESH_SIZE_HINTS": "false",
+        # sin deadline efectivo: se mide throughput, no admisión
+        "TASK_TIMEOUT_SEC": str(10**7),
+        "CHECKPOINT_TABLE_FQN": "",
+        "GLOSSARY_TABLE_FQN": "",
+        "FAMILY_DETECTION": "false",
+        "JOB_MODE": "online",
+        "DATAPLEX_ASYNC": str(scenario.dataplex_async).lower(),
+        "BQ_BATCH_WRITES": str(scenario.bq_batch_writes).lower(),
+    }
+
+
+def run_scenario(scenario: Scenario, time_scale: float = 0.05, seed: int = 7) -> dict:
+    # imports diferidos: los módulos leen env al importarse
+    import app.adapters.vertex_llm as vertex_llm
+    import app.services.dataplex_writer as dataplex_writer
+    import job.job as job_module
+
+    sim = new_sim(seed, time_scale)
+    bq = FakeBigQueryClient(sim, scenario.bigquery, TRACKER_TABLE_FQN)
+    weights = [weight for weight, _ in scenario.size_mix]
+    shapes = [shape for _, shape in scenario.size_mix]
+    for fqn in table_fqns(scenario.tables):
+        bq.add_table(fqn, sim.choice(shapes, weights))
+
+    genai_client = FakeGenaiClient(sim, scenario.llm)
+    dataplex_session = FakeDataplexSession(sim, scenario.dataplex)
+    scaled_time = ScaledTime(time_scale)
+
+    # tiempo ocupado de cada worker (process_table de punta a punta)
+    spans: List[tuple] = []
+    spans_lock = threading.Lock()
+    original_process_table = job_module.process_table
+
+    def timed_process_table(*args, **kwargs):
+        start = time.monotonic()
+        try:
+            return original_process_table(*args, **kwargs)
+        finally:
+            with spans_lock:
+                spans.append((start, time.monotonic()))
+
+    vertex_llm._stats.clear()
+    job_module._clients_cache.clear()
+
+    with ExitStack() as stack:
+        stack.enter_context(_environ(_job_env(scenario)))
+        stack.enter_context(_patched(job_module, "get_bq_client", lambda project: bq))
+        stack.enter_context(_patched(job_module, "process_table", timed_process_table))
+        stack.enter_context(_patched(job_module, "time", scaled_time))
+        stack.enter_context(_patched(vertex_llm, "time", scaled_time))
+        stack.enter_context(_patched(dataplex_writer, "time", scaled_time))
+        stack.enter_context(_patched(dataplex_writer, "_session", dataplex_session))
+        stack.enter_context(
+            _patched(
+                vertex_llm,
+                "CLIENTS",
+                {region: genai_client for region in vertex_llm.REGIONS},
+            )
+        )
+
+        started = time.monotonic()
+        try:
+            job_module.run()
+        except SystemExit:
+            # el job sale con 1 si hubo errores: igual se reporta
+            pass
+        wall_sec = time.monotonic() - started
+
+    return _report(
+        scenario, bq, genai_client, vertex_llm.llm_stats(), spans, wall_sec, time_scale
+    )
+
+
+def _report(
+    scenario: Scenario,
+    bq: FakeBigQueryClient,
+    genai_client: FakeGenaiClient,
+    llm: dict,
+    spans: List[tuple],
+    wall_sec: float,
+    time_scale: float,
+) -> dict:
+    ok = sum(1 for row in bq.merged_rows if row["estado"] == "OK")
+    errors = sum(1 for row in bq.merged_rows if row["estado"] != "OK")
+    sim_sec = wall_sec / time_scale
+
+    durations = sorted(int((end - start) * 1000 / time_scale) for start, end in spans)
+    busy_sec = sum(end - start for start, end in spans)
+    window_sec = (max(e for _, e in spans) - min(s for s, _ in spans)) if spans else 0.0
+
+    histograms = StageHistograms()
+    for row in bq.merged_rows:
+        if row.get("stage_timings"):
+            timings = json.loads(row["stage_timings"])
+            histograms.observe_all(
+                {stage: ms / time_scale for stage, ms in timings.items()}
+            )
+
+    return {
+        "scenario": scenario.name,
+        "description": scenario.description,
+        "tables": scenario.tables,
+        "max_workers": scenario.max_workers,
+        "ok": ok,
+        "error": errors,
+        "elapsed_sec": round(sim_sec, 1),
+        "tables_per_min": round(ok / sim_sec * 60, 2) if sim_sec else None,
+        # fracción del tiempo en que los workers estuvieron ocupados
+        "worker_utilization": round(
+            busy_sec / (scenario.max_workers * window_sec), 3
+        )
+        if window_sec
+        else None,
+        "table_ms": {
+            f"p{pct}": percentile(durations, pct) for pct in (50, 95, 99)
+        },
+        "stages": histograms.summary(),
+        "llm": {
+            "calls": llm.get("calls", 0),
+            "attempts": llm.get("attempts", 0),
+            "rate_limited": genai_client.counters["rate_limited"],
+            "input_tokens": llm.get("input_tokens", 0),
+            "output_tokens": llm.get("output_tokens", 0),
+            "thinking_tokens": llm.get("thinking_tokens", 0),
+            "cost_usd": round(llm.get("cost_micro_usd", 0) / 1_000_000, 4),
+        },
+    }
+
+
+def _print_table(reports: List[dict]) -> None:
+    header = (
+        f"{'escenario':<14} {'ok':>5} {'err':>4} {'tablas/min':>10} "
+        f"{'util':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'429s':>5}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in reports:
+        print(
+            f"{r['scenario']:<14} {r['ok']:>5} {r['error']:>4} "
+            f"{r['tables_per_min'] or 0:>10.2f} "
+            f"{r['worker_utilization'] or 0:>6.1%} "
+            f"{r['table_ms']['p50'] or 0:>9} {r['table_ms']['p95'] or 0:>9} "
+            f"{r['table_ms']['p99'] or 0:>9} {r['llm']['rate_limited']:>5}"
+        )
+
+    for r in reports:
+        print(f"\n[{r['scenario']}] p95 por etapa (ms):")
+        for stage, summary in r["stages"].items():
+            print(f"  {stage:<17} {summary['p95']:>9}  (n={summary['count']})")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "-s",
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="escenario a correr (repetible); por defecto todos",
+    )
+    parser.add_argument("--time-scale", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument(
+        "--tables", type=int, help="reemplaza el tamaño del backlog de cada escenario"
+    )
+    parser.add_argument("--json", help="archivo donde guardar el reporte completo")
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="muestra los logs del job"
+    )
+    args = parser.parse_args(argv)
+
+    import job.job  # noqa: F401  (configura logging al importarse)
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.ERROR)
+
+    reports = []
+    for name in args.scenario or list(SCENARIOS):
+        scenario = SCENARIOS[name]
+        if args.tables:
+            scenario = dataclasses.replace(scenario, tables=args.tables)
+        reports.append(
+            run_scenario(scenario, time_scale=args.time_scale, seed=args.seed)
+        )
+    _print_table(reports)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(reports, fh, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,12 +17,18 @@ IMAGE="${REGION}-docker.pkg.dev/${PROJECT_ID}/${REPO}/${JOB_NAME}:$(date +%Y%m%d
 
 SERVICE_ACCOUNT="sa-nprd-dt-gob-dataplex-deploy@rs-nprd-dlk-dt-trsv-digt-f7ef.iam.gserviceaccount.com"
 TRACKER_TABLE_FQN="${PROJECT_ID}.trsv_monitoreo.tablas_mdm"
+CHECKPOINT_TABLE_FQN="${PROJECT_ID}.trsv_monitoreo.tablas_mdm_checkpoints"
+GLOSSARY_TABLE_FQN="${PROJECT_ID}.trsv_monitoreo.tablas_mdm_glosario"
+BATCH_BUCKET="gs://${PROJECT_ID}-metadata-batch"
 
 TASK_COUNT=10
 PARALLELISM=5
 MAX_WORKERS=10
 VERTEX_CONCURRENCY=5
 LLM_RETRIES=3
+# TPM por modelo de cada task (cuota del proyecto / PARALLELISM); 0 = sin límite
+LLM_TPM_LIMIT=0
+SHARD_BY_TASK=true
 
 # =============================================================================
 # RUNTIME
@@ -83,9 +89,14 @@ gcloud run jobs deploy "${JOB_NAME}" \
   --memory "${MEMORY}" \
   --set-env-vars "\
 TRACKER_TABLE_FQN=${TRACKER_TABLE_FQN},\
+CHECKPOINT_TABLE_FQN=${CHECKPOINT_TABLE_FQN},\
+GLOSSARY_TABLE_FQN=${GLOSSARY_TABLE_FQN},\
 MAX_WORKERS=${MAX_WORKERS},\
 VERTEX_CONCURRENCY=${VERTEX_CONCURRENCY},\
 LLM_RETRIES=${LLM_RETRIES},\
+LLM_TPM_LIMIT=${LLM_TPM_LIMIT},\
+SHARD_BY_TASK=${SHARD_BY_TASK},\
+TASK_TIMEOUT_SEC=${TIMEOUT%s},\
 PROJECT_ID=${PROJECT_ID}"
 
 echo ""
@@ -94,6 +105,12 @@ echo ""
 echo "▶ Ejecutar:"
 echo "  gcloud run jobs execute ${JOB_NAME} --region ${REGION} --project ${PROJECT_ID}"
 echo ""
+echo "▶ Backfill por batch prediction (fase 1 y, al terminar el batch, fase 2):"
+echo "  gcloud run jobs execute ${JOB_NAME} --region ${REGION} --project ${PROJECT_ID} \\"
+echo "    --update-env-vars JOB_MODE=batch_prepare,BATCH_SUBMIT=true,BATCH_REQUESTS_URI=${BATCH_BUCKET}/requests,BATCH_RESULTS_URI=${BATCH_BUCKET}/results"
+echo "  gcloud run jobs execute ${JOB_NAME} --region ${REGION} --project ${PROJECT_ID} \\"
+echo "    --update-env-vars JOB_MODE=batch_ingest,BATCH_RESULTS_URI=${BATCH_BUCKET}/results"
+echo ""
 echo "▶ Logs en tiempo real:"
 echo "  gcloud logging read \\"
 echo "    'resource.type=\"cloud_run_job\" AND resource.labels.job_name=\"${JOB_NAME}\"' \\"
@@ -103,6 +120,8 @@ echo "▶ Progreso en BigQuery:"
 echo "  SELECT"
 echo "    COUNTIF(estado='OK')    AS ok,"
 echo "    COUNTIF(estado='ERROR') AS errores,"
+echo "    COUNTIF(estado='QUARANTINE') AS cuarentena,"
+echo "    COUNTIF(estado='BATCH') AS en_batch,"
 echo "    COUNTIF(estado IS NULL) AS pendientes,"
 echo "    COUNT(*)                AS total"
 echo "  FROM \`${TRACKER_TABLE_FQN}\`;"
\ No newline at end of file
@@ -0,0 +1,353 @@
+"""
+Modo batch para backfills grandes: sin latencia interactiva ni límite de RPM.
+
+Fase 1 (prepare): perfila las tablas reclamadas y escribe un JSONL de requests
+en formato de batch prediction de Vertex AI (una línea por tabla, con la FQN
+y el fingerprint del schema en "key"). Las filas quedan en BATCH hasta la
+ingesta.
+
+Fase 2 (ingest): lee el JSONL de resultados y valida cada línea con
+validate_metadata. process_table descarta el payload si el schema cambió
+desde el prepare y, si no, lo pasa por el clasificador local y el chequeo de
+cobertura (con reparación) antes de escribir, igual que en modo online.
+
+Las URIs pueden ser rutas locales o gs://.
+"""
+
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from google.cloud import bigquery
+
+from app.adapters.bq_reader import get_table_metadata, schema_fingerprint
+from app.adapters.vertex_llm import (
+    generation_config,
+    stamp_metadata,
+    submit_batch_job,
+)
+from app.errors import (
+    DEADLINE,
+    TRANSIENT,
+    VALIDATION,
+    DeadlineExceededError,
+    classify_error,
+)
+from app.services.profiling import build_profile
+from app.services.prompt_builder import build_prompt
+from app.validators.metadata_schema import validate_metadata
+from job.bq_tracker import batch_update_status, release_unfinished
+from job.config import JobConfig
+from job.retry_policy import failure_row
+
+logger = logging.getLogger(__name__)
+
+ONLINE = "online"
+BATCH_PREPARE = "batch_prepare"
+BATCH_INGEST = "batch_ingest"
+
+# "proyecto.dataset.tabla|fingerprint": "|" no es válido en nombres de BigQuery
+_KEY_SEPARATOR = "|"
+
+
+@dataclass
+class BatchResult:
+    table_fqn: Optional[str]
+    payload: Optional[dict] = None
+    error: Optional[str] = None
+    error_type: Optional[str] = None
+    # fingerprint del schema en el prepare (None en requests sin fingerprint)
+    fingerprint: Optional[str] = None
+
+
+# ── fase 1: requests ─────────────────────────────────────────────────────────
+
+
+def request_key(table_fqn: str, fingerprint: Optional[str] = None) -> str:
+    if not fingerprint:
+        return table_fqn
+    return f"{table_fqn}{_KEY_SEPARATOR}{fingerprint}"
+
+
+def split_request_key(key: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """(FQN, fingerprint) de una key; acepta keys sin fingerprint."""
+    if not key:
+        return None, None
+    table_fqn, _, fingerprint = key.partition(_KEY_SEPARATOR)
+    return table_fqn, fingerprint or None
+
+
+def build_request_line(
+    table_fqn: str, prompt: str, fingerprint: Optional[str] = None
+) -> str:
+    request = {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": generation_config(),
+    }
+    return json.dumps(
+        {"key": request_key(table_fqn, fingerprint), "request": request},
+        ensure_ascii=False,
+    )
+
+
+def _prepare_one(
+    row: Dict,
+    get_client: Callable[[str], bigquery.Client],
+    deadline: Optional[float],
+) -> str:
+    if deadline is not None and time.time() >= deadline:
+        # classify_error lo marca DEADLINE y la fila se libera al final
+        raise DeadlineExceededError("Deadline alcanzado antes de profiling")
+
+    bq_client = get_client(row["catalog"])
+    table_obj = get_table_metadata(row["catalog"], row["schema"], row["table"], bq_client)
+    profile = build_profile(table=table_obj, bq_client=bq_client)
+    # la ingesta no tiene el schema a mano para expandir el formato compacto
+    prompt = build_prompt(table=table_obj, profile=profile, compact=False)
+
+    return build_request_line(
+        f"{row['catalog']}.{row['schema']}.{row['table']}",
+        prompt,
+        schema_fingerprint(table_obj),
+    )
+
+
+def run_prepare(
+    cfg: JobConfig,
+    tracker_client: bigquery.Client,
+    job_id: str,
+    tables: List[Dict],
+    get_client: Callable[[str], bigquery.Client],
+    deadline: Optional[float] = None,
+) -> Dict[str, int]:
+    """
+    Fase 1 completa: requests al JSONL, filas a BATCH (o ERROR si no se
+    pudieron perfilar) y, con batch_submit, lanza el batch prediction.
+    """
+    lines: List[str] = []
+    updates: List[Dict] = []
+    stats = {"prepared": 0, "error": 0, "released": 0}
+
+    def prepare(row: Dict) -> Tuple[Dict, Optional[str], Optional[Exception]]:
+        try:
+            return row, _prepare_one(row, get_client, deadline), None
+        except Exception as exc:
+            return row, None, exc
+
+    with ThreadPoolExecutor(max_workers=cfg.max_workers) as executor:
+        for row, line, exc in executor.map(prepare, tables):
+            fqn = f"{row['catalog']}.{row['schema']}.{row['table']}"
+            if exc is None:
+                lines.append(line)
+                updates.append(
+                    {
+                        "catalog": row["catalog"],
+                        "schema": row["schema"],
+                        "table": row["table"],
+                        "estado": "BATCH",
+                        "error": None,
+                    }
+                )
+                stats["prepared"] += 1
+                continue
+
+            error_type = classify_error(exc)
+            if error_type == DEADLINE:
+                stats["released"] += 1
+                continue
+
+            updates.append(
+                failure_row(
+                    row,
+                    str(exc)[:500],
+                    error_type,
+                    max_attempts=cfg.max_attempts,
+                    backoff_sec=cfg.retry_backoff_sec,
+                    backoff_max_sec=cfg.retry_backoff_max_sec,
+                )
+            )
+            stats["error"] += 1
+            logger.error(f"[BATCH] {fqn} — {error_type} — {exc}")
+
+    requests_uri = None
+    try:
+        if lines:
+            requests_uri = f"{cfg.batch_requests_uri.rstrip('/')}/requests-{job_id}.jsonl"
+            write_jsonl(requests_uri, lines)
+            logger.info(f"[BATCH] {len(lines)} requests escritos en {requests_uri}")
+    except Exception:
+        # sin archivo no hay batch: las filas preparadas vuelven al backlog
+        updates = [u for u in updates if u["estado"] != "BATCH"]
+        stats["released"] += stats["prepared"]
+        stats["prepared"] = 0
+        raise
+    finally:
+        batch_update_status(tracker_client, cfg.tracker_table_fqn, updates)
+        release_unfinished(tracker_client, cfg.tracker_table_fqn, job_id)
+
+    if requests_uri and cfg.batch_submit:
+        submit_batch_job(requests_uri, cfg.batch_results_uri)
+
+    return stats
+
+
+# ── fase 2: resultados ───────────────────────────────────────────────────────
+
+
+def parse_result_line(line: str) -> BatchResult:
+    """
+    Convierte una línea de resultados de batch prediction en un BatchResult.
+    La FQN y el fingerprint salen de "key"; si el resultado no la conserva,
+    la FQN sale del propio payload (y sin fingerprint no se detecta un cambio
+    de schema, pero sí la cobertura de columnas).
+    """
+    record = json.loads(line)
+    table_fqn, fingerprint = split_request_key(record.get("key"))
+
+    status = record.get("status")
+    if status:
+        return BatchResult(
+            table_fqn,
+            error=f"Batch prediction falló: {status}",
+            error_type=TRANSIENT,
+            fingerprint=fingerprint,
+        )
+
+    candidates = (record.get("response") or {}).get("candidates") or []
+    parts = (candidates[0].get("content") or {}).get("parts", []) if candidates else []
+    text = "".join(part.get("text", "") for part in parts).strip()
+    if not text:
+        reason = candidates[0].get("finishReason") if candidates else None
+        return BatchResult(
+            table_fqn,
+            error=f"Respuesta vacía del modelo (finishReason={reason})",
+            error_type=VALIDATION,
+            fingerprint=fingerprint,
+        )
+
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as exc:
+        return BatchResult(
+            table_fqn,
+            error=f"JSON inválido: {exc}",
+            error_type=VALIDATION,
+            fingerprint=fingerprint,
+        )
+
+    if not isinstance(data, dict):
+        return BatchResult(
+            table_fqn,
+            error="La respuesta no es un objeto JSON",
+            error_type=VALIDATION,
+            fingerprint=fingerprint,
+        )
+
+    # la key del request manda: los writers usan table_fqn del payload
+    if table_fqn:
+        data["table_fqn"] = table_fqn
+    else:
+        table_fqn = data.get("table_fqn")
+
+    payload = stamp_metadata(data)
+    errors = validate_metadata(payload)
+    if errors:
+        return BatchResult(
+            table_fqn, error=str(errors), error_type=VALIDATION, fingerprint=fingerprint
+        )
+
+    return BatchResult(table_fqn, payload=payload, fingerprint=fingerprint)
+
+
+def load_results(uri: str) -> Dict[str, BatchResult]:
+    """
+    Lee todos los resultados bajo uri (archivo, directorio o prefijo gs://).
+    Si una tabla aparece más de una vez, gana el resultado válido.
+    """
+    if not uri:
+        raise ValueError("BATCH_RESULTS_URI es obligatorio en modo batch_ingest")
+
+    results: Dict[str, BatchResult] = {}
+    skipped = 0
+
+    for line in read_jsonl(uri):
+        try:
+            result = parse_result_line(line)
+        except (json.JSONDecodeError, AttributeError, TypeError) as exc:
+            skipped += 1
+            logger.warning(f"[BATCH] Línea de resultados ilegible: {exc}")
+            continue
+
+        if not result.table_fqn:
+            skipped += 1
+            logger.warning("[BATCH] Resultado sin key ni table_fqn: se descarta")
+            continue
+
+        previous = results.get(result.table_fqn)
+        if previous is None or previous.payload is None:
+            results[result.table_fqn] = result
+
+    valid = sum(1 for r in results.values() if r.payload is not None)
+    logger.info(
+        f"[BATCH] Resultados cargados: {len(results)} tablas | válidos={valid} | "
+        f"descartados={skipped}"
+    )
+    return results
+
+
+# ── E/S de JSONL (local o GCS) ───────────────────────────────────────────────
+
+
+def write_jsonl(uri: str, lines: Iterable[str]) -> None:
+    content = "".join(f"{line}\n" for line in lines)
+
+    if uri.startswith("gs://"):
+        bucket, blob = _split_gcs_uri(uri)
+        _storage_client().bucket(bucket).blob(blob).upload_from_string(
+            content, content_type="application/jsonl"
+        )
+        return
+
+    path = Path(uri)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content, encoding="utf-8")
+
+
+def read_jsonl(uri: str) -> Iterator[str]:
+    """
+    Líneas no vacías de un archivo JSONL o de todos los *.jsonl bajo un
+    directorio o prefijo gs:// (Vertex escribe los resultados en subcarpetas).
+    """
+    if uri.startswith("gs://"):
+        bucket, prefix = _split_gcs_uri(uri)
+        blobs = _storage_client().list_blobs(bucket, prefix=prefix)
+        sources = (
+            blob.download_as_text(encoding="utf-8")
+            for blob in sorted(blobs, key=lambda b: b.name)
+            if blob.name.endswith(".jsonl")
+        )
+    else:
+        path = Path(uri)
+        files = sorted(path.rglob("*.jsonl")) if path.is_dir() else [path]
+        sources = (f.read_text(encoding="utf-8") for f in files)
+
+    for text in sources:
+        for line in text.splitlines():
+            if line.strip():
+                yield line
+
+
+def _split_gcs_uri(uri: str) -> Tuple[str, str]:
+    bucket, _, blob = uri[len("gs://"):].partition("/")
+    return bucket, blob
+
+
+def _storage_client():
+    # google-cloud-storage llega con google-cloud-aiplatform
+    from google.cloud import storage
+
+    return storage.Client()
@@ -7,6 +7,9 @@ from typing import Dict, List, Optional, Tuple
 
 from google.cloud import bigquery
 
+from job.cost_model import ESTIMATE_SQL
+from job.families import PERIOD_SUFFIX_PATTERN
+
 logger = logging.getLogger(__name__)
 
 # Límite conservador de tamaño de payload JSON por MERGE
@@ -14,12 +17,125 @@ logger = logging.getLogger(__name__)
 _MAX_PAYLOAD_BYTES = 800_000
 # Truncado de campo error para evitar payloads enormes
 _MAX_ERROR_LEN = 800
+# Un snapshot más grande no cabe con margen en el parámetro del MERGE
+_MAX_SNAPSHOT_BYTES = 500_000
+# Nombre de la tabla sin sufijo de período (job.families.family_stem en SQL)
+_STEM_EXPR = (
+    f"COALESCE(RTRIM(REGEXP_EXTRACT(`table`, r'{PERIOD_SUFFIX_PATTERN}'), '_'), "
+    "`table`)"
+)
+# Shard determinístico de una fila del tracker, por familia: los shards de
+# events_2024* caen en la misma task y group_families los puede agrupar (con
+# el FQN completo quedaban repartidos y cada task llamaba al LLM por su
+# cuenta). ABS sobre el MOD evita el overflow de ABS(INT64_MIN).
+_SHARD_EXPR = (
+    f"ABS(MOD(FARM_FINGERPRINT(CONCAT(catalog, '.', schema, '.', {_STEM_EXPR})), "
+    "@task_count))"
+)
+# Columnas que el job añade al tracker si no existen (migración idempotente)
+_TRACKER_COLUMNS = {
+    "duration_ms": "INT64",
+    "size_bytes": "INT64",
+    "num_columns": "INT64",
+    "error_type": "STRING",
+    "attempts": "INT64",
+    "next_eligible_at": "TIMESTAMP",
+    "aspect_hash": "STRING",
+    "model_tier": "STRING",
+    "escalated": "BOOL",
+    "family_rep": "STRING",
+    "payload_snapshot": "STRING",
+    "stage_timings": "STRING",
+    "llm_usage": "STRING",
+}
+# Un batch prediction de Vertex AI puede tardar hasta 72h; pasado ese plazo
+# sin ingesta, la fila en BATCH vuelve a ser reclamable
+_BATCH_TTL_HOURS = 72
+# Fila reclamable: pendiente, en ERROR con el back-off ya cumplido o en BATCH
+# con el plazo vencido. QUARANTINE (presupuesto agotado) nunca se reclama.
+_CLAIMABLE = (
+    "((estado IS NULL OR estado = 'ERROR') "
+    "AND (next_eligible_at IS NULL OR next_eligible_at <= CURRENT_TIMESTAMP()) "
+    "OR estado = 'BATCH' AND updated_at < "
+    f"TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {_BATCH_TTL_HOURS} HOUR))"
+)
+
+
+def ensure_tracker_columns(bq_client: bigquery.Client, tracker_table: str) -> None:
+    """
+    Añade al tracker las columnas opcionales que usa el job.
+    Best-effort: si otra task está alterando la tabla a la vez, se ignora.
+    """
+    add_columns = ",\n".join(
+        f"ADD COLUMN IF NOT EXISTS {name} {bq_type}"
+        for name, bq_type in _TRACKER_COLUMNS.items()
+    )
+
+    try:
+        bq_client.query(f"ALTER TABLE `{tracker_table}`\n{add_columns}").result()
+    except Exception as exc:
+        logger.warning(f"No se pudieron asegurar columnas del tracker: {exc}")
+
+
+def refresh_size_hints(
+    bq_client: bigquery.Client,
+    tracker_table: str,
+    region: str,
+) -> None:
+    """
+    Refresca size_bytes y num_columns de las filas pendientes desde
+    INFORMATION_SCHEMA.TABLE_STORAGE y COLUMNS de cada proyecto origen.
+    Un único MERGE para todos los catálogos pendientes.
+    """
+    catalogs_query = f"""
+        SELECT DISTINCT catalog
+        FROM `{tracker_table}`
+        WHERE estado IS NULL OR estado = 'ERROR'
+    """
+    catalogs = [row.catalog for row in bq_client.query(catalogs_query).result()]
+
+    if not catalogs:
+        return
+
+    sources = "\n            UNION ALL\n".join(
+        f"""
+            SELECT
+                s.project_id          AS catalog,
+                s.table_schema        AS schema,
+                s.table_name          AS `table`,
+                s.total_logical_bytes AS size_bytes,
+                c.num_columns         AS num_columns
+            FROM `{catalog}`.`{region}`.INFORMATION_SCHEMA.TABLE_STORAGE AS s
+            LEFT JOIN (
+                SELECT table_schema, table_name, COUNT(*) AS num_columns
+                FROM `{catalog}`.`{region}`.INFORMATION_SCHEMA.COLUMNS
+                GROUP BY table_schema, table_name
+            ) AS c
+            USING (table_schema, table_name)"""
+        for catalog in catalogs
+    )
+
+    merge_query = f"""
+        MERGE `{tracker_table}` AS t
+        USING ({sources}
+        ) AS src
+        ON  t.catalog = src.catalog
+        AND t.schema  = src.schema
+        AND t.`table` = src.`table`
+        WHEN MATCHED AND (t.estado IS NULL OR t.estado = 'ERROR') THEN UPDATE SET
+            t.size_bytes  = src.size_bytes,
+            t.num_columns = src.num_columns
+    """
+
+    bq_client.query(merge_query).result()
+    logger.info(f"Size hints refrescados para {len(catalogs)} catálogo(s).")
 
 
 def claim_pending_tables(
     bq_client: bigquery.Client,
     tracker_table: str,
     batch_size: int,
+    shard: Optional[Tuple[int, int]] = None,
 ) -> Tuple[str, List[Dict]]:
     """
     Claim atómico con QUALIFY ROW_NUMBER().
@@ -30,9 +146,31 @@ def claim_pending_tables(
     además del subquery — doble filtro defensivo.
     Si dos tasks llegan exactamente al mismo tiempo, la segunda no encuentra
     filas que cumplan ambos filtros y retorna 0 rows afectadas, sin duplicar.
+
+    shard=(task_index, task_count) restringe el claim a las filas cuyo
+    FARM_FINGERPRINT(catalog.schema.<tabla sin sufijo de período>) MOD
+    task_count = task_index: una familia de shards queda entera en una task.
+    Cada task compite solo consigo misma por su shard, así que la contención
+    del DML desaparece. Con shard=None se reclama sobre todo el backlog
+    (modo robo entre shards).
+
+    El orden es longest-expected-first (ver job.cost_model) para que las
+    tablas grandes arranquen primero y no queden al final del timeout.
     """
     job_id = str(uuid.uuid4())
 
+    query_parameters = [
+        bigquery.ScalarQueryParameter("job_id", "STRING", job_id),
+    ]
+    shard_filter = ""
+    if shard is not None:
+        task_index, task_count = shard
+        shard_filter = f"AND {_SHARD_EXPR} = @task_index"
+        query_parameters += [
+            bigquery.ScalarQueryParameter("task_index", "INT64", task_index),
+            bigquery.ScalarQueryParameter("task_count", "INT64", task_count),
+        ]
+
     claim_query = f"""
         UPDATE `{tracker_table}`
         SET
@@ -40,46 +178,73 @@ def claim_pending_tables(
             estado     = 'PROCESSING',
             updated_at = CURRENT_TIMESTAMP()
         WHERE
-            (estado IS NULL OR estado = 'ERROR')
+            {_CLAIMABLE}
             AND job_id IS NULL
             AND STRUCT(catalog, schema, `table`) IN (
                 SELECT AS STRUCT catalog, schema, `table`
                 FROM `{tracker_table}`
-                WHERE estado IS NULL OR estado = 'ERROR'
+                WHERE {_CLAIMABLE}
+                AND job_id IS NULL
+                {shard_filter}
                 QUALIFY ROW_NUMBER() OVER (
-                    ORDER BY catalog, schema, `table`
+                    ORDER BY {ESTIMATE_SQL} DESC, catalog, schema, `table`
                 ) <= {batch_size}
             )
     """
 
+    bq_client.query(
+        claim_query,
+        job_config=bigquery.QueryJobConfig(query_parameters=query_parameters),
+    ).result()
+
+    rows = _fetch_claimed(bq_client, tracker_table, job_id)
+
+    logger.info(
+        f"Tablas claimadas: {len(rows)} (job_id={job_id}"
+        f"{f', shard={shard[0]}/{shard[1]}' if shard is not None else ''})"
+    )
+    return job_id, rows
+
+
+def claim_batch_tables(
+    bq_client: bigquery.Client,
+    tracker_table: str,
+    table_fqns: List[str],
+) -> Tuple[str, List[Dict]]:
+    """
+    Claim de las filas en BATCH que tienen resultado en el archivo a ingerir.
+    Una fila ya ingerida (o reclamada por otra task con el mismo archivo)
+    deja de estar en BATCH y no se procesa dos veces.
+    """
+    job_id = str(uuid.uuid4())
+
+    claim_query = f"""
+        UPDATE `{tracker_table}`
+        SET
+            job_id     = @job_id,
+            estado     = 'PROCESSING',
+            updated_at = CURRENT_TIMESTAMP()
+        WHERE estado = 'BATCH'
+          AND CONCAT(catalog, '.', schema, '.', `table`) IN UNNEST(@table_fqns)
+    """
+
     bq_client.query(
         claim_query,
         job_config=bigquery.QueryJobConfig(
             query_parameters=[
                 bigquery.ScalarQueryParameter("job_id", "STRING", job_id),
+                bigquery.ArrayQueryParameter("table_fqns", "STRING", table_fqns),
             ]
         ),
     ).result()
 
-    fetch_query = f"""
-        SELECT catalog, schema, `table`
-        FROM `{tracker_table}`
-        WHERE job_id = @job_id
-    """
+    rows = _fetch_claimed(bq_client, tracker_table, job_id)
 
-    rows = list(
-        bq_client.query(
-            fetch_query,
-            job_config=bigquery.QueryJobConfig(
-                query_parameters=[
-                    bigquery.ScalarQueryParameter("job_id", "STRING", job_id),
-                ]
-            ),
-        ).result()
+    logger.info(
+        f"Tablas en BATCH claimadas: {len(rows)} de {len(table_fqns)} "
+        f"resultados (job_id={job_id})"
     )
-
-    logger.info(f"Tablas claimadas: {len(rows)} (job_id={job_id})")
-    return job_id, [dict(row) for row in rows]
+    return job_id, rows
 
 
 def batch_update_status(
@@ -110,9 +275,102 @@ def batch_update_status(
     logger.info(f"Batch update completado: {len(rows)} filas totales.")
 
 
+def release_unfinished(
+    bq_client: bigquery.Client,
+    tracker_table: str,
+    job_id: str,
+) -> None:
+    """
+    Devuelve al backlog las filas de este job que siguen en PROCESSING
+    (no admitidas por deadline o cortadas a mitad). Debe llamarse después
+    del flush final para no pisar resultados ya calculados.
+    """
+    release_query = f"""
+        UPDATE `{tracker_table}`
+        SET
+            job_id     = NULL,
+            estado     = NULL,
+            updated_at = CURRENT_TIMESTAMP()
+        WHERE job_id = @job_id
+          AND estado = 'PROCESSING'
+    """
+
+    job = bq_client.query(
+        release_query,
+        job_config=bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("job_id", "STRING", job_id),
+            ]
+        ),
+    )
+    job.result()
+
+    logger.info(f"Filas liberadas al backlog: {job.num_dml_affected_rows or 0}")
+
+
+def fetch_snapshot(
+    bq_client: bigquery.Client,
+    tracker_table: str,
+    catalog: str,
+    schema: str,
+    table: str,
+) -> Optional[str]:
+    """
+    payload_snapshot de una tabla (JSON), leído bajo demanda: el claim solo
+    trae has_snapshot para no tener en memoria hasta 500KB por fila reclamada.
+    """
+    query = f"""
+        SELECT payload_snapshot
+        FROM `{tracker_table}`
+        WHERE catalog = @catalog AND schema = @schema AND `table` = @table
+        LIMIT 1
+    """
+    rows = bq_client.query(
+        query,
+        job_config=bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("catalog", "STRING", catalog),
+                bigquery.ScalarQueryParameter("schema", "STRING", schema),
+                bigquery.ScalarQueryParameter("table", "STRING", table),
+            ]
+        ),
+    ).result()
+    for row in rows:
+        return row.payload_snapshot
+    return None
+
+
 # ── internals ────────────────────────────────────────────────────────────────
 
 
+def _fetch_claimed(
+    bq_client: bigquery.Client, tracker_table: str, job_id: str
+) -> List[Dict]:
+    fetch_query = f"""
+        SELECT
+            catalog, schema, `table`,
+            duration_ms, size_bytes, num_columns,
+            COALESCE(attempts, 0) AS attempts,
+            aspect_hash,
+            -- el snapshot (hasta _MAX_SNAPSHOT_BYTES) se lee por tabla y solo
+            -- si se usa: ver fetch_snapshot
+            payload_snapshot IS NOT NULL AS has_snapshot
+        FROM `{tracker_table}`
+        WHERE job_id = @job_id
+    """
+
+    rows = bq_client.query(
+        fetch_query,
+        job_config=bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("job_id", "STRING", job_id),
+            ]
+        ),
+    ).result()
+
+    return [dict(row) for row in rows]
+
+
 def _sanitize_row(r: Dict) -> Dict:
     """
     Gap 2: limpia y valida cada campo antes de enviarlo a BigQuery.
@@ -126,6 +384,14 @@ def _sanitize_row(r: Dict) -> Dict:
         error = "".join(c for c in str(error) if c == "\n" or c == "\t" or ord(c) >= 32)
         error = error[:_MAX_ERROR_LEN]
 
+    snapshot = r.get("payload_snapshot")
+    if snapshot is not None and len(snapshot.encode("utf-8")) > _MAX_SNAPSHOT_BYTES:
+        logger.warning(
+            f"[{r['catalog']}.{r['schema']}.{r['table']}] payload_snapshot omitido "
+            f"por tamaño: la próxima evolución de schema regenera completo"
+        )
+        snapshot = None
+
     return {
         "catalog": str(r["catalog"]).strip(),
         "schema": str(r["schema"]).strip(),
@@ -133,6 +399,17 @@ def _sanitize_row(r: Dict) -> Dict:
         "estado": str(r["estado"]).strip(),
         "error": error,
         "processed_at": _ts(r.get("processed_at")),
+        "duration_ms": _int(r.get("duration_ms")),
+        "error_type": r.get("error_type"),
+        "attempts": _int(r.get("attempts")),
+        "next_eligible_at": _ts(r.get("next_eligible_at")),
+        "aspect_hash": r.get("aspect_hash"),
+        "model_tier": r.get("model_tier"),
+        "escalated": r.get("escalated"),
+        "family_rep": r.get("family_rep"),
+        "payload_snapshot": snapshot,
+        "stage_timings": r.get("stage_timings"),
+        "llm_usage": r.get("llm_usage"),
     }
 
 
@@ -171,22 +448,47 @@ def _merge_chunk(
         MERGE `{tracker_table}` AS t
         USING (
             SELECT
-                JSON_VALUE(item, '$.catalog')                        AS catalog,
-                JSON_VALUE(item, '$.schema')                         AS schema,
-                JSON_VALUE(item, '$.table')                          AS `table`,
-                JSON_VALUE(item, '$.estado')                         AS estado,
-                JSON_VALUE(item, '$.error')                          AS error,
-                CAST(JSON_VALUE(item, '$.processed_at') AS TIMESTAMP) AS processed_at
+                JSON_VALUE(item, '$.catalog')                              AS catalog,
+                JSON_VALUE(item, '$.schema')                               AS schema,
+                JSON_VALUE(item, '$.table')                                AS `table`,
+                JSON_VALUE(item, '$.estado')                               AS estado,
+                JSON_VALUE(item, '$.error')                                AS error,
+                CAST(JSON_VALUE(item, '$.processed_at') AS TIMESTAMP)      AS processed_at,
+                CAST(JSON_VALUE(item, '$.duration_ms') AS INT64)           AS duration_ms,
+                JSON_VALUE(item, '$.error_type')                           AS error_type,
+                CAST(JSON_VALUE(item, '$.attempts') AS INT64)              AS attempts,
+                CAST(JSON_VALUE(item, '$.next_eligible_at') AS TIMESTAMP)  AS next_eligible_at,
+                JSON_VALUE(item, '$.aspect_hash')                          AS aspect_hash,
+                JSON_VALUE(item, '$.model_tier')                           AS model_tier,
+                CAST(JSON_VALUE(item, '$.escalated') AS BOOL)              AS escalated,
+                JSON_VALUE(item, '$.family_rep')                           AS family_rep,
+                JSON_VALUE(item, '$.payload_snapshot')                     AS payload_snapshot,
+                JSON_VALUE(item, '$.stage_timings')                        AS stage_timings,
+                JSON_VALUE(item, '$.llm_usage')                            AS llm_usage
             FROM UNNEST(JSON_QUERY_ARRAY(@payload)) AS item
         ) AS src
         ON  t.catalog = src.catalog
         AND t.schema  = src.schema
         AND t.`table` = src.`table`
         WHEN MATCHED THEN UPDATE SET
-            t.estado       = src.estado,
-            t.error        = src.error,
-            t.processed_at = src.processed_at,
-            t.updated_at   = CURRENT_TIMESTAMP()
+            t.estado           = src.estado,
+            t.error            = src.error,
+            t.processed_at     = src.processed_at,
+            t.duration_ms      = COALESCE(src.duration_ms, t.duration_ms),
+            t.error_type       = src.error_type,
+            t.attempts         = COALESCE(src.attempts, t.attempts),
+            t.next_eligible_at = src.next_eligible_at,
+            t.aspect_hash      = COALESCE(src.aspect_hash, t.aspect_hash),
+            t.model_tier       = COALESCE(src.model_tier, t.model_tier),
+            t.escalated        = COALESCE(src.escalated, t.escalated),
+            t.family_rep       = IF(src.estado = 'OK', src.family_rep, t.family_rep),
+            t.payload_snapshot = COALESCE(src.payload_snapshot, t.payload_snapshot),
+            t.stage_timings    = COALESCE(src.stage_timings, t.stage_timings),
+            t.llm_usage        = COALESCE(src.llm_usage, t.llm_usage),
+            -- ERROR vuelve a ser reclamable cuando vence next_eligible_at;
+            -- BATCH queda sin dueño a la espera de la ingesta
+            t.job_id           = IF(src.estado IN ('ERROR', 'BATCH'), NULL, t.job_id),
+            t.updated_at       = CURRENT_TIMESTAMP()
     """
 
     bq_client.query(
@@ -199,6 +501,12 @@ def _merge_chunk(
     ).result()
 
 
+def _int(value) -> Optional[int]:
+    if value is None:
+        return None
+    return int(value)
+
+
 def _ts(value) -> Optional[str]:
     if value is None:
         return None
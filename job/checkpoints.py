@@ -0,0 +1,207 @@
+"""
+Checkpoints por etapa para que un reintento retome en la primera etapa
+incompleta en lugar de repetir perfilado y LLM.
+
+Cada fila de la tabla de checkpoints guarda la salida de una etapa para
+(table_fqn, fingerprint). El fingerprint es el del schema: si la tabla cambia
+de estructura, los checkpoints anteriores dejan de aplicar.
+
+Etapas, en orden: profile → glossary → prompt → llm_raw → validated → bq_write → dataplex_write
+
+Al terminar OK se escribe un marcador completed: las etapas anteriores a él
+no se vuelven a cargar, así un refresh posterior con el mismo fingerprint no
+reutiliza el ciclo ya terminado. Cualquier otra interrupción (DEADLINE,
+ERROR) deja las etapas disponibles para la siguiente corrida.
+"""
+
+import json
+import logging
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from google.cloud import bigquery
+
+logger = logging.getLogger(__name__)
+
+PROFILE = "profile"
+GLOSSARY = "glossary"
+PROMPT = "prompt"
+LLM_RAW = "llm_raw"
+VALIDATED = "validated"
+BQ_WRITE = "bq_write"
+DATAPLEX_WRITE = "dataplex_write"
+# marcador de ciclo terminado (no es una etapa)
+COMPLETED = "completed"
+
+# Los checkpoints solo sirven para reintentos cercanos; la tabla expira particiones
+CHECKPOINT_TTL_DAYS = 7
+
+
+class TableCheckpoint:
+    """
+    Vista de los checkpoints de una tabla y fingerprint concretos.
+    """
+
+    def __init__(
+        self,
+        store: "CheckpointStore",
+        table_fqn: str,
+        fingerprint: str,
+        stages: Dict[str, Any],
+    ):
+        self.store = store
+        self.table_fqn = table_fqn
+        self.fingerprint = fingerprint
+        self._stages = stages
+
+    def get(self, stage: str) -> Optional[Any]:
+        return self._stages.get(stage)
+
+    def done(self, stage: str) -> bool:
+        return stage in self._stages
+
+    def save(self, stage: str, data: Any = None) -> None:
+        data = {} if data is None else data
+        self._stages[stage] = data
+        self.store.save(self.table_fqn, self.fingerprint, stage, data)
+
+
+class CheckpointStore:
+    """
+    Checkpoints en una tabla BigQuery (streaming insert para escribir,
+    una sola query por claim para leer).
+    """
+
+    def __init__(self, bq_client: bigquery.Client, checkpoint_table: str):
+        self.bq_client = bq_client
+        self.checkpoint_table = checkpoint_table
+        self._cache: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        # marcadores completed pendientes de escribir (flush_completed)
+        self._completed: List[dict] = []
+        self._lock = Lock()
+
+    def ensure_table(self) -> None:
+        ddl = f"""
+            CREATE TABLE IF NOT EXISTS `{self.checkpoint_table}` (
+                table_fqn   STRING NOT NULL,
+                fingerprint STRING NOT NULL,
+                stage       STRING NOT NULL,
+                data        STRING,
+                created_at  TIMESTAMP NOT NULL
+            )
+            PARTITION BY DATE(created_at)
+            CLUSTER BY table_fqn
+            OPTIONS (partition_expiration_days = {CHECKPOINT_TTL_DAYS})
+        """
+        try:
+            self.bq_client.query(ddl).result()
+        except Exception as exc:
+            logger.warning(f"No se pudo asegurar la tabla de checkpoints: {exc}")
+
+    def prefetch(self, table_fqns: Iterable[str]) -> None:
+        """
+        Carga en memoria el último checkpoint por etapa de cada tabla,
+        omitiendo los de ciclos ya completados.
+        """
+        table_fqns = sorted(set(table_fqns))
+        if not table_fqns:
+            return
+
+        query = f"""
+            WITH recent AS (
+                SELECT table_fqn, fingerprint, stage, data, created_at
+                FROM `{self.checkpoint_table}`
+                WHERE table_fqn IN UNNEST(@table_fqns)
+                  AND created_at >= TIMESTAMP_SUB(
+                      CURRENT_TIMESTAMP(), INTERVAL {CHECKPOINT_TTL_DAYS} DAY
+                  )
+            ),
+            completed AS (
+                SELECT table_fqn, fingerprint, MAX(created_at) AS completed_at
+                FROM recent
+                WHERE stage = '{COMPLETED}'
+                GROUP BY table_fqn, fingerprint
+            )
+            SELECT r.table_fqn, r.fingerprint, r.stage, r.data
+            FROM recent AS r
+            LEFT JOIN completed AS c USING (table_fqn, fingerprint)
+            WHERE r.stage != '{COMPLETED}'
+              AND (c.completed_at IS NULL OR r.created_at > c.completed_at)
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY r.table_fqn, r.fingerprint, r.stage
+                ORDER BY r.created_at DESC
+            ) = 1
+        """
+
+        rows = self.bq_client.query(
+            query,
+            job_config=bigquery.QueryJobConfig(
+                query_parameters=[
+                    bigquery.ArrayQueryParameter("table_fqns", "STRING", table_fqns),
+                ]
+            ),
+        ).result()
+
+        loaded = 0
+        with self._lock:
+            for row in rows:
+                stages = self._cache.setdefault((row.table_fqn, row.fingerprint), {})
+                stages[row.stage] = json.loads(row.data) if row.data else {}
+                loaded += 1
+
+        logger.info(f"Checkpoints cargados: {loaded} para {len(table_fqns)} tablas")
+
+    def for_table(self, table_fqn: str, fingerprint: str) -> TableCheckpoint:
+        with self._lock:
+            stages = dict(self._cache.get((table_fqn, fingerprint), {}))
+
+        if stages:
+            logger.info(
+                f"[{table_fqn}] Reanudando desde checkpoints: {sorted(stages)}"
+            )
+        return TableCheckpoint(self, table_fqn, fingerprint, stages)
+
+    def mark_completed(self, table_fqn: str, fingerprint: str) -> None:
+        """
+        La tabla terminó OK: sus etapas no se reutilizan en el próximo ciclo.
+        El marcador se escribe en flush_completed (uno por lote, no por tabla).
+        """
+        with self._lock:
+            self._cache.pop((table_fqn, fingerprint), None)
+            self._completed.append(_row(table_fqn, fingerprint, COMPLETED, {}))
+
+    def flush_completed(self) -> None:
+        with self._lock:
+            rows, self._completed = self._completed, []
+        if not rows:
+            return
+
+        # un marcador perdido solo permite reutilizar etapas ya válidas
+        try:
+            errors = self.bq_client.insert_rows_json(self.checkpoint_table, rows)
+            if errors:
+                logger.warning(f"Marcadores completed rechazados: {errors}")
+        except Exception as exc:
+            logger.warning(f"No se pudieron guardar marcadores completed: {exc}")
+
+    def save(self, table_fqn: str, fingerprint: str, stage: str, data: Any) -> None:
+        row = _row(table_fqn, fingerprint, stage, data)
+
+        # un checkpoint perdido solo cuesta rehacer la etapa: nunca falla la tabla
+        try:
+            errors = self.bq_client.insert_rows_json(self.checkpoint_table, [row])
+            if errors:
+                logger.warning(f"[{table_fqn}] Checkpoint {stage} rechazado: {errors}")
+        except Exception as exc:
+            logger.warning(f"[{table_fqn}] No se pudo guardar checkpoint {stage}: {exc}")
+
+
+def _row(table_fqn: str, fingerprint: str, stage: str, data: Any) -> dict:
+    return {
+        "table_fqn": table_fqn,
+        "fingerprint": fingerprint,
+        "stage": stage,
+        "data": json.dumps(data, ensure_ascii=False, default=str),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
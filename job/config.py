@@ -1,6 +1,13 @@
 import os
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "y")
 
 
 @dataclass(frozen=True)
@@ -21,9 +28,53 @@ class JobConfig:
     # Reintentos LLM
     llm_retries: int
 
-    # Delay inicial anti-thundering herd
+    # Delay inicial anti-thundering herd (solo sin sharding)
     startup_jitter_sec: float
 
+    # Sharding determinístico del backlog por task de Cloud Run
+    shard_by_task: bool
+    task_index: int
+    task_count: int
+
+    # Size hints del tracker desde INFORMATION_SCHEMA (región de BigQuery)
+    refresh_size_hints: bool
+    bq_region: str
+
+    # Deadline de la task (TIMEOUT de Cloud Run) y margen para flush final
+    task_timeout_sec: int
+    deadline_margin_sec: int
+
+    # Presupuesto de reintentos y back-off exponencial entre intentos
+    max_attempts: int
+    retry_backoff_sec: int
+    retry_backoff_max_sec: int
+
+    # Checkpoints por etapa (deshabilitado si no se define la tabla)
+    checkpoint_table_fqn: Optional[str]
+
+    # Glosario de columnas entre tablas (deshabilitado si no se define la tabla)
+    glossary_table_fqn: Optional[str]
+
+    # Publisher de Dataplex en segundo plano
+    dataplex_async: bool
+    dataplex_workers: int
+    dataplex_queue_size: int
+    dataplex_retries: int
+
+    # Descripciones de BigQuery por lotes (script DDL por dataset)
+    bq_batch_writes: bool
+    bq_write_batch_size: int
+
+    # Familias de tablas shardeadas: un LLM por familia (ver job.families)
+    family_detection: bool
+    family_pool_shards: int
+
+    # Modo del job: online | batch_prepare | batch_ingest (ver job.batch_prediction)
+    job_mode: str
+    batch_requests_uri: Optional[str]
+    batch_results_uri: Optional[str]
+    batch_submit: bool
+
     @classmethod
     def from_env(cls) -> "JobConfig":
         tracker_table_fqn = os.environ["TRACKER_TABLE_FQN"]
@@ -44,4 +95,28 @@ class JobConfig:
             ],
             llm_retries=int(os.getenv("LLM_RETRIES", "3")),
             startup_jitter_sec=float(os.getenv("STARTUP_JITTER_SEC", "3")),
+            shard_by_task=_env_bool("SHARD_BY_TASK", False),
+            task_index=int(os.getenv("CLOUD_RUN_TASK_INDEX", "0")),
+            task_count=int(os.getenv("CLOUD_RUN_TASK_COUNT", "1")),
+            refresh_size_hints=_env_bool("REFRESH_SIZE_HINTS", False),
+            bq_region=os.getenv("BQ_REGION", "region-us"),
+            task_timeout_sec=int(os.getenv("TASK_TIMEOUT_SEC", "7200")),
+            deadline_margin_sec=int(os.getenv("DEADLINE_MARGIN_SEC", "180")),
+            max_attempts=int(os.getenv("MAX_ATTEMPTS", "5")),
+            retry_backoff_sec=int(os.getenv("RETRY_BACKOFF_SEC", "900")),
+            retry_backoff_max_sec=int(os.getenv("RETRY_BACKOFF_MAX_SEC", "86400")),
+            checkpoint_table_fqn=os.getenv("CHECKPOINT_TABLE_FQN") or None,
+            glossary_table_fqn=os.getenv("GLOSSARY_TABLE_FQN") or None,
+            dataplex_async=_env_bool("DATAPLEX_ASYNC", True),
+            dataplex_workers=int(os.getenv("DATAPLEX_WORKERS", "4")),
+            dataplex_queue_size=int(os.getenv("DATAPLEX_QUEUE_SIZE", "100")),
+            dataplex_retries=int(os.getenv("DATAPLEX_RETRIES", "3")),
+            bq_batch_writes=_env_bool("BQ_BATCH_WRITES", True),
+            bq_write_batch_size=int(os.getenv("BQ_WRITE_BATCH_SIZE", "100")),
+            family_detection=_env_bool("FAMILY_DETECTION", True),
+            family_pool_shards=int(os.getenv("FAMILY_POOL_SHARDS", "1")),
+            job_mode=os.getenv("JOB_MODE", "online").strip().lower(),
+            batch_requests_uri=os.getenv("BATCH_REQUESTS_URI") or None,
+            batch_results_uri=os.getenv("BATCH_RESULTS_URI") or None,
+            batch_submit=_env_bool("BATCH_SUBMIT", False),
         )
@@ -0,0 +1,43 @@
+"""
+Estimador de duración por tabla para ordenar el trabajo longest-expected-first.
+
+Prioridad de señales:
+1. duration_ms aprendido de la última ejecución OK de la tabla
+2. size hints del tracker (size_bytes, num_columns) refrescados desde
+   INFORMATION_SCHEMA.TABLE_STORAGE / COLUMNS
+3. un default conservador para tablas sin información
+
+La misma fórmula existe en SQL (ESTIMATE_SQL) para que el claim ordene
+igual que el scheduling dentro de la task.
+"""
+
+from typing import Dict
+
+# Coste fijo por tabla: get_table + prompt + latencia base del LLM
+BASE_MS = 20_000
+# Coste marginal por columna (perfilado + tokens de salida)
+PER_COLUMN_MS = 400
+# Coste marginal por GB lógico escaneado en el perfilado
+PER_GB_MS = 1_500
+# Ancho asumido cuando no hay hint de columnas
+DEFAULT_COLUMNS = 30
+
+ESTIMATE_SQL = (
+    f"COALESCE(duration_ms, {BASE_MS}"
+    f" + {PER_COLUMN_MS} * COALESCE(num_columns, {DEFAULT_COLUMNS})"
+    f" + CAST({PER_GB_MS} * COALESCE(size_bytes, 0) / 1e9 AS INT64))"
+)
+
+
+def estimate_duration_ms(row: Dict) -> int:
+    """
+    Duración esperada en ms para una fila del tracker.
+    """
+    last_duration = row.get("duration_ms")
+    if last_duration:
+        return int(last_duration)
+
+    num_columns = row.get("num_columns") or DEFAULT_COLUMNS
+    size_bytes = row.get("size_bytes") or 0
+
+    return int(BASE_MS + PER_COLUMN_MS * num_columns + PER_GB_MS * size_bytes / 1e9)
@@ -0,0 +1,135 @@
+"""
+Regeneración por delta ante evolución de schema.
+
+Cada tabla OK deja en el tracker un snapshot (payload_snapshot) con el último
+payload validado y el tipo/modo de cada columna. Cuando la tabla vuelve con
+un schema distinto, solo las columnas nuevas o que cambiaron de tipo se
+perfilan y se piden al LLM; el resto del payload se conserva y las columnas
+ya documentadas viajan en el prompt como contexto de solo lectura.
+"""
+
+import json
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from google.cloud import bigquery
+
+from app.adapters.bq_reader import iter_schema_paths
+
+logger = logging.getLogger(__name__)
+
+# Por encima de esta fracción de columnas cambiadas se regenera la tabla completa
+DELTA_MAX_FRACTION = 0.5
+
+
+@dataclass
+class DeltaPlan:
+    # rutas a generar (nuevas o con tipo/modo distinto)
+    changed: List[str]
+    # entradas validadas que se conservan, por ruta
+    kept: Dict[str, dict]
+    table_description: dict
+
+
+def column_types(table: bigquery.Table) -> Dict[str, str]:
+    return {
+        path: f"{field.field_type}:{field.mode}"
+        for path, field in iter_schema_paths(table.schema)
+    }
+
+
+def build_snapshot(table: bigquery.Table, fingerprint: str, payload: dict) -> dict:
+    return {
+        "fingerprint": fingerprint,
+        "types": column_types(table),
+        "payload": payload,
+    }
+
+
+def parse_snapshot(raw) -> Optional[dict]:
+    if not raw:
+        return None
+    try:
+        snapshot = json.loads(raw) if isinstance(raw, str) else raw
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(snapshot, dict) or not isinstance(snapshot.get("payload"), dict):
+        return None
+    return snapshot
+
+
+def plan_delta(
+    snapshot: Optional[dict], table: bigquery.Table, fingerprint: str
+) -> Optional[DeltaPlan]:
+    """
+    Plan de regeneración parcial, o None si corresponde la tabla completa:
+    sin snapshot, mismo fingerprint (refresh pedido a mano) o demasiados
+    cambios para que el delta compense. Si solo se eliminaron columnas el
+    plan no tiene nada que generar (changed vacío): se conserva el resto.
+    """
+    if snapshot is None or snapshot.get("fingerprint") == fingerprint:
+        return None
+
+    previous_types = snapshot.get("types") or {}
+    current_types = column_types(table)
+    previous_columns = {
+        col.get("name"): col
+        for col in snapshot["payload"].get("columns") or []
+        if isinstance(col, dict)
+    }
+
+    changed = [
+        path
+        for path, type_mode in current_types.items()
+        if previous_types.get(path) != type_mode or path not in previous_columns
+    ]
+    if len(changed) > DELTA_MAX_FRACTION * len(current_types):
+        return None
+
+    changed_set = set(changed)
+    kept = {
+        path: previous_columns[path]
+        for path in current_types
+        if path not in changed_set and path in previous_columns
+    }
+
+    return DeltaPlan(
+        changed=changed,
+        kept=kept,
+        table_description=snapshot["payload"]["table_description"],
+    )
+
+
+def known_descriptions(plan: DeltaPlan) -> Dict[str, str]:
+    return {
+        path: col.get("description") or ""
+        for path, col in plan.kept.items()
+        if col.get("description")
+    }
+
+
+def merge_delta(plan: DeltaPlan, generated: dict, table: bigquery.Table) -> dict:
+    """
+    Payload completo: columnas conservadas + generadas, en orden del schema.
+    La descripción de tabla validada se conserva. Las columnas eliminadas
+    del schema desaparecen del payload.
+    """
+    changed = set(plan.changed)
+    generated_columns = {}
+    for col in generated.get("columns") or []:
+        if isinstance(col, dict) and col.get("name") in changed:
+            generated_columns.setdefault(col["name"], col)
+
+    columns = []
+    for path, _ in iter_schema_paths(table.schema):
+        if path in plan.kept:
+            columns.append(plan.kept[path])
+        elif path in generated_columns:
+            columns.append(generated_columns[path])
+
+    merged = dict(generated)
+    merged["table_fqn"] = f"{table.project}.{table.dataset_id}.{table.table_id}"
+    merged["table_description"] = plan.table_description
+    merged["columns"] = columns
+    return merged
@@ -0,0 +1,129 @@
+"""
+Detección de familias de tablas shardeadas (events_20240101 … events_20241231,
+copias por período con el mismo schema).
+
+Una familia son las tablas reclamadas del mismo dataset con el mismo prefijo
+de nombre (sin el sufijo de período) y el mismo fingerprint de schema. Solo el
+representante (el shard más reciente) se perfila y pasa por el LLM; el payload
+validado se replica al resto con table_fqn reescrito.
+"""
+
+import copy
+import logging
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from google.cloud import bigquery
+
+from app.adapters.bq_reader import get_table_metadata, schema_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Sufijo de período: 2024, 202401, 20240101, 2024_01, 2024_01_01. Un solo
+# grupo (el prefijo) y sintaxis RE2: el tracker usa el mismo patrón en SQL
+# (REGEXP_EXTRACT) para repartir las familias completas entre tasks.
+PERIOD_SUFFIX_PATTERN = r"^(.*?[A-Za-z].*?)_?\d{4}(?:_?\d{2}){0,2}$"
+_PERIOD_SUFFIX = re.compile(PERIOD_SUFFIX_PATTERN)
+
+
+def family_stem(table_name: str) -> Optional[str]:
+    match = _PERIOD_SUFFIX.match(table_name)
+    if not match:
+        return None
+    return match.group(1).rstrip("_")
+
+
+def group_families(
+    rows: List[Dict],
+    get_client: Callable[[str], bigquery.Client],
+    max_workers: int,
+) -> Tuple[List[Dict], Dict[str, List[Dict]]]:
+    """
+    Retorna (filas a procesar, {fqn del representante: filas miembro}).
+    Las filas miembro no se procesan: esperan el payload del representante.
+    Solo se lee la metadata de las tablas cuyo prefijo se repite en el claim.
+    """
+    by_stem: Dict[Tuple[str, str, str], List[Dict]] = defaultdict(list)
+    for row in rows:
+        stem = family_stem(row["table"])
+        if stem:
+            by_stem[(row["catalog"], row["schema"], stem)].append(row)
+
+    candidates = [row for group in by_stem.values() if len(group) > 1 for row in group]
+    if not candidates:
+        return rows, {}
+
+    def fingerprint(row: Dict) -> Optional[str]:
+        try:
+            table = get_table_metadata(
+                row["catalog"], row["schema"], row["table"], get_client(row["catalog"])
+            )
+            return schema_fingerprint(table)
+        except Exception as exc:
+            # sin fingerprint la tabla se procesa sola
+            logger.warning(
+                f"[{row['catalog']}.{row['schema']}.{row['table']}] "
+                f"Sin fingerprint para familia: {exc}"
+            )
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        fingerprints = list(executor.map(fingerprint, candidates))
+
+    families: Dict[Tuple, List[Dict]] = defaultdict(list)
+    for row, fp in zip(candidates, fingerprints):
+        if fp is not None:
+            stem = family_stem(row["table"])
+            families[(row["catalog"], row["schema"], stem, fp)].append(row)
+
+    members_by_rep: Dict[str, List[Dict]] = {}
+    member_ids = set()
+    for group in families.values():
+        if len(group) < 2:
+            continue
+        # el shard más reciente representa mejor el schema y los datos actuales
+        group.sort(key=lambda r: r["table"], reverse=True)
+        rep, members = group[0], group[1:]
+        rep_fqn = f"{rep['catalog']}.{rep['schema']}.{rep['table']}"
+        members_by_rep[rep_fqn] = members
+        member_ids.update(id(m) for m in members)
+
+    if members_by_rep:
+        logger.info(
+            f"Familias detectadas: {len(members_by_rep)} | "
+            f"miembros sin LLM: {len(member_ids)}"
+        )
+
+    return [row for row in rows if id(row) not in member_ids], members_by_rep
+
+
+def payload_for_member(payload: dict, member: Dict) -> dict:
+    member_payload = copy.deepcopy(payload)
+    member_payload["table_fqn"] = (
+        f"{member['catalog']}.{member['schema']}.{member['table']}"
+    )
+    return member_payload
+
+
+def pool_profiles(base: dict, others: List[dict], max_examples: int = 10) -> dict:
+    """
+    Suma a los ejemplos del representante los de otros shards (sin repetir),
+    para que el LLM vea la variedad de la familia y no solo un período.
+    """
+    pooled = {}
+    for column, col_profile in base.items():
+        col_profile = dict(col_profile or {})
+        examples = list(col_profile.get("example_values") or [])
+        seen = {str(value) for value in examples}
+        for other in others:
+            for value in (other.get(column) or {}).get("example_values") or []:
+                if len(examples) >= max_examples:
+                    break
+                if str(value) not in seen:
+                    seen.add(str(value))
+                    examples.append(value)
+        col_profile["example_values"] = examples
+        pooled[column] = col_profile
+    return pooled
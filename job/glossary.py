@@ -0,0 +1,307 @@
+"""
+Glosario de columnas entre tablas: descripciones validadas que se reutilizan
+para columnas equivalentes (num_poliza, cod_producto, fec_proceso, ...).
+
+La clave es (nombre normalizado, tipo, forma de los valores). La forma resume
+los ejemplos del perfil ("POL-000123" → "A-9") para no mezclar columnas con
+el mismo nombre y contenido distinto. Cada entrada guarda la descripción de
+mayor accuracy vista y en cuántas tablas distintas se observó (re-runs y
+reintentos de la misma tabla no suman frecuencia).
+
+- Confianza alta (accuracy y frecuencia altas): la columna no va al prompt,
+  se completa con la entrada del glosario.
+- Confianza media: la descripción va en el prompt como respuesta sugerida.
+"""
+
+import json
+import logging
+import re
+from collections import Counter
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from google.cloud import bigquery
+
+from app.adapters.bq_reader import iter_schema_paths
+from app.adapters.bq_writer import MIN_ACCURACY
+
+logger = logging.getLogger(__name__)
+
+# Se omite del prompt: descripción muy confiable y vista en varias tablas
+GLOSSARY_OMIT_ACCURACY = 0.9
+GLOSSARY_OMIT_FREQUENCY = 5
+# Se sugiere en el prompt: descripción aceptable vista más de una vez
+GLOSSARY_HINT_FREQUENCY = 2
+# Tablas guardadas por clave para contar frecuencia distinta; la frecuencia
+# satura aquí (muy por encima de los umbrales)
+GLOSSARY_MAX_TABLES = 50
+
+_MAX_SHAPE_LEN = 24
+
+
+def normalize_name(path: str) -> str:
+    """Último segmento de la ruta, en minúsculas y sin separadores extremos."""
+    return path.rsplit(".", 1)[-1].strip().strip("_").lower()
+
+
+def value_shape(examples: Iterable) -> str:
+    """
+    Forma dominante de los ejemplos: dígitos → 9, letras → A (rachas
+    colapsadas), el resto literal. "" si no hay ejemplos.
+    """
+    shapes = Counter()
+    for value in examples:
+        text = str(value).strip().strip('"')
+        if not text:
+            continue
+        shape = re.sub(r"[0-9]+", "9", text)
+        shape = re.sub(r"[^\W\d_]+", "A", shape)
+        shapes[shape[:_MAX_SHAPE_LEN]] += 1
+    return shapes.most_common(1)[0][0] if shapes else ""
+
+
+def glossary_key(path: str, field_type: str, examples: Iterable) -> str:
+    return f"{normalize_name(path)}|{field_type}|{value_shape(examples)}"
+
+
+class GlossaryStore:
+    """
+    Glosario en una tabla BigQuery: se carga completo al inicio del job y las
+    observaciones nuevas se consolidan al final con un único MERGE.
+    """
+
+    def __init__(self, bq_client: bigquery.Client, glossary_table: str):
+        self.bq_client = bq_client
+        self.glossary_table = glossary_table
+        self._entries: Dict[str, dict] = {}
+        # clave -> (mejor observación, FQNs de las tablas que la aportaron)
+        self._observations: Dict[str, Tuple[dict, Set[str]]] = {}
+        self._lock = Lock()
+
+    def ensure_table(self) -> None:
+        ddl = f"""
+            CREATE TABLE IF NOT EXISTS `{self.glossary_table}` (
+                key         STRING NOT NULL,
+                name        STRING,
+                field_type  STRING,
+                shape       STRING,
+                description STRING,
+                accuracy    FLOAT64,
+                is_computed BOOL,
+                sensitivity BOOL,
+                frequency   INT64,
+                tables      ARRAY<STRING>,
+                updated_at  TIMESTAMP
+            )
+            CLUSTER BY key
+        """
+        try:
+            self.bq_client.query(ddl).result()
+            # glosarios creados antes de contar tablas distintas
+            self.bq_client.query(
+                f"ALTER TABLE `{self.glossary_table}` "
+                f"ADD COLUMN IF NOT EXISTS tables ARRAY<STRING>"
+            ).result()
+        except Exception as exc:
+            logger.warning(f"No se pudo asegurar la tabla de glosario: {exc}")
+
+    def load(self) -> None:
+        query = f"""
+            SELECT key, description, accuracy, is_computed, sensitivity, frequency
+            FROM `{self.glossary_table}`
+            WHERE accuracy >= {MIN_ACCURACY}
+              AND frequency >= {GLOSSARY_HINT_FREQUENCY}
+        """
+        entries = {row.key: dict(row) for row in self.bq_client.query(query).result()}
+        with self._lock:
+            self._entries = entries
+        logger.info(f"Glosario cargado: {len(entries)} entradas")
+
+    # ── consulta ────────────────────────────────────────────────────────────
+
+    def match(
+        self, table: bigquery.Table, profile: dict, paths: Optional[Iterable[str]] = None
+    ) -> Tuple[Dict[str, dict], Dict[str, str]]:
+        """
+        Retorna (columnas prellenadas {ruta: entrada del contrato},
+        sugerencias {ruta: descripción}) para las rutas indicadas.
+        """
+        wanted = None if paths is None else set(paths)
+        prefilled: Dict[str, dict] = {}
+        hints: Dict[str, str] = {}
+
+        for path, field in iter_schema_paths(table.schema):
+            if wanted is not None and path not in wanted:
+                continue
+            examples = (profile.get(path) or {}).get("example_values") or []
+            entry = self._entries.get(glossary_key(path, field.field_type, examples))
+            if entry is None:
+                continue
+
+            if (
+                entry["accuracy"] >= GLOSSARY_OMIT_ACCURACY
+                and entry["frequency"] >= GLOSSARY_OMIT_FREQUENCY
+            ):
+                prefilled[path] = {
+                    "name": path,
+                    "description": entry["description"],
+                    "accuracy": entry["accuracy"],
+                    "is_computed": bool(entry["is_computed"]),
+                    "sensitivity": bool(entry["sensitivity"]),
+                }
+            else:
+                hints[path] = entry["description"]
+
+        return prefilled, hints
+
+    # ── observaciones ───────────────────────────────────────────────────────
+
+    def observe(
+        self,
+        table: bigquery.Table,
+        profile: dict,
+        columns: List[dict],
+        hints: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """
+        Registra las columnas generadas por el LLM con accuracy suficiente.
+        Las prellenadas desde el glosario no se registran (no son evidencia
+        nueva), ni las que repiten la sugerencia del prompt (hints): el modelo
+        copiando el glosario no confirma la entrada.
+        """
+        table_fqn = f"{table.project}.{table.dataset_id}.{table.table_id}"
+        fields = dict(iter_schema_paths(table.schema))
+        with self._lock:
+            for col in columns:
+                field = fields.get(col.get("name"))
+                if field is None or not col.get("description"):
+                    continue
+                if col.get("accuracy", 0.0) < MIN_ACCURACY:
+                    continue
+                hint = (hints or {}).get(col["name"])
+                if hint and hint.strip() == col["description"].strip():
+                    continue
+
+                examples = (profile.get(col["name"]) or {}).get("example_values") or []
+                key = glossary_key(col["name"], field.field_type, examples)
+                best, tables = self._observations.get(key, (None, set()))
+                if best is None or col["accuracy"] > best["accuracy"]:
+                    best = {
+                        "key": key,
+                        "name": normalize_name(col["name"]),
+                        "field_type": field.field_type,
+                        "shape": value_shape(examples),
+                        "description": col["description"],
+                        "accuracy": col["accuracy"],
+                        "is_computed": col.get("is_computed"),
+                        "sensitivity": col.get("sensitivity"),
+                    }
+                tables.add(table_fqn)
+                self._observations[key] = (best, tables)
+
+    def flush(self) -> None:
+        with self._lock:
+            observations = list(self._observations.values())
+            self._observations = {}
+        if not observations:
+            return
+
+        rows = [
+            dict(best, tables=sorted(tables)[:GLOSSARY_MAX_TABLES])
+            for best, tables in observations
+        ]
+        # unión de las tablas ya registradas y las nuevas, sin repetidos
+        merged_tables = (
+            "ARRAY(SELECT DISTINCT fqn FROM UNNEST("
+            "ARRAY_CONCAT(IFNULL(t.tables, []), src.tables)) AS fqn "
+            f"ORDER BY fqn LIMIT {GLOSSARY_MAX_TABLES})"
+        )
+        merge_query = f"""
+            MERGE `{self.glossary_table}` AS t
+            USING (
+                SELECT
+                    JSON_VALUE(item, '$.key')                         AS key,
+                    JSON_VALUE(item, '$.name')                        AS name,
+                    JSON_VALUE(item, '$.field_type')                  AS field_type,
+                    JSON_VALUE(item, '$.shape')                       AS shape,
+                    JSON_VALUE(item, '$.description')                 AS description,
+                    CAST(JSON_VALUE(item, '$.accuracy') AS FLOAT64)   AS accuracy,
+                    CAST(JSON_VALUE(item, '$.is_computed') AS BOOL)   AS is_computed,
+                    CAST(JSON_VALUE(item, '$.sensitivity') AS BOOL)   AS sensitivity,
+                    JSON_VALUE_ARRAY(item, '$.tables')               AS tables
+                FROM UNNEST(JSON_QUERY_ARRAY(@payload)) AS item
+            ) AS src
+            ON t.key = src.key
+            WHEN MATCHED THEN UPDATE SET
+                t.tables      = {merged_tables},
+                t.frequency   = ARRAY_LENGTH({merged_tables}),
+                t.description = IF(src.accuracy > t.accuracy, src.description, t.description),
+                t.is_computed = IF(src.accuracy > t.accuracy, src.is_computed, t.is_computed),
+                t.sensitivity = IF(src.accuracy > t.accuracy, src.sensitivity, t.sensitivity),
+                t.accuracy    = GREATEST(t.accuracy, src.accuracy),
+                t.updated_at  = @now
+            WHEN NOT MATCHED THEN INSERT (
+                key, name, field_type, shape, description, accuracy,
+                is_computed, sensitivity, frequency, tables, updated_at
+            ) VALUES (
+                src.key, src.name, src.field_type, src.shape, src.description,
+                src.accuracy, src.is_computed, src.sensitivity,
+                ARRAY_LENGTH(src.tables), src.tables, @now
+            )
+        """
+
+        # el glosario es una optimización: un fallo no afecta al job
+        try:
+            self.bq_client.query(
+                merge_query,
+                job_config=bigquery.QueryJobConfig(
+                    query_parameters=[
+                        bigquery.ScalarQueryParameter(
+                            "payload", "STRING", json.dumps(rows, ensure_ascii=False)
+                        ),
+                        bigquery.ScalarQueryParameter(
+                            "now", "TIMESTAMP", datetime.now(timezone.utc)
+                        ),
+                    ]
+                ),
+            ).result()
+            logger.info(f"Glosario actualizado: {len(rows)} claves")
+        except Exception as exc:
+            logger.warning(f"No se pudo actualizar el glosario: {exc}")
+
+
+def merge_prefilled(
+    prefilled: Dict[str, dict], generated: dict, table: bigquery.Table
+) -> dict:
+    """
+    Payload con las columnas del glosario insertadas en orden del schema.
+    Si el LLM igual devolvió una columna prellenada, gana el glosario.
+    """
+    generated_columns = [
+        col
+        for col in generated.get("columns") or []
+        if not (isinstance(col, dict) and col.get("name") in prefilled)
+    ]
+    by_name = {}
+    for col in generated_columns:
+        if isinstance(col, dict) and isinstance(col.get("name"), str):
+            by_name.setdefault(col["name"], []).append(col)
+
+    columns = []
+    for path, _ in iter_schema_paths(table.schema):
+        if path in prefilled:
+            columns.append(prefilled[path])
+        else:
+            columns.extend(by_name.pop(path, []))
+    # entradas fuera del schema o sin nombre: quedan para validación/reparación
+    columns.extend(
+        col
+        for col in generated_columns
+        if not (isinstance(col, dict) and isinstance(col.get("name"), str))
+        or col["name"] in by_name
+    )
+
+    merged = dict(generated)
+    merged["columns"] = columns
+    return merged
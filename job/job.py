@@ -1,10 +1,41 @@
+import json
 import logging
+import queue
 import sys
 import random
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-from job.bq_tracker import claim_pending_tables, batch_update_status
+from collections import deque
+from typing import Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from app.errors import TRANSIENT, classify_error
+from app.adapters.vertex_llm import llm_stats
+from app.adapters.bq_writer import BatchedSchemaWriter
+from app.services.dataplex_writer import DataplexPublisher
+from job.batch_prediction import (
+    BATCH_INGEST,
+    BATCH_PREPARE,
+    ONLINE,
+    load_results,
+    run_prepare,
+)
+from job.bq_tracker import (
+    claim_batch_tables,
+    claim_pending_tables,
+    batch_update_status,
+    ensure_tracker_columns,
+    fetch_snapshot,
+    refresh_size_hints,
+    release_unfinished,
+)
+from job.checkpoints import BQ_WRITE, DATAPLEX_WRITE, CheckpointStore
+from job.cost_model import estimate_duration_ms
+from job.delta import parse_snapshot
+from job.families import group_families, payload_for_member
+from job.glossary import GlossaryStore
+from job.metrics import StageHistograms
+from job.retry_policy import failure_row as build_failure_row
 from job.processor import process_table
 from job.config import JobConfig
 from job.bq_client_factory import get_bq_client
@@ -17,10 +48,11 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def chunked(iterable, size):
-    for i in range(0, len(iterable), size):
-        yield iterable[i : i + size]
+# etapa de checkpoint que completa cada escritura diferida
+_SINK_STAGES = {"bq": BQ_WRITE, "dataplex": DATAPLEX_WRITE}
 
+# tablas más caras que se listan en el resumen de la task
+COSTLIEST_TABLES = 5
 
 # cache local para evitar múltiples lookups al factory
 _clients_cache = {}
@@ -37,117 +69,714 @@ def get_client_cached(project_id: str):
 def run() -> None:
     cfg = JobConfig.from_env()
 
-    # evita thundering herd entre múltiples tasks
-    time.sleep(random.uniform(0, cfg.startup_jitter_sec))
+    if cfg.job_mode not in (ONLINE, BATCH_PREPARE, BATCH_INGEST):
+        raise ValueError(f"JOB_MODE desconocido: {cfg.job_mode}")
+    # se valida antes del claim para no dejar filas en PROCESSING
+    if cfg.job_mode == BATCH_PREPARE and not cfg.batch_requests_uri:
+        raise ValueError("BATCH_REQUESTS_URI es obligatorio en modo batch_prepare")
+    if cfg.job_mode == BATCH_PREPARE and cfg.batch_submit and not cfg.batch_results_uri:
+        raise ValueError("BATCH_SUBMIT requiere BATCH_RESULTS_URI como destino")
+
+    # Cloud Run mata la task en TASK_TIMEOUT_SEC; el margen cubre flush y release
+    deadline = time.time() + cfg.task_timeout_sec - cfg.deadline_margin_sec
+
+    shard = None
+    if cfg.shard_by_task and cfg.task_count > 1:
+        # cada task es dueña de su shard: no hay carrera en el claim
+        shard = (cfg.task_index, cfg.task_count)
+    else:
+        # evita thundering herd entre múltiples tasks
+        time.sleep(random.uniform(0, cfg.startup_jitter_sec))
 
     logger.info(
         f"Job iniciado | workers={cfg.max_workers} | "
         f"batch_size={cfg.batch_size} | tracker={cfg.tracker_table_fqn}"
+        f"{f' | shard={shard[0]}/{shard[1]}' if shard else ''}"
     )
 
     tracker_client = get_bq_client(cfg.tracker_project)
 
-    # claim de tablas
-    job_id, tables = claim_pending_tables(
-        tracker_client,
-        tracker_table=cfg.tracker_table_fqn,
-        batch_size=cfg.batch_size or 500,
-    )
+    ensure_tracker_columns(tracker_client, cfg.tracker_table_fqn)
+
+    # una sola task refresca los size hints para no duplicar el MERGE
+    if cfg.refresh_size_hints and cfg.task_index == 0:
+        try:
+            refresh_size_hints(
+                tracker_client,
+                tracker_table=cfg.tracker_table_fqn,
+                region=cfg.bq_region,
+            )
+        except Exception as exc:
+            logger.warning(f"No se pudieron refrescar size hints: {exc}")
+
+    batch_results = None
+    if cfg.job_mode == BATCH_INGEST:
+        # ingesta de un batch prediction: se reclaman las filas con resultado
+        batch_results = load_results(cfg.batch_results_uri)
+        result_fqns = sorted(batch_results)
+        if shard is not None:
+            result_fqns = result_fqns[shard[0] :: shard[1]]
+        job_id, tables = claim_batch_tables(
+            tracker_client,
+            tracker_table=cfg.tracker_table_fqn,
+            table_fqns=result_fqns,
+        )
+    else:
+        # claim de tablas: primero el shard propio
+        job_id, tables = claim_pending_tables(
+            tracker_client,
+            tracker_table=cfg.tracker_table_fqn,
+            batch_size=cfg.batch_size or 500,
+            shard=shard,
+        )
+
+    # shard propio drenado: robo entre shards sobre el backlog restante
+    if not tables and shard is not None and batch_results is None:
+        logger.info("Shard propio sin pendientes. Reclamando de otros shards...")
+        job_id, tables = claim_pending_tables(
+            tracker_client,
+            tracker_table=cfg.tracker_table_fqn,
+            batch_size=cfg.batch_size or 500,
+        )
 
     if not tables:
         logger.info("No hay tablas pendientes. Job finalizado.")
         return
 
     logger.info(f"Tablas claimadas: {len(tables)} | job_id={job_id}")
+    # queue_wait se mide desde el claim
+    claimed_at = time.monotonic()
+
+    # longest-expected-first: las tablas caras arrancan primero
+    for row in tables:
+        row["expected_ms"] = estimate_duration_ms(row)
+    tables.sort(key=lambda r: r["expected_ms"], reverse=True)
+
+    if cfg.job_mode == BATCH_PREPARE:
+        batch_stats = run_prepare(
+            cfg, tracker_client, job_id, tables, get_client_cached, deadline
+        )
+        logger.info(
+            f"Batch preparado | prepared={batch_stats['prepared']} | "
+            f"error={batch_stats['error']} | released={batch_stats['released']}"
+        )
+        return
+
+    # toda fila reclamada retoma desde sus checkpoints (también las cortadas
+    # por deadline, que vuelven con attempts=0); los ciclos que terminaron OK
+    # quedan cerrados por su marcador completed
+    checkpoints = None
+    if cfg.checkpoint_table_fqn:
+        checkpoints = CheckpointStore(tracker_client, cfg.checkpoint_table_fqn)
+        checkpoints.ensure_table()
+        try:
+            checkpoints.prefetch(
+                f"{row['catalog']}.{row['schema']}.{row['table']}" for row in tables
+            )
+        except Exception as exc:
+            logger.warning(f"No se pudieron cargar checkpoints: {exc}")
+
+    # el glosario es una optimización: si no carga, el job sigue sin él
+    glossary = None
+    if cfg.glossary_table_fqn and batch_results is None:
+        glossary = GlossaryStore(tracker_client, cfg.glossary_table_fqn)
+        glossary.ensure_table()
+        try:
+            glossary.load()
+        except Exception as exc:
+            logger.warning(f"No se pudo cargar el glosario: {exc}")
+            glossary = None
 
     results = []
-    stats = {"ok": 0, "error": 0}
+    stats = {
+        "ok": 0,
+        "error": 0,
+        "quarantined": 0,
+        "released": 0,
+        "dataplex_skipped": 0,
+        "fast_tier": 0,
+        "escalated": 0,
+        "family_members": 0,
+        "glossary_prefilled": 0,
+    }
+    # error absoluto relativo del estimador, para calibrar job.cost_model
+    estimate_errors = []
+    # ms por etapa de todas las tablas (p50/p95/p99 en el resumen final)
+    histograms = StageHistograms()
+
+    def stage_timings(result: dict) -> Optional[str]:
+        """Suma las etapas de la tabla a los histogramas; JSON para el tracker."""
+        timings = result.get("stage_ms")
+        if not timings:
+            return None
+        histograms.observe_all(timings)
+        return json.dumps(timings, sort_keys=True)
+
+    # (costo estimado de LLM, tabla) de las COSTLIEST_TABLES más caras
+    costliest = []
+
+    def llm_usage(fqn: str, result: dict) -> Optional[str]:
+        """Consumo de LLM de la tabla en JSON para el tracker."""
+        usage = result.get("llm_usage")
+        if not usage:
+            return None
+        costliest.append((usage["cost_usd"], fqn))
+        costliest.sort(reverse=True)
+        del costliest[COSTLIEST_TABLES:]
+        return json.dumps(usage, sort_keys=True)
 
     # tamaño de batch para escribir en BigQuery
     BATCH_UPDATE_SIZE = 200
 
-    with ThreadPoolExecutor(max_workers=cfg.max_workers) as executor:
-        for chunk in chunked(tables, cfg.max_workers):
-            futures = {
-                executor.submit(
-                    process_table,
-                    row["catalog"],
-                    row["schema"],
-                    row["table"],
-                    get_client_cached(row["catalog"]),
-                ): row
-                for row in chunk
+    def failure_row(row: dict, error_msg: str, error_type: str) -> dict:
+        failed = build_failure_row(
+            row,
+            error_msg,
+            error_type,
+            max_attempts=cfg.max_attempts,
+            backoff_sec=cfg.retry_backoff_sec,
+            backoff_max_sec=cfg.retry_backoff_max_sec,
+        )
+        if failed["estado"] == "QUARANTINE":
+            stats["quarantined"] += 1
+        return failed
+
+    def record_ok(row: dict, result: dict) -> None:
+        fqn = f"{row['catalog']}.{row['schema']}.{row['table']}"
+        # con payload ya generado (batch o familia) la duración no incluye
+        # perfilado ni LLM: no alimenta el estimador
+        from_batch = "generated_payload" in row
+
+        results.append(
+            {
+                "catalog": row["catalog"],
+                "schema": row["schema"],
+                "table": row["table"],
+                "estado": "OK",
+                "error": None,
+                # solo las ejecuciones OK alimentan el estimador
+                "duration_ms": None if from_batch else result["duration_ms"],
+                "attempts": 0,
+                "aspect_hash": result.get("aspect_hash"),
+                "model_tier": result.get("model_tier"),
+                "escalated": result.get("escalated"),
+                "family_rep": row.get("family_rep"),
+                "payload_snapshot": json.dumps(
+                    result["snapshot"], ensure_ascii=False, default=str
+                )
+                if result.get("snapshot")
+                else None,
+                "stage_timings": stage_timings(result),
+                "llm_usage": llm_usage(fqn, result),
             }
+        )
+        if checkpoints is not None and result.get("fingerprint"):
+            checkpoints.mark_completed(fqn, result["fingerprint"])
+        stats["ok"] += 1
+        if result.get("model_tier") == "fast":
+            stats["fast_tier"] += 1
+        if result.get("escalated"):
+            stats["escalated"] += 1
+        if result.get("dataplex_skipped"):
+            stats["dataplex_skipped"] += 1
+        stats["glossary_prefilled"] += result.get("glossary_prefilled") or 0
+        actual_ms = result["duration_ms"]
+        if actual_ms and not from_batch:
+            estimate_errors.append(abs(row["expected_ms"] - actual_ms) / actual_ms)
+        logger.info(
+            f"[OK] {fqn} | predicted_ms={row['expected_ms']} | actual_ms={actual_ms}"
+        )
 
-            for future in as_completed(futures):
-                row = futures[future]
-                fqn = f"{row['catalog']}.{row['schema']}.{row['table']}"
-
-                try:
-                    result = future.result()
-
-                    results.append(
-                        {
-                            "catalog": row["catalog"],
-                            "schema": row["schema"],
-                            "table": row["table"],
-                            "estado": result["estado"],
-                            "error": result["error"],
-                        }
-                    )
+    def record_write_failure(row: dict, result: dict, errors: list) -> None:
+        fqn = f"{row['catalog']}.{row['schema']}.{row['table']}"
+        error_msg = "; ".join(errors)
+
+        # sin checkpoints las escrituras siguen siendo best-effort
+        if checkpoints is None:
+            logger.warning(f"[{fqn}] {error_msg}")
+            record_ok(row, result)
+            return
+
+        # el checkpoint validated hace que el reintento solo repita la escritura
+        failed = failure_row(row, error_msg[:500], TRANSIENT)
+        failed["stage_timings"] = stage_timings(result)
+        failed["llm_usage"] = llm_usage(fqn, result)
+        results.append(failed)
+        stats["error"] += 1
+        logger.error(f"[{failed['estado']}] {fqn} — {error_msg}")
+
+    # Escrituras diferidas (BQ por lotes, Dataplex en segundo plano): la fila
+    # queda en awaiting_writes hasta que todos sus sinks reporten.
+    awaiting_writes = {}
+    # Reportes que llegan antes de que handle_result registre la fila: el
+    # worker encola en el publisher dentro de process_table, y el outcome de
+    # Dataplex puede drenarse antes de que el dispatcher procese su future.
+    # Se aplican en await_writes; si la fila no espera escrituras (DEADLINE,
+    # ERROR) se descartan al terminar handle_result.
+    early_reports = {}
+
+    def complete_write(
+        fqn: str, sink: str, error=None, updates=None, timings=None
+    ) -> None:
+        entry = awaiting_writes.get(fqn)
+        if entry is None:
+            early_reports.setdefault(fqn, []).append((sink, error, updates, timings))
+            return
+        if sink not in entry["sinks"]:
+            return
+
+        stage_ms = entry["result"].setdefault("stage_ms", {})
+        for stage, ms in (timings or {}).items():
+            stage_ms[stage] = stage_ms.get(stage, 0) + int(ms)
+
+        entry["sinks"].discard(sink)
+        if error:
+            entry["errors"].append(error)
+        elif checkpoints is not None:
+            checkpoints.save(
+                fqn, entry["result"]["fingerprint"], _SINK_STAGES[sink], {}
+            )
+        if updates:
+            entry["result"].update(updates)
+
+        if not entry["sinks"]:
+            del awaiting_writes[fqn]
+            if entry["errors"]:
+                record_write_failure(entry["row"], entry["result"], entry["errors"])
+            else:
+                record_ok(entry["row"], entry["result"])
+
+    def await_writes(fqn: str, row: dict, result: dict, sinks: set) -> None:
+        awaiting_writes[fqn] = {
+            "row": row,
+            "result": result,
+            "sinks": sinks,
+            "errors": [],
+        }
+        for report in early_reports.pop(fqn, []):
+            complete_write(fqn, *report)
+
+    # Dataplex en segundo plano: los resultados llegan por esta cola
+    publish_outcomes = queue.Queue()
+
+    publisher = None
+    if cfg.dataplex_async:
+        publisher = DataplexPublisher(
+            on_done=lambda key, res: publish_outcomes.put((key, res)),
+            workers=cfg.dataplex_workers,
+            queue_size=cfg.dataplex_queue_size,
+            retries=cfg.dataplex_retries,
+        )
+
+    def drain_publish_outcomes() -> None:
+        while True:
+            try:
+                fqn, dataplex_result = publish_outcomes.get_nowait()
+            except queue.Empty:
+                return
+
+            timings = {"dataplex_write": dataplex_result.latency_ms}
+            if dataplex_result.success:
+                complete_write(
+                    fqn,
+                    "dataplex",
+                    updates={
+                        "aspect_hash": dataplex_result.content_hash,
+                        "dataplex_skipped": dataplex_result.skipped,
+                    },
+                    timings=timings,
+                )
+            else:
+                complete_write(
+                    fqn,
+                    "dataplex",
+                    error=f"Dataplex failed: {dataplex_result.errors}",
+                    timings=timings,
+                )
+
+    # Descripciones de BigQuery por lotes (ver BatchedSchemaWriter). El flush
+    # corre en un thread aparte para no frenar la admisión: los resultados
+    # llegan por esta cola y se aplican en el dispatcher
+    schema_writer = BatchedSchemaWriter() if cfg.bq_batch_writes else None
+    schema_outcomes = queue.Queue()
+    schema_flush = {"thread": None}
+
+    def run_schema_flush() -> None:
+        flush_start = time.monotonic()
+        try:
+            outcomes = schema_writer.flush()
+        except Exception as exc:
+            # las tablas del lote quedan como escrituras no finalizadas
+            logger.error(f"Flush de descripciones BQ falló: {exc}")
+            return
+        # un flush cubre el lote: el tiempo se reparte entre sus tablas
+        per_table_ms = (time.monotonic() - flush_start) * 1000 / max(len(outcomes), 1)
+        schema_outcomes.put((outcomes, per_table_ms))
+
+    def flush_schema_writes() -> Optional[threading.Thread]:
+        """Lanza un flush si hay cambios y no hay otro en curso; retorna el activo."""
+        thread = schema_flush["thread"]
+        if thread is not None and thread.is_alive():
+            return thread
+        if schema_writer is None or not len(schema_writer):
+            return None
+        # daemon: un flush que no termina antes del deadline no retiene el proceso
+        thread = threading.Thread(
+            target=run_schema_flush, name="bq-schema-flush", daemon=True
+        )
+        schema_flush["thread"] = thread
+        thread.start()
+        return thread
+
+    def drain_schema_outcomes() -> None:
+        while True:
+            try:
+                outcomes, per_table_ms = schema_outcomes.get_nowait()
+            except queue.Empty:
+                return
+            for fqn, exc in outcomes.items():
+                complete_write(
+                    fqn,
+                    "bq",
+                    error=f"BQ update failed: {exc}" if exc else None,
+                    timings={"bq_write": per_table_ms},
+                )
+
+    def finish_schema_writes() -> None:
+        """
+        Flushes restantes hasta el deadline. Lo que no termine queda en
+        awaiting_writes y se registra como escritura no finalizada.
+        """
+        while time.time() < deadline:
+            thread = flush_schema_writes()
+            if thread is None:
+                break
+            thread.join(timeout=max(0.0, deadline - time.time()))
+            drain_schema_outcomes()
+            if thread.is_alive():
+                logger.warning("Flush de descripciones BQ sin terminar al deadline")
+                break
+        drain_schema_outcomes()
+
+    def snapshot_loader(row: dict):
+        if not row.get("has_snapshot"):
+            return None
+        return lambda: parse_snapshot(
+            fetch_snapshot(
+                tracker_client,
+                cfg.tracker_table_fqn,
+                row["catalog"],
+                row["schema"],
+                row["table"],
+            )
+        )
 
-                    if result["estado"] == "OK":
-                        stats["ok"] += 1
-                        logger.info(f"[OK] {fqn}")
-                    else:
-                        stats["error"] += 1
-                        logger.error(f"[ERROR] {fqn} — {result['error']}")
-
-                    # manejo básico de rate limit
-                    if result.get("error_type") == "RATE_LIMIT":
-                        sleep_time = random.uniform(1, 3)
-                        logger.warning(f"[RATE LIMIT] Pausando {sleep_time:.2f}s")
-                        time.sleep(sleep_time)
-
-                    # flush parcial a BigQuery
-                    if len(results) >= BATCH_UPDATE_SIZE:
-                        logger.info("Flushing batch parcial al tracker...")
-                        batch_update_status(
-                            tracker_client,
-                            tracker_table=cfg.tracker_table_fqn,
-                            rows=results,
+    def fan_out_family(fqn: str, result: Optional[dict]) -> None:
+        members = families.pop(fqn, None)
+        if not members:
+            return
+
+        payload = (result or {}).get("payload")
+        if payload is None:
+            # sin payload del representante los miembros vuelven al backlog
+            stats["released"] += len(members)
+            logger.warning(
+                f"[FAMILY] {fqn} sin payload: {len(members)} miembro(s) liberados"
+            )
+            return
+
+        for member in members:
+            member["generated_payload"] = payload_for_member(payload, member)
+            # la familia se agrupó por fingerprint: si el miembro cambió después,
+            # process_table lo regenera por su cuenta
+            member["generated_fingerprint"] = result.get("fingerprint")
+            member["family_rep"] = fqn
+            member["expected_ms"] = 0
+            # adelante de la cola: son escrituras cortas
+            pending.appendleft(member)
+        stats["family_members"] += len(members)
+        logger.info(f"[FAMILY] {fqn} → {len(members)} miembro(s)")
+
+    def handle_result(row: dict, future) -> None:
+        fqn = f"{row['catalog']}.{row['schema']}.{row['table']}"
+
+        try:
+            result = future.result()
+            result.setdefault("stage_ms", {})["queue_wait"] = row["queue_wait_ms"]
+            fan_out_family(fqn, result if result["estado"] == "OK" else None)
+
+            # cortado por deadline: la fila se libera al final para la próxima run
+            if result.get("error_type") == "DEADLINE":
+                histograms.observe_all(result["stage_ms"])
+                stats["released"] += 1
+                logger.warning(f"[DEADLINE] {fqn} — {result['error']}")
+                return
+
+            sinks = set()
+            if result.get("bq_pending"):
+                sinks.add("bq")
+            if result.get("dataplex_pending"):
+                sinks.add("dataplex")
+
+            if result["estado"] == "OK" and sinks:
+                # el estado final llega cuando las escrituras diferidas reporten
+                await_writes(fqn, row, result, sinks)
+            elif result["estado"] == "OK":
+                record_ok(row, result)
+            else:
+                failed = failure_row(row, result["error"], result["error_type"])
+                failed["stage_timings"] = stage_timings(result)
+                failed["llm_usage"] = llm_usage(fqn, result)
+                results.append(failed)
+                stats["error"] += 1
+                logger.error(
+                    f"[{failed['estado']}] {fqn} — {result['error_type']} "
+                    f"(intento {failed['attempts']}) — {result['error']}"
+                )
+
+            # manejo básico de rate limit
+            if result.get("error_type") == "RATE_LIMIT":
+                sleep_time = random.uniform(1, 3)
+                logger.warning(f"[RATE LIMIT] Pausando {sleep_time:.2f}s")
+                time.sleep(sleep_time)
+
+        except Exception as exc:
+            error_msg = str(exc)[:500]
+
+            results.append(failure_row(row, error_msg, classify_error(exc)))
+            fan_out_family(fqn, None)
+
+            stats["error"] += 1
+            logger.error(f"[CRITICAL] {fqn} — {error_msg}")
+
+        finally:
+            if fqn not in awaiting_writes:
+                early_reports.pop(fqn, None)
+
+    # familias shardeadas: solo el representante pasa por perfilado y LLM
+    families = {}
+    if cfg.family_detection and batch_results is None:
+        tables, families = group_families(tables, get_client_cached, cfg.max_workers)
+        for row in tables:
+            members = families.get(f"{row['catalog']}.{row['schema']}.{row['table']}")
+            if members and cfg.family_pool_shards > 0:
+                row["pool_tables"] = [
+                    m["table"] for m in members[: cfg.family_pool_shards]
+                ]
+
+    if batch_results is not None:
+        admitted = []
+        for row in tables:
+            fqn = f"{row['catalog']}.{row['schema']}.{row['table']}"
+            batch_result = batch_results[fqn]
+            if batch_result.payload is None:
+                failed = failure_row(row, batch_result.error, batch_result.error_type)
+                results.append(failed)
+                stats["error"] += 1
+                logger.error(
+                    f"[{failed['estado']}] {fqn} — {batch_result.error_type} "
+                    f"(batch) — {batch_result.error}"
+                )
+                continue
+            # solo quedan escrituras (y la verificación contra el schema
+            # actual): se admiten sin estimación de duración
+            row["generated_payload"] = batch_result.payload
+            row["generated_fingerprint"] = batch_result.fingerprint
+            row["verify_generated"] = True
+            row["expected_ms"] = 0
+            admitted.append(row)
+        tables = admitted
+
+    pending = deque(tables)
+    in_flight = {}
+
+    try:
+        with ThreadPoolExecutor(max_workers=cfg.max_workers) as executor:
+            while pending or in_flight:
+                # admisión: solo se arrancan tablas que terminan antes del deadline
+                while pending and len(in_flight) < cfg.max_workers:
+                    remaining_ms = (deadline - time.time()) * 1000
+                    row = pending.popleft()
+
+                    if row["expected_ms"] > remaining_ms:
+                        # en orden descendente puede caber una tabla más chica
+                        stats["released"] += 1
+                        logger.info(
+                            f"[SKIP] {row['catalog']}.{row['schema']}.{row['table']}"
+                            f" | expected_ms={row['expected_ms']}"
+                            f" > remaining_ms={int(remaining_ms)}"
                         )
-                        results.clear()
-
-                except Exception as exc:
-                    error_msg = str(exc)[:500]
-
-                    results.append(
-                        {
-                            "catalog": row["catalog"],
-                            "schema": row["schema"],
-                            "table": row["table"],
-                            "estado": "ERROR",
-                            "error": error_msg,
-                        }
+                        continue
+
+                    row["queue_wait_ms"] = int((time.monotonic() - claimed_at) * 1000)
+                    future = executor.submit(
+                        process_table,
+                        row["catalog"],
+                        row["schema"],
+                        row["table"],
+                        get_client_cached(row["catalog"]),
+                        deadline=deadline,
+                        checkpoints=checkpoints,
+                        publisher=publisher,
+                        previous_aspect_hash=row.get("aspect_hash"),
+                        schema_writer=schema_writer,
+                        generated_payload=row.get("generated_payload"),
+                        generated_fingerprint=row.get("generated_fingerprint"),
+                        verify_generated=row.get("verify_generated", False),
+                        pool_tables=row.get("pool_tables", ()),
+                        load_snapshot=snapshot_loader(row),
+                        glossary=glossary,
                     )
-
-                    stats["error"] += 1
-                    logger.error(f"[CRITICAL] {fqn} — {error_msg}")
-
-    # flush final
-    if results:
-        logger.info("Flush final al tracker...")
-        batch_update_status(
+                    in_flight[future] = row
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    handle_result(in_flight.pop(future), future)
+                drain_publish_outcomes()
+                drain_schema_outcomes()
+
+                if schema_writer is not None and (
+                    len(schema_writer) >= cfg.bq_write_batch_size
+                ):
+                    flush_schema_writes()
+
+                # flush parcial a BigQuery
+                if len(results) >= BATCH_UPDATE_SIZE:
+                    logger.info("Flushing batch parcial al tracker...")
+                    batch_update_status(
+                        tracker_client,
+                        tracker_table=cfg.tracker_table_fqn,
+                        rows=results,
+                    )
+                    results.clear()
+                    if checkpoints is not None:
+                        checkpoints.flush_completed()
+
+    finally:
+        finish_schema_writes()
+
+        if glossary is not None:
+            glossary.flush()
+
+        if publisher is not None:
+            # las escrituras pendientes aprovechan el resto del tiempo, dejando
+            # parte del margen para flush y release
+            publisher.close(
+                timeout=max(0.0, deadline - time.time()) + cfg.deadline_margin_sec / 3
+            )
+            drain_publish_outcomes()
+
+        for entry in list(awaiting_writes.values()):
+            record_write_failure(
+                entry["row"],
+                entry["result"],
+                entry["errors"] + [f"escrituras no finalizadas: {sorted(entry['sinks'])}"],
+            )
+        awaiting_writes.clear()
+        if early_reports:
+            # outcomes de filas cuyo future nunca se procesó (quedan para release)
+            logger.warning(
+                f"{len(early_reports)} reporte(s) de escritura sin fila registrada"
+            )
+            early_reports.clear()
+
+        # flush final
+        if results:
+            logger.info("Flush final al tracker...")
+            batch_update_status(
+                tracker_client,
+                tracker_table=cfg.tracker_table_fqn,
+                rows=results,
+            )
+        if checkpoints is not None:
+            checkpoints.flush_completed()
+
+        # todo lo que siga en PROCESSING con este job_id vuelve al backlog
+        release_unfinished(
             tracker_client,
             tracker_table=cfg.tracker_table_fqn,
-            rows=results,
+            job_id=job_id,
         )
 
     total = stats["ok"] + stats["error"]
 
     logger.info(
-        f"Job finalizado | ok={stats['ok']} | error={stats['error']} | total={total}"
+        f"Job finalizado | ok={stats['ok']} | error={stats['error']} | "
+        f"quarantined={stats['quarantined']} | released={stats['released']} | "
+        f"dataplex_skipped={stats['dataplex_skipped']} | "
+        f"family_members={stats['family_members']} | "
+        f"glossary_prefilled={stats['glossary_prefilled']} | total={total}"
+    )
+
+    # generaciones pagadas que no sirvieron (JSON ilegible o fuera de contrato)
+    llm = llm_stats()
+    if llm.get("calls"):
+        logger.info(
+            f"LLM | calls={llm.get('calls', 0)} | attempts={llm.get('attempts', 0)} | "
+            f"parse_errors={llm.get('parse_errors', 0)} | "
+            f"validation_failures={llm.get('validation_failures', 0)} | "
+            f"repairs={llm.get('repairs', 0)} | "
+            f"repaired_columns={llm.get('repaired_columns', 0)} | "
+            f"flag_disagreements={llm.get('flag_disagreements', 0)} | "
+            f"output_tokens/attempt="
+            f"{llm.get('output_tokens', 0) // max(llm.get('attempts', 1), 1)}"
+        )
+        logger.info(
+            f"LLM tokens | input={llm.get('input_tokens', 0)} | "
+            f"cached={llm.get('cached_tokens', 0)} | "
+            f"output={llm.get('output_tokens', 0)} | "
+            f"thinking={llm.get('thinking_tokens', 0)} | "
+            f"cost_usd={llm.get('cost_micro_usd', 0) / 1_000_000:.4f}"
+        )
+
+    # tasa de escalamiento sobre las tablas que intentaron el tier rápido
+    fast_attempts = stats["fast_tier"] + stats["escalated"]
+    if fast_attempts:
+        logger.info(
+            f"Model tiering | fast={stats['fast_tier']} | "
+            f"escalated={stats['escalated']} | "
+            f"escalation_rate={stats['escalated'] / fast_attempts:.1%}"
+        )
+
+    if estimate_errors:
+        mape = sum(estimate_errors) / len(estimate_errors)
+        logger.info(
+            f"Estimador de duración | muestras={len(estimate_errors)} | MAPE={mape:.1%}"
+        )
+
+    # resumen estructurado (una línea JSON) para comparar corridas y ajustar
+    # MAX_WORKERS / concurrencia con los percentiles por etapa
+    stage_summary = histograms.summary()
+    for stage, summary in stage_summary.items():
+        logger.info(
+            f"Etapa {stage} | n={summary['count']} | p50={summary['p50']}ms | "
+            f"p95={summary['p95']}ms | p99={summary['p99']}ms | max={summary['max']}ms"
+        )
+    elapsed_sec = time.monotonic() - claimed_at
+    logger.info(
+        "Resumen de task | "
+        + json.dumps(
+            {
+                "job_id": job_id,
+                "task_index": cfg.task_index,
+                "job_mode": cfg.job_mode,
+                "max_workers": cfg.max_workers,
+                "elapsed_sec": round(elapsed_sec, 1),
+                "tables_per_min": round(total / elapsed_sec * 60, 2)
+                if elapsed_sec > 0
+                else None,
+                "stats": stats,
+                "llm": llm,
+                "costliest_tables": [
+                    {"table": fqn, "cost_usd": cost} for cost, fqn in costliest
+                ],
+                "stages": stage_summary,
+            },
+            sort_keys=True,
+        )
     )
 
     if stats["error"] > 0:
@@ -0,0 +1,104 @@
+"""
+Tiempos por etapa del procesamiento de cada tabla.
+
+StageTimer mide una tabla (process_table) y StageHistograms agrega todas las
+tablas de la task para el resumen final (p50/p95/p99 por etapa). Los tiempos
+de cada tabla también quedan en el tracker (columna stage_timings, JSON), de
+modo que MAX_WORKERS y la concurrencia se ajusten con datos de varias corridas.
+
+Etapas:
+- queue_wait        : desde el claim hasta que un worker toma la tabla
+- metadata          : get_table_metadata + fingerprint
+- partition_lookup  : última partición (INFORMATION_SCHEMA.PARTITIONS)
+- profiling         : query de perfilado (sin partition_lookup)
+- prompt            : glosario, flags locales y armado del prompt
+- llm               : generación (incluye reintentos y escalamiento de tier)
+- validation        : validación y reparación dirigida
+- bq_write          : descripciones en BigQuery (por lotes: flush amortizado)
+- dataplex_write    : publicación del aspect en Dataplex
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+STAGES = (
+    "queue_wait",
+    "metadata",
+    "partition_lookup",
+    "profiling",
+    "prompt",
+    "llm",
+    "validation",
+    "bq_write",
+    "dataplex_write",
+)
+
+PERCENTILES = (50, 95, 99)
+
+
+class StageTimer:
+    """Cronómetro de una tabla: acumula ms por etapa."""
+
+    def __init__(self):
+        self.timings: Dict[str, int] = {}
+
+    def add(self, stage: str, ms: float) -> None:
+        self.timings[stage] = self.timings.get(stage, 0) + int(ms)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, (time.monotonic() - start) * 1000)
+
+
+def percentile(sorted_values: List[int], pct: float) -> Optional[int]:
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class StageHistograms:
+    """
+    Muestras por etapa de todas las tablas de la task. Una task procesa a lo
+    sumo unos miles de tablas: se guardan los valores y los percentiles son
+    exactos.
+    """
+
+    def __init__(self):
+        self._samples: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, ms: int) -> None:
+        with self._lock:
+            self._samples.setdefault(stage, []).append(int(ms))
+
+    def observe_all(self, timings: Optional[Dict[str, int]]) -> None:
+        for stage, ms in (timings or {}).items():
+            self.observe(stage, ms)
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        """{etapa: {count, p50, p95, p99, max, total_ms}} en orden de STAGES."""
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+
+        ordered = [s for s in STAGES if s in samples] + sorted(
+            s for s in samples if s not in STAGES
+        )
+        summary = {}
+        for stage in ordered:
+            values = samples[stage]
+            summary[stage] = {
+                "count": len(values),
+                **{f"p{pct}": percentile(values, pct) for pct in PERCENTILES},
+                "max": values[-1],
+                "total_ms": sum(values),
+            }
+        return summary
@@ -1,25 +1,125 @@
 import logging
 import time
+from typing import Callable, Optional, Sequence
 
 from google.cloud import bigquery
 
-from app.adapters.bq_reader import get_table_metadata
+from app.errors import (
+    DeadlineExceededError,
+    MetadataValidationError,
+    TransientError,
+    classify_error,
+)
+
+from app.adapters.bq_reader import (
+    get_table_metadata,
+    iter_schema_paths,
+    schema_fingerprint,
+)
+from app.adapters.bq_writer import BatchedSchemaWriter
 from app.services.profiling import build_profile
-from app.services.prompt_builder import build_prompt
-from app.adapters.vertex_llm import generate_metadata
-from app.validators.metadata_schema import validate_metadata
+from app.services.prompt_builder import build_prompt, prompt_columns
+from app.adapters.llm_usage import LlmUsage
+from app.adapters.vertex_llm import record_llm_event
+from app.services.column_classifier import (
+    LOCAL_FLAGS,
+    classify_columns,
+    reconcile_flags,
+)
+from app.services.metadata_repair import is_repairable, repair_metadata
+from app.services.model_tiering import generate_tiered, tier_of
+from app.services.wire_format import compact_format_for
+from app.validators.metadata_schema import missing_columns, validate_metadata
 from app.services.schema_updater import update_table_metadata
-from app.services.dataplex_writer import upsert_dataplex_aspects
+from app.services.dataplex_writer import DataplexPublisher, upsert_dataplex_aspects
+from job.delta import build_snapshot, known_descriptions, merge_delta, plan_delta
+from job.families import pool_profiles
+from job.glossary import GlossaryStore, merge_prefilled
+from job.metrics import StageTimer
+from job.checkpoints import (
+    BQ_WRITE,
+    DATAPLEX_WRITE,
+    GLOSSARY,
+    LLM_RAW,
+    PROFILE,
+    PROMPT,
+    VALIDATED,
+    CheckpointStore,
+)
 
 logger = logging.getLogger(__name__)
 
 
-class MetadataValidationError(Exception):
-    pass
+def _check_deadline(deadline: Optional[float], stage: str) -> None:
+    if deadline is not None and time.time() >= deadline:
+        raise DeadlineExceededError(f"Deadline alcanzado antes de {stage}")
+
+
+def _verify_generated(
+    payload: dict,
+    table_obj: bigquery.Table,
+    bq_client: bigquery.Client,
+    ckpt,
+    deadline: Optional[float],
+    usage: LlmUsage,
+    timer: StageTimer,
+) -> dict:
+    """
+    Payload de batch prediction: se generó en el prepare sin el clasificador
+    local ni el chequeo de cobertura. Se contrastan los flags y se reparan
+    las columnas faltantes o inválidas, como en el camino online. El perfil
+    solo se calcula si hace falta (flags locales o reparación).
+    """
+    expected_names = [path for path, _ in iter_schema_paths(table_obj.schema)]
+    needs_repair = bool(
+        validate_metadata(payload) or missing_columns(payload, expected_names)
+    )
+    profile = {}
+    if LOCAL_FLAGS or needs_repair:
+        profile = ckpt.get(PROFILE) if ckpt else None
+        if profile is None:
+            _check_deadline(deadline, "profiling")
+            with timer.stage("profiling"):
+                profile = build_profile(table=table_obj, bq_client=bq_client)
+            if ckpt:
+                ckpt.save(PROFILE, profile)
 
+    local_flags = classify_columns(table_obj, profile) if LOCAL_FLAGS else None
+    payload = reconcile_flags(payload, local_flags)
 
-class RateLimitError(Exception):
-    pass
+    with timer.stage("validation"):
+        if needs_repair:
+            payload = repair_metadata(
+                payload, table_obj, profile, deadline=deadline, usage=usage
+            )
+        errors = validate_metadata(payload)
+        if errors:
+            record_llm_event("validation_failures")
+            raise MetadataValidationError(str(errors))
+    return payload
+
+
+def _pooled_profile(
+    profile: dict,
+    catalog: str,
+    schema: str,
+    pool_tables: Sequence[str],
+    bq_client: bigquery.Client,
+    columns: Optional[Sequence[str]] = None,
+) -> dict:
+    others = []
+    for pool_table in pool_tables:
+        try:
+            pool_obj = get_table_metadata(catalog, schema, pool_table, bq_client)
+            others.append(
+                build_profile(table=pool_obj, bq_client=bq_client, columns=columns)
+            )
+        except Exception as exc:
+            # los ejemplos extra son opcionales: el representante sigue solo
+            logger.warning(
+                f"[{catalog}.{schema}.{pool_table}] Perfil de familia omitido: {exc}"
+            )
+    return pool_profiles(profile, others) if others else profile
 
 
 def process_table(
@@ -27,46 +127,293 @@ def process_table(
     schema: str,
     table: str,
     bq_client: bigquery.Client,
+    deadline: Optional[float] = None,
+    checkpoints: Optional[CheckpointStore] = None,
+    publisher: Optional[DataplexPublisher] = None,
+    previous_aspect_hash: Optional[str] = None,
+    schema_writer: Optional[BatchedSchemaWriter] = None,
+    generated_payload: Optional[dict] = None,
+    generated_fingerprint: Optional[str] = None,
+    verify_generated: bool = False,
+    pool_tables: Sequence[str] = (),
+    load_snapshot: Optional[Callable[[], Optional[dict]]] = None,
+    glossary: Optional[GlossaryStore] = None,
 ) -> dict:
     """
     Retorna metadata útil para el tracker:
     - estado
-    - error_type
+    - error_type (DEADLINE si la tabla no alcanzó a terminar)
     - duration_ms
+    - dataplex_pending / fingerprint (si el aspect quedó encolado en publisher)
+    - bq_pending (si las descripciones quedaron en el schema_writer por lotes)
+    - aspect_hash / dataplex_skipped (escritura síncrona de Dataplex)
+    - model_tier / escalated (tier del modelo que generó el payload)
+    - payload (solo OK: el metadata validado, para replicarlo a la familia)
+    - snapshot (solo OK: payload + tipos de columna, base del próximo delta)
+    - glossary_prefilled (columnas completadas desde el glosario sin LLM)
+    - stage_ms (ms por etapa, ver job.metrics; también en errores)
+    - llm_usage (tokens, costo e intentos de LLM de la tabla; también en errores)
+
+    Con checkpoints, cada etapa persiste su salida y un reintento retoma
+    en la primera etapa incompleta.
+
+    generated_payload (ingesta de batch prediction o payload del representante
+    de una familia) ya viene validado: se omiten prompt y LLM. Si
+    generated_fingerprint no coincide con el schema actual, el payload se
+    descarta y la tabla sigue el camino normal. verify_generated (batch)
+    además lo pasa por los flags locales y el chequeo de cobertura.
+    pool_tables: otros shards del mismo dataset cuyos ejemplos se suman al
+    perfil del representante.
+    load_snapshot: lee el snapshot de la última generación OK (solo si hace
+    falta generar); si el schema cambió poco, solo se perfilan y generan las
+    columnas nuevas o cambiadas.
+    glossary: columnas equivalentes ya documentadas en otras tablas se
+    completan sin LLM (confianza alta) o van al prompt como sugerencia.
     """
 
     start_time = time.time()
     table_fqn = f"{catalog}.{schema}.{table}"
+    timer = StageTimer()
+    usage = LlmUsage()
 
     try:
         # 1. Metadata
-        table_obj = get_table_metadata(catalog, schema, table, bq_client)
+        with timer.stage("metadata"):
+            table_obj = get_table_metadata(catalog, schema, table, bq_client)
 
-        # 2. Profiling
-        profile = build_profile(table=table_obj, bq_client=bq_client)
+            fingerprint = schema_fingerprint(table_obj)
+            ckpt = None
+            if checkpoints is not None:
+                ckpt = checkpoints.for_table(table_fqn, fingerprint)
 
-        # 3. Prompt
-        prompt = build_prompt(table=table_obj, profile=profile)
+        escalated = False
+        prefilled = {}
+        payload = generated_payload
+        if payload is not None and generated_fingerprint not in (None, fingerprint):
+            logger.warning(
+                f"[{table_fqn}] El schema cambió desde que se generó el payload: "
+                f"se regenera"
+            )
+            payload = None
+        if payload is not None:
+            if verify_generated:
+                payload = _verify_generated(
+                    payload, table_obj, bq_client, ckpt, deadline, usage, timer
+                )
+            if ckpt:
+                ckpt.save(VALIDATED, payload)
+        elif ckpt:
+            payload = ckpt.get(VALIDATED)
 
-        # 4. LLM
-        payload = generate_metadata(prompt)
+        if payload is None:
+            # Delta: solo columnas nuevas o con tipo distinto al último snapshot
+            previous_snapshot = None
+            if load_snapshot is not None:
+                try:
+                    with timer.stage("metadata"):
+                        previous_snapshot = load_snapshot()
+                except Exception as exc:
+                    # sin snapshot se regenera completo
+                    logger.warning(f"[{table_fqn}] No se pudo leer el snapshot: {exc}")
+            delta = plan_delta(previous_snapshot, table_obj, fingerprint)
+            delta_columns = delta.changed if delta else None
+            # solo columnas eliminadas: sin perfilado, prompt ni LLM
+            drop_only = delta is not None and not delta.changed
+            if delta:
+                logger.info(
+                    f"[{table_fqn}] Delta de schema: {len(delta.changed)} columna(s) "
+                    f"a generar, {len(delta.kept)} conservadas"
+                )
 
-        # 5. Validación
-        errors = validate_metadata(payload)
-        if errors:
-            raise MetadataValidationError(str(errors))
+            # 2. Profiling
+            profile = ckpt.get(PROFILE) if ckpt else None
+            if profile is None and drop_only:
+                profile = {}
+            elif profile is None:
+                _check_deadline(deadline, "profiling")
+                lookup = {}
+                with timer.stage("profiling"):
+                    profile = build_profile(
+                        table=table_obj,
+                        bq_client=bq_client,
+                        columns=delta_columns,
+                        timings=lookup,
+                    )
+                    if pool_tables:
+                        profile = _pooled_profile(
+                            profile,
+                            catalog,
+                            schema,
+                            pool_tables,
+                            bq_client,
+                            delta_columns,
+                        )
+                # el lookup de partición se reporta aparte
+                for stage_name, ms in lookup.items():
+                    timer.add(stage_name, ms)
+                    timer.add("profiling", -ms)
+                if ckpt:
+                    ckpt.save(PROFILE, profile)
 
-        # 6. BigQuery (best-effort)
-        try:
-            update_table_metadata(table_fqn, payload, bq_client)
-        except Exception as exc:
-            logger.warning(f"[{table_fqn}] BQ update failed: {exc}")
+            # 3. Prompt
+            with timer.stage("prompt"):
+                # glosario (se guarda en checkpoint: el glosario puede cambiar
+                # entre reintentos y el prompt/LLM_RAW dependen de esta selección)
+                glossary_match = ckpt.get(GLOSSARY) if ckpt else None
+                if glossary_match is None and glossary is not None:
+                    prefilled, hints = glossary.match(
+                        table_obj, profile, delta_columns
+                    )
+                    glossary_match = {"prefilled": prefilled, "hints": hints}
+                    if ckpt:
+                        ckpt.save(GLOSSARY, glossary_match)
+                prefilled = (glossary_match or {}).get("prefilled") or {}
+                hints = (glossary_match or {}).get("hints") or {}
 
-        # 7. Dataplex (best-effort)
-        try:
-            upsert_dataplex_aspects(payload)
-        except Exception as exc:
-            logger.warning(f"[{table_fqn}] Dataplex failed: {exc}")
+                only_columns = delta_columns
+                known_columns = known_descriptions(delta) if delta else {}
+                if prefilled:
+                    only_columns = [
+                        path
+                        for path in prompt_columns(table_obj, delta_columns)
+                        if path not in prefilled
+                    ]
+                    known_columns.update(
+                        {path: col["description"] for path, col in prefilled.items()}
+                    )
+                    logger.info(
+                        f"[{table_fqn}] Glosario: {len(prefilled)} columna(s) "
+                        f"prellenadas, {len(only_columns)} a generar"
+                    )
+
+                # sensitivity / is_computed: reglas locales sobre nombre y ejemplos
+                local_flags = (
+                    classify_columns(table_obj, profile) if LOCAL_FLAGS else None
+                )
+
+                prompt = ckpt.get(PROMPT) if ckpt else None
+                if prompt is None and not drop_only:
+                    prompt = build_prompt(
+                        table=table_obj,
+                        profile=profile,
+                        only_columns=only_columns,
+                        known_columns=known_columns or None,
+                        suggested_columns=hints,
+                        local_flags=local_flags,
+                    )
+                    if ckpt:
+                        ckpt.save(PROMPT, prompt)
+
+            # 4. LLM (un raw guardado se reutiliza si sus errores son reparables
+            # por columna; si no, se regenera completo). Un delta cubierto por
+            # completo con el glosario no necesita LLM.
+            payload = ckpt.get(LLM_RAW) if ckpt else None
+            if delta and not only_columns:
+                payload = dict(previous_snapshot["payload"], columns=[])
+            elif payload is None or not is_repairable(payload):
+                _check_deadline(deadline, "LLM")
+                with timer.stage("llm"):
+                    llm_result = generate_tiered(
+                        prompt,
+                        table_obj,
+                        deadline=deadline,
+                        wire_format=compact_format_for(
+                            table_obj, only_columns, local_flags
+                        ),
+                        only_columns=only_columns,
+                        usage=usage,
+                    )
+                    payload = llm_result.payload
+                    escalated = llm_result.escalated
+                    if ckpt:
+                        ckpt.save(LLM_RAW, payload)
+
+            # formato completo o raw de checkpoint: los flags del modelo se
+            # contrastan con los locales. Después de insertar las prellenadas:
+            # las entradas del glosario vienen de otras tablas y también pasan
+            # por el clasificador local (un email marcado no sensible en otra
+            # tabla no debe saltarse la regla)
+            if prefilled and isinstance(payload, dict):
+                payload = merge_prefilled(prefilled, payload, table_obj)
+            payload = reconcile_flags(payload, local_flags)
+            if delta:
+                payload = merge_delta(delta, payload, table_obj)
+
+            # 5. Validación, con reparación dirigida de las columnas faltantes,
+            # duplicadas o inválidas
+            with timer.stage("validation"):
+                expected_names = [
+                    path for path, _ in iter_schema_paths(table_obj.schema)
+                ]
+                if validate_metadata(payload) or missing_columns(
+                    payload, expected_names
+                ):
+                    payload = repair_metadata(
+                        payload, table_obj, profile, deadline=deadline, usage=usage
+                    )
+
+                errors = validate_metadata(payload)
+                if errors:
+                    record_llm_event("validation_failures")
+                    raise MetadataValidationError(str(errors))
+                if ckpt:
+                    ckpt.save(VALIDATED, payload)
+
+            # solo lo que generó el LLM (no lo conservado ni lo prellenado)
+            # alimenta el glosario
+            if glossary is not None:
+                reused = set(prefilled) | (set(delta.kept) if delta else set())
+                glossary.observe(
+                    table_obj,
+                    profile,
+                    [col for col in payload["columns"] if col["name"] not in reused],
+                    hints=hints,
+                )
+
+        # Sin checkpoints las escrituras son best-effort (reintentar costaría
+        # perfilado + LLM). Con checkpoints un fallo deja la tabla en ERROR y el
+        # reintento solo repite la escritura pendiente.
+
+        # 6. BigQuery (por lotes si hay schema_writer: el job hace el flush y
+        # el tiempo de bq_write lo imputa al cerrar el lote)
+        bq_pending = False
+        if not (ckpt and ckpt.done(BQ_WRITE)):
+            try:
+                if schema_writer is not None:
+                    bq_pending = schema_writer.add(payload, table_obj, bq_client)
+                else:
+                    with timer.stage("bq_write"):
+                        update_table_metadata(table_fqn, payload, bq_client)
+                if ckpt and not bq_pending:
+                    ckpt.save(BQ_WRITE)
+            except Exception as exc:
+                if ckpt:
+                    raise TransientError(f"BQ update failed: {exc}") from exc
+                logger.warning(f"[{table_fqn}] BQ update failed: {exc}")
+
+        # 7. Dataplex (en segundo plano si hay publisher: el resultado llega
+        # al tracker de forma asíncrona y el worker sigue con otra tabla)
+        dataplex_pending = False
+        aspect_hash = None
+        dataplex_skipped = False
+        if not (ckpt and ckpt.done(DATAPLEX_WRITE)):
+            if publisher is not None:
+                publisher.submit(table_fqn, payload, previous_aspect_hash)
+                dataplex_pending = True
+            else:
+                try:
+                    result = upsert_dataplex_aspects(payload, previous_aspect_hash)
+                    timer.add("dataplex_write", result.latency_ms)
+                    if not result.success:
+                        raise TransientError(f"Dataplex failed: {result.errors}")
+                    aspect_hash = result.content_hash
+                    dataplex_skipped = result.skipped
+                    if ckpt:
+                        ckpt.save(DATAPLEX_WRITE)
+                except Exception as exc:
+                    if ckpt:
+                        raise
+                    logger.warning(f"[{table_fqn}] Dataplex failed: {exc}")
 
         duration = int((time.time() - start_time) * 1000)
 
@@ -75,25 +422,34 @@ def process_table(
             "error": None,
             "error_type": None,
             "duration_ms": duration,
+            "dataplex_pending": dataplex_pending,
+            "bq_pending": bq_pending,
+            "fingerprint": fingerprint,
+            "aspect_hash": aspect_hash,
+            "dataplex_skipped": dataplex_skipped,
+            "model_tier": tier_of(payload),
+            "escalated": escalated,
+            "payload": payload,
+            "snapshot": build_snapshot(table_obj, fingerprint, payload),
+            "glossary_prefilled": len(prefilled),
+            "stage_ms": timer.timings,
+            "llm_usage": usage.summary(),
         }
 
     except Exception as e:
         duration = int((time.time() - start_time) * 1000)
         error_msg = str(e)
 
-        # Clasificación de errores
-        if "429" in error_msg or "ResourceExhausted" in error_msg:
-            error_type = "RATE_LIMIT"
-        elif isinstance(e, MetadataValidationError):
-            error_type = "VALIDATION"
-        else:
-            error_type = "UNKNOWN"
+        # Clasificación de errores (TRANSIENT, RATE_LIMIT, PERMANENT, VALIDATION, DEADLINE)
+        error_type = classify_error(e)
 
-        logger.error(f"[{table_fqn}] Error: {error_msg}")
+        logger.error(f"[{table_fqn}] Error ({error_type}): {error_msg}")
 
         return {
             "estado": "ERROR",
             "error": error_msg[:500],
             "error_type": error_type,
             "duration_ms": duration,
+            "stage_ms": timer.timings,
+            "llm_usage": usage.summary(),
         }
@@ -0,0 +1,83 @@
+"""
+Presupuesto de reintentos y back-off exponencial por tipo de error.
+
+Cada fallo incrementa attempts en el tracker. Mientras quede presupuesto la
+fila vuelve a ERROR con next_eligible_at en el futuro; al agotarlo pasa a
+QUARANTINE y deja de reclamarse hasta que alguien la libere a mano.
+
+TRANSIENT y RATE_LIMIT no tienen presupuesto: dependen de la plataforma (cuota
+de Vertex, caída regional), no de la tabla, y un incidente de horas no debe
+dejar en cuarentena tablas que van a funcionar. Siguen en ERROR con el
+back-off acotado a backoff_max_sec.
+"""
+
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from app.errors import PERMANENT, RATE_LIMIT, TRANSIENT, VALIDATION
+
+# Intentos máximos por tipo; el resto usa max_attempts de JobConfig
+_FIXED_BUDGETS = {
+    # NotFound / permisos: un reintento por si fue un cambio de IAM en curso
+    PERMANENT: 2,
+    # el LLM es estocástico, pero un contrato roto suele repetirse
+    VALIDATION: 3,
+}
+# Nunca van a QUARANTINE: se reintentan indefinidamente con back-off acotado
+_UNBOUNDED = {TRANSIENT, RATE_LIMIT}
+
+
+def next_retry_state(
+    error_type: Optional[str],
+    attempts: int,
+    max_attempts: int,
+    backoff_sec: int,
+    backoff_max_sec: int,
+) -> Tuple[str, Optional[datetime]]:
+    """
+    Retorna (estado, next_eligible_at) para una fila fallida.
+    attempts ya incluye el intento actual.
+    """
+    budget = _FIXED_BUDGETS.get(error_type, max_attempts)
+    if error_type not in _UNBOUNDED and attempts >= min(budget, max_attempts):
+        return "QUARANTINE", None
+
+    # jitter ±20% para no sincronizar reintentos de tablas que fallaron juntas
+    delay = backoff_sec * 2 ** (attempts - 1) * random.uniform(0.8, 1.2)
+    delay = min(delay, backoff_max_sec)
+
+    return "ERROR", datetime.now(timezone.utc) + timedelta(seconds=delay)
+
+
+def failure_row(
+    row: Dict,
+    error_msg: str,
+    error_type: Optional[str],
+    max_attempts: int,
+    backoff_sec: int,
+    backoff_max_sec: int,
+) -> Dict:
+    """
+    Fila del tracker para un fallo: incrementa attempts y aplica el back-off
+    (o la cuarentena si se agotó el presupuesto).
+    """
+    attempts = row.get("attempts", 0) + 1
+    estado, next_eligible_at = next_retry_state(
+        error_type,
+        attempts,
+        max_attempts=max_attempts,
+        backoff_sec=backoff_sec,
+        backoff_max_sec=backoff_max_sec,
+    )
+
+    return {
+        "catalog": row["catalog"],
+        "schema": row["schema"],
+        "table": row["table"],
+        "estado": estado,
+        "error": error_msg,
+        "error_type": error_type,
+        "attempts": attempts,
+        "next_eligible_at": next_eligible_at,
+    }
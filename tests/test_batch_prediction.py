@@ -0,0 +1,114 @@
+import json
+
+from app.errors import TRANSIENT, VALIDATION
+from job.batch_prediction import (
+    build_request_line,
+    load_results,
+    parse_result_line,
+    split_request_key,
+)
+
+FQN = "proj.ds.polizas"
+
+
+def _model_output(table_fqn=FQN, **overrides):
+    data = {
+        "table_fqn": table_fqn,
+        "table_description": {"description": "Pólizas emitidas", "accuracy": 0.9},
+        "columns": [
+            {
+                "name": "num_poliza",
+                "description": "Número de póliza",
+                "accuracy": 0.95,
+                "is_computed": False,
+                "sensitivity": False,
+            }
+        ],
+    }
+    data.update(overrides)
+    return data
+
+
+def _result_line(key=FQN, text=None, status=None, **output):
+    record = {"request": {}}
+    if key is not None:
+        record["key"] = key
+    if status:
+        record["status"] = status
+    else:
+        if text is None:
+            text = json.dumps(_model_output(**output), ensure_ascii=False)
+        record["response"] = {
+            "candidates": [
+                {"content": {"parts": [{"text": text}]}, "finishReason": "STOP"}
+            ]
+        }
+    return json.dumps(record, ensure_ascii=False)
+
+
+def _write(path, lines):
+    path.write_text("".join(f"{line}\n" for line in lines), encoding="utf-8")
+    return str(path)
+
+
+def test_request_key_round_trip():
+    line = json.loads(build_request_line(FQN, "prompt", "fp123"))
+
+    assert split_request_key(line["key"]) == (FQN, "fp123")
+    assert split_request_key(FQN) == (FQN, None)
+
+
+def test_parse_result_line_valid_payload_keeps_key_and_fingerprint():
+    result = parse_result_line(
+        _result_line(key=f"{FQN}|fp123", table_fqn="otro.ds.tabla")
+    )
+
+    assert result.error is None
+    assert result.table_fqn == FQN
+    assert result.fingerprint == "fp123"
+    # la key del request manda sobre lo que devolvió el modelo
+    assert result.payload["table_fqn"] == FQN
+    assert "model" in result.payload and "generated_at" in result.payload
+
+
+def test_parse_result_line_errors():
+    failed = parse_result_line(_result_line(status="INTERNAL"))
+    assert (failed.payload, failed.error_type) == (None, TRANSIENT)
+
+    invalid_json = parse_result_line(_result_line(text="{no es json"))
+    assert invalid_json.error_type == VALIDATION
+
+    bad_contract = parse_result_line(_result_line(columns=[{"name": "x"}]))
+    assert bad_contract.error_type == VALIDATION
+
+
+def test_load_results_from_local_jsonl(tmp_path):
+    uri = _write(
+        tmp_path / "results.jsonl",
+        [
+            _result_line(key=f"{FQN}|fp1", text="{roto"),
+            _result_line(key=f"{FQN}|fp1"),
+            # sin key: la FQN sale del payload
+            _result_line(key=None, table_fqn="proj.ds.siniestros"),
+            _result_line(key="proj.ds.vacia", text=""),
+            "no es json",
+        ],
+    )
+
+    results = load_results(uri)
+
+    assert set(results) == {FQN, "proj.ds.siniestros", "proj.ds.vacia"}
+    # el resultado válido gana sobre el inválido de la misma tabla
+    assert results[FQN].payload is not None
+    assert results[FQN].fingerprint == "fp1"
+    assert results["proj.ds.siniestros"].fingerprint is None
+    assert results["proj.ds.vacia"].error_type == VALIDATION
+
+
+def test_load_results_reads_every_jsonl_under_a_directory(tmp_path):
+    (tmp_path / "prediction-1").mkdir()
+    _write(tmp_path / "prediction-1" / "a.jsonl", [_result_line(key="p.d.a")])
+    _write(tmp_path / "b.jsonl", [_result_line(key="p.d.b")])
+    _write(tmp_path / "ignorado.txt", [_result_line(key="p.d.c")])
+
+    assert set(load_results(str(tmp_path))) == {"p.d.a", "p.d.b"}
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.errors import DEADLINE, PERMANENT, RATE_LIMIT, TRANSIENT, VALIDATION
+from job.retry_policy import failure_row, next_retry_state
+
+BACKOFF = {"max_attempts": 5, "backoff_sec": 900, "backoff_max_sec": 86400}
+
+
+def _state(error_type, attempts):
+    return next_retry_state(error_type, attempts, **BACKOFF)
+
+
+@pytest.mark.parametrize(
+    "error_type, budget",
+    [(PERMANENT, 2), (VALIDATION, 3), (DEADLINE, 5), (None, 5)],
+)
+def test_bounded_types_quarantine_when_budget_is_spent(error_type, budget):
+    for attempts in range(1, budget):
+        assert _state(error_type, attempts)[0] == "ERROR"
+
+    assert _state(error_type, budget) == ("QUARANTINE", None)
+
+
+def test_max_attempts_caps_fixed_budgets():
+    state = next_retry_state(
+        VALIDATION, 1, max_attempts=1, backoff_sec=900, backoff_max_sec=86400
+    )
+    assert state == ("QUARANTINE", None)
+
+
+@pytest.mark.parametrize("error_type", [TRANSIENT, RATE_LIMIT])
+def test_platform_errors_never_quarantine(error_type):
+    for attempts in (1, 5, 6, 50, 1000):
+        estado, next_eligible_at = _state(error_type, attempts)
+        assert estado == "ERROR"
+        assert next_eligible_at is not None
+
+
+@pytest.mark.parametrize("error_type", [TRANSIENT, RATE_LIMIT, PERMANENT])
+def test_backoff_grows_with_jitter(error_type):
+    before = datetime.now(timezone.utc)
+    _, next_eligible_at = _state(error_type, 1)
+    delay = (next_eligible_at - before).total_seconds()
+
+    assert 900 * 0.8 - 1 <= delay <= 900 * 1.2 + 1
+
+
+@pytest.mark.parametrize("error_type", [TRANSIENT, RATE_LIMIT])
+def test_backoff_is_capped(error_type):
+    _, next_eligible_at = _state(error_type, 40)
+
+    assert next_eligible_at <= datetime.now(timezone.utc) + timedelta(seconds=86400)
+
+
+def test_failure_row_increments_attempts():
+    row = {"catalog": "p", "schema": "d", "table": "t", "attempts": 1}
+
+    failed = failure_row(row, "boom", PERMANENT, **BACKOFF)
+
+    assert failed["attempts"] == 2
+    assert failed["estado"] == "QUARANTINE"
+    assert failed["error_type"] == PERMANENT
+
+    rate_limited = failure_row(dict(row, attempts=20), "429", RATE_LIMIT, **BACKOFF)
+    assert rate_limited["estado"] == "ERROR"
+    assert rate_limited["attempts"] == 21